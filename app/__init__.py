@@ -1,3 +1,4 @@
+import sqlalchemy as sa
 from flask import Flask, redirect, url_for, flash
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, current_user, logout_user
@@ -7,6 +8,32 @@ db = SQLAlchemy()
 login_manager = LoginManager()
 login_manager.login_view = "auth.login_get"
 
+def _upgrade_schema():
+    # create_all() only creates missing tables; add columns/indexes introduced later
+    insp = sa.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col.type.compile(dialect=db.engine.dialect)}'
+                default = col.default.arg if col.default is not None and col.default.is_scalar else None
+                if default is not None:
+                    ddl += f" NOT NULL DEFAULT {sa.literal(default).compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})}"
+                conn.execute(sa.text(ddl))
+        for table in db.metadata.sorted_tables:
+            for idx in table.indexes:
+                idx.create(conn, checkfirst=True)
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets the dashboard read while job workers write
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.close()
+
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
@@ -37,6 +64,17 @@ def create_app():
             bal = getattr(current_user, "balance_cents", 0) or 0
         return {"balance_cents": bal}
 
+    # Background services (snapshot refresh, job queue + crash recovery) start on
+    # the first request so the reloader's parent process doesn't run them too
+    @app.before_request
+    def start_background_services():
+        if app.config["SYNC_SCHEDULER_ENABLED"]:
+            from .services.sync_scheduler import start_sync_scheduler
+            start_sync_scheduler(app)
+        if app.config["QUEUE_WORKER_ENABLED"]:
+            from .jobs import start_queue_worker
+            start_queue_worker(app)
+
     # Block banned users everywhere (force logout)
     @app.before_request
     def block_banned():
@@ -47,7 +85,10 @@ def create_app():
 
     with app.app_context():
         from . import models  # noqa
+        if db.engine.dialect.name == "sqlite":
+            sa.event.listen(db.engine, "connect", _sqlite_pragmas)
         db.create_all()
+        _upgrade_schema()
 
         # Seed admin df/df
         from .models import User
@@ -58,4 +99,13 @@ def create_app():
             db.session.add(admin)
             db.session.commit()
 
+        # one-shot: import legacy instance/users/<id>/bms.json into waba_entry
+        from .waba_store import migrate_all_users, reindex_entries
+        migrate_all_users()
+        reindex_entries()
+
+        # one-shot: tag ledger rows by kind and build the OTP daily rollup
+        from .services.otp_stats import backfill_otp_stats
+        backfill_otp_stats()
+
     return app
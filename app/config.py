@@ -4,13 +4,16 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-change-me")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///app.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite: wait for the write lock instead of failing when workers commit concurrently
+    SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"timeout": 30}} if SQLALCHEMY_DATABASE_URI.startswith("sqlite") else {}
 
     # SMS24H
     SMS24H_API_KEY = os.getenv("SMS24H_API_KEY", "0a8b463bee4645a9cfccb45cde49472b")
-    SMS24H_BASE_URL = "https://api.sms24h.org/stubs/handler_api"
+    SMS24H_BASE_URL = os.getenv("SMS24H_BASE_URL", "https://api.sms24h.org/stubs/handler_api")
 
-    # META
+    # META (base URL is overridable for the bench/ stand-in servers)
     META_API_VERSION = os.getenv("META_API_VERSION", "v18.0")
+    META_GRAPH_BASE_URL = os.getenv("META_GRAPH_BASE_URL", "https://graph.facebook.com").rstrip("/")
 
     # Flow defaults (same as your script)
     SERVICE = "wa"
@@ -23,9 +26,115 @@ class Config:
     TEMPO_MAX_ESPERA_OTP = int(os.getenv("TEMPO_MAX_ESPERA_OTP", "120"))
     OTP_LOCK_HOURS = int(os.getenv("OTP_LOCK_HOURS", "3"))
 
+    # OTP poller: per-activation check interval backs off from MIN to MAX seconds
+    OTP_POLL_MIN_INTERVAL = float(os.getenv("OTP_POLL_MIN_INTERVAL", "2"))
+    OTP_POLL_MAX_INTERVAL = float(os.getenv("OTP_POLL_MAX_INTERVAL", "12"))
+    OTP_POLL_WORKERS = int(os.getenv("OTP_POLL_WORKERS", "8"))
+
+    # Warm pool of pre-bought SMS24h numbers for add-phone attempts (0 = off).
+    # NUMBER_POOL_MAX_AGE must stay below the SMS24h activation lifetime (~20 min).
+    NUMBER_POOL_SIZE = int(os.getenv("NUMBER_POOL_SIZE", "0"))
+    NUMBER_POOL_MAX_AGE = float(os.getenv("NUMBER_POOL_MAX_AGE", "600"))
+    NUMBER_POOL_IDLE_SECONDS = float(os.getenv("NUMBER_POOL_IDLE_SECONDS", "60"))
+
+    # Job queue: WABAs processed in parallel per job, and across all jobs of one user
+    JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "5"))
+    USER_JOB_CONCURRENCY = int(os.getenv("USER_JOB_CONCURRENCY", "10"))
+    # Set to 0 on web processes when jobs run in separate `python worker.py` processes;
+    # the web tier then only enqueues and reads status.
+    QUEUE_WORKER_ENABLED = os.getenv("QUEUE_WORKER_ENABLED", "1") == "1"
+    QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", "20"))  # worker threads in this process
+    QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "2"))
+    JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "180"))
+    JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+    JOB_MAX_ITEM_ATTEMPTS = int(os.getenv("JOB_MAX_ITEM_ATTEMPTS", "3"))
+    # add-phone preflight: Graph token lookups run in parallel (one per token)
+    PREFLIGHT_CONCURRENCY = int(os.getenv("PREFLIGHT_CONCURRENCY", "8"))
+    # progress text (last_message) is buffered and written to the Job row at most this often
+    JOB_PROGRESS_FLUSH_INTERVAL = float(os.getenv("JOB_PROGRESS_FLUSH_INTERVAL", "2"))
+    # balance holds older than this whose job item is no longer running are released
+    BALANCE_HOLD_TTL = int(os.getenv("BALANCE_HOLD_TTL", "3600"))
+
+    # Add-phone engine: "threads" (one worker thread per in-flight WABA) or
+    # "async" (asyncio + httpx on one event loop; needs httpx installed)
+    ADD_PHONE_ENGINE = os.getenv("ADD_PHONE_ENGINE", "threads")
+    ASYNC_MAX_IN_FLIGHT = int(os.getenv("ASYNC_MAX_IN_FLIGHT", "500"))
+    ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "200"))
+    ASYNC_BLOCKING_THREADS = int(os.getenv("ASYNC_BLOCKING_THREADS", "16"))
+
     # Cost: R$8 per OTP received
     OTP_COST_CENTS = int(os.getenv("OTP_COST_CENTS", "800"))
 
     # Proxies (optional)
     # format: ip:port:user:pass separated by commas
     PROXIES_RAW = [p.strip() for p in os.getenv("PROXIES_RAW", "").split(",") if p.strip()]
+    # Proxy health: quarantine after N consecutive failures, re-probe quarantined ones
+    PROXY_QUARANTINE_FAILURES = int(os.getenv("PROXY_QUARANTINE_FAILURES", "3"))
+    PROXY_QUARANTINE_SECONDS = float(os.getenv("PROXY_QUARANTINE_SECONDS", "120"))
+    PROXY_PROBE_INTERVAL = float(os.getenv("PROXY_PROBE_INTERVAL", "60"))
+    PROXY_PROBE_URL = os.getenv("PROXY_PROBE_URL", "https://graph.facebook.com/")
+
+    # Meta sync: WABAs fetched in parallel per /sync
+    SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "8"))
+
+    # Bulk WABA import (/wabas/import) upload limit
+    IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+    # Flask caps every request body at this, chunked uploads included (the
+    # import is the largest one)
+    MAX_CONTENT_LENGTH = IMPORT_MAX_BYTES
+
+    # Background sync scheduler: re-sync each WABA once its age exceeds the
+    # interval for its status_label, within a global Graph request budget.
+    # Every process may enable it: one of them holds a DB lease and runs the
+    # staleness scan, the others only sync what their own users asked for.
+    # The budget is in Graph requests; each WABA is charged SYNC_REQUESTS_PER_WABA
+    # (one expanded call, plus extra pages or the 3-read fallback now and then).
+    SYNC_SCHEDULER_ENABLED = os.getenv("SYNC_SCHEDULER_ENABLED", "1") == "1"
+    SYNC_SCHEDULER_TICK = int(os.getenv("SYNC_SCHEDULER_TICK", "30"))
+    SYNC_INTERVAL_OK = int(os.getenv("SYNC_INTERVAL_OK", "900"))
+    SYNC_INTERVAL_ERROR = int(os.getenv("SYNC_INTERVAL_ERROR", "300"))
+    SYNC_INTERVAL_BLOCKED = int(os.getenv("SYNC_INTERVAL_BLOCKED", "3600"))
+    SYNC_BUDGET_PER_MIN = int(os.getenv("SYNC_BUDGET_PER_MIN", "240"))
+    SYNC_REQUESTS_PER_WABA = int(os.getenv("SYNC_REQUESTS_PER_WABA", "2"))
+
+    # Shared HTTP sessions (one per proxy)
+    HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+    HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "50"))
+    HTTP_CONNECT_RETRIES = int(os.getenv("HTTP_CONNECT_RETRIES", "2"))
+
+    # Client-side rate limits (requests/s and burst) and circuit breakers for
+    # outbound calls; buckets per upstream host, per Graph token and per proxy
+    THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "1") == "1"
+    THROTTLE_MAX_WAIT = float(os.getenv("THROTTLE_MAX_WAIT", "30"))
+    GRAPH_RATE_PER_SEC = float(os.getenv("GRAPH_RATE_PER_SEC", "50"))
+    GRAPH_BURST = float(os.getenv("GRAPH_BURST", "100"))
+    GRAPH_TOKEN_RATE_PER_SEC = float(os.getenv("GRAPH_TOKEN_RATE_PER_SEC", "5"))
+    GRAPH_TOKEN_BURST = float(os.getenv("GRAPH_TOKEN_BURST", "20"))
+    SMS24H_RATE_PER_SEC = float(os.getenv("SMS24H_RATE_PER_SEC", "10"))
+    SMS24H_BURST = float(os.getenv("SMS24H_BURST", "20"))
+    # cancels (refunds) never queue behind getNumber/getStatus
+    SMS24H_REFUND_RATE_PER_SEC = float(os.getenv("SMS24H_REFUND_RATE_PER_SEC", "10"))
+    SMS24H_REFUND_BURST = float(os.getenv("SMS24H_REFUND_BURST", "50"))
+    PROXY_RATE_PER_SEC = float(os.getenv("PROXY_RATE_PER_SEC", "20"))
+    PROXY_BURST = float(os.getenv("PROXY_BURST", "40"))
+    BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+    BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+    BREAKER_MAX_COOLDOWN = float(os.getenv("BREAKER_MAX_COOLDOWN", "600"))
+
+    # /admin/metrics: admins, or scrapers sending "Authorization: Bearer <METRICS_TOKEN>"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+    # Read-through cache for Graph reads (seconds; 0 disables a resource).
+    # Errors are cached for GRAPH_CACHE_TTL_ERROR; bounded by entries and bytes
+    GRAPH_CACHE_TTL_INFO = float(os.getenv("GRAPH_CACHE_TTL_INFO", "3600"))
+    GRAPH_CACHE_TTL_PHONES = float(os.getenv("GRAPH_CACHE_TTL_PHONES", "300"))
+    GRAPH_CACHE_TTL_TEMPLATES = float(os.getenv("GRAPH_CACHE_TTL_TEMPLATES", "300"))
+    GRAPH_CACHE_TTL_OVERVIEW = float(os.getenv("GRAPH_CACHE_TTL_OVERVIEW", "300"))  # sync's name+phones+templates call
+    GRAPH_CACHE_TTL_ERROR = float(os.getenv("GRAPH_CACHE_TTL_ERROR", "60"))
+    GRAPH_CACHE_MAX_ENTRIES = int(os.getenv("GRAPH_CACHE_MAX_ENTRIES", "20000"))
+    GRAPH_CACHE_MAX_BYTES = int(os.getenv("GRAPH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+    # Graph edge pagination (page size per edge, hard cap on pages followed)
+    GRAPH_TEMPLATES_PAGE_LIMIT = int(os.getenv("GRAPH_TEMPLATES_PAGE_LIMIT", "250"))
+    GRAPH_PHONES_PAGE_LIMIT = int(os.getenv("GRAPH_PHONES_PAGE_LIMIT", "100"))
+    GRAPH_MAX_PAGES = int(os.getenv("GRAPH_MAX_PAGES", "200"))
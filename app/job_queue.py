@@ -0,0 +1,176 @@
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+import sqlalchemy as sa
+from . import db
+from .models import Job, JobItem
+from .services.pubsub import publish_job
+
+# DB-backed work queue: one JobItem per WABA. Every state change is a
+# conditional UPDATE, so any number of worker threads/processes can share it.
+
+OPEN_STATUSES = ("queued", "running")
+
+def enqueue_job(user_id: int, job_type: str, waba_ids: list[str]) -> int:
+    job = Job(user_id=user_id, type=job_type, status="queued", total=len(waba_ids), done=0, failed=0)
+    db.session.add(job)
+    db.session.flush()
+    if waba_ids:
+        db.session.execute(db.insert(JobItem), [
+            {"job_id": job.id, "user_id": user_id, "waba_id": str(w)} for w in waba_ids
+        ])
+    db.session.commit()
+    return job.id
+
+def lease_next(owner: str, lease_seconds: int, job_limit: int, user_limit: int) -> JobItem | None:
+    """
+    Claims the oldest queued item whose job and user are below their concurrency
+    limits. The limits are soft: two workers racing may overshoot by one.
+    """
+    now = int(time.time())
+    live = sa.and_(JobItem.status == "running", JobItem.lease_expires_at >= now)
+    busy_jobs = sa.select(JobItem.job_id).where(live).group_by(JobItem.job_id).having(sa.func.count() >= job_limit)
+    busy_users = sa.select(JobItem.user_id).where(live).group_by(JobItem.user_id).having(sa.func.count() >= user_limit)
+
+    candidates = db.session.scalars(
+        sa.select(JobItem.id)
+        .where(JobItem.status == "queued", JobItem.job_id.not_in(busy_jobs), JobItem.user_id.not_in(busy_users))
+        .order_by(JobItem.id.asc())
+        .limit(5)
+    ).all()
+
+    for item_id in candidates:
+        res = db.session.execute(
+            sa.update(JobItem)
+            .where(JobItem.id == item_id, JobItem.status == "queued")
+            .values(status="running", lease_owner=owner, lease_expires_at=now + lease_seconds,
+                    heartbeat_at=now, attempts=JobItem.attempts + 1)
+        )
+        if res.rowcount != 1:
+            continue  # another worker won it
+        item = db.session.get(JobItem, item_id)
+        db.session.execute(
+            sa.update(Job)
+            .where(Job.id == item.job_id)
+            .values(
+                current_label=item.waba_id,
+                status=sa.case((Job.status == "queued", "running"), else_=Job.status),
+            )
+        )
+        db.session.commit()
+        publish_job(item.job_id, status="running", current_label=item.waba_id)
+        return item
+
+    db.session.commit()
+    return None
+
+def heartbeat(owner: str, item_ids: list[int], lease_seconds: int) -> None:
+    if not item_ids:
+        return
+    now = int(time.time())
+    db.session.execute(
+        sa.update(JobItem)
+        .where(JobItem.id.in_(item_ids), JobItem.lease_owner == owner, JobItem.status == "running")
+        .values(lease_expires_at=now + lease_seconds, heartbeat_at=now)
+    )
+    db.session.commit()
+
+def _count_result(job_id: int, waba_id: str, ok: bool) -> None:
+    values = {Job.done: Job.done + 1}
+    if not ok:
+        values[Job.failed] = Job.failed + 1
+        values[Job.last_message] = f"Falhou em {waba_id} (veja o log do job)"
+    Job.query.filter_by(id=job_id).update(values, synchronize_session=False)
+
+def _progress(job_id: int) -> dict:
+    row = db.session.execute(
+        sa.select(Job.status, Job.done, Job.failed, Job.last_message).where(Job.id == job_id)
+    ).first()
+    return dict(row._mapping) if row is not None else {}
+
+def _finalize_if_complete(job_id: int) -> bool:
+    open_items = JobItem.query.filter(JobItem.job_id == job_id, JobItem.status.in_(OPEN_STATUSES)).count()
+    if open_items:
+        return False
+    failed = db.session.scalar(sa.select(Job.failed).where(Job.id == job_id)) or 0
+    res = db.session.execute(
+        sa.update(Job)
+        .where(Job.id == job_id, Job.status.in_(OPEN_STATUSES))
+        .values(
+            status="done" if failed == 0 else "done_with_errors",
+            last_message="Finalizado." if failed == 0 else f"Finalizado com erros ({failed}).",
+        )
+    )
+    return res.rowcount == 1
+
+def complete(item_id: int, owner: str, ok: bool) -> bool:
+    """Marks a leased item done/failed and updates the job. Returns True if that finished the job."""
+    item = db.session.get(JobItem, item_id)
+    if item is None:
+        return False
+    res = db.session.execute(
+        sa.update(JobItem)
+        .where(JobItem.id == item_id, JobItem.status == "running", JobItem.lease_owner == owner)
+        .values(status="done" if ok else "failed", lease_owner="", lease_expires_at=0)
+    )
+    if res.rowcount != 1:
+        # lease was lost (recovered elsewhere); whoever holds it now reports the result
+        db.session.commit()
+        return False
+    _count_result(item.job_id, item.waba_id, ok)
+    finished = _finalize_if_complete(item.job_id)
+    progress = _progress(item.job_id)
+    db.session.commit()
+    publish_job(item.job_id, **progress)
+    return finished
+
+def recover(max_attempts: int, on_abandon: Callable[[JobItem], None], grace_seconds: int = 0) -> dict:
+    """
+    Crash recovery. Items whose lease expired (worker died / deploy) go back to
+    the queue so the flow can resume them; after max_attempts they are failed and
+    handed to on_abandon (which cancels any bought SMS24h number). Jobs left
+    "running" with nothing open are finalized; an open job without items is
+    only closed once it is older than grace_seconds.
+    """
+    now = int(time.time())
+    counts = {"requeued": 0, "abandoned": 0, "jobs_closed": 0}
+
+    expired = JobItem.query.filter(JobItem.status == "running", JobItem.lease_expires_at < now).all()
+    for item in expired:
+        give_up = item.attempts >= max_attempts
+        res = db.session.execute(
+            sa.update(JobItem)
+            .where(JobItem.id == item.id, JobItem.status == "running", JobItem.lease_expires_at < now)
+            .values(status="failed" if give_up else "queued", lease_owner="", lease_expires_at=0)
+        )
+        if res.rowcount != 1:
+            continue
+        if give_up:
+            _count_result(item.job_id, item.waba_id, False)
+            _finalize_if_complete(item.job_id)
+            progress = _progress(item.job_id)
+            db.session.commit()
+            publish_job(item.job_id, **progress)
+            on_abandon(item)
+            counts["abandoned"] += 1
+        else:
+            counts["requeued"] += 1
+        db.session.commit()
+
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    stuck = Job.query.filter(Job.status.in_(OPEN_STATUSES)).all()
+    for job in stuck:
+        if JobItem.query.filter_by(job_id=job.id).first() is None:
+            if job.created_at > cutoff:
+                continue  # may still be getting its items
+            # job from before the queue existed: its thread died with the process
+            job.status = "error"
+            job.last_message = "Interrompido (servidor reiniciado)."
+            counts["jobs_closed"] += 1
+        elif _finalize_if_complete(job.id):
+            counts["jobs_closed"] += 1
+    db.session.commit()
+    return counts
+
+def queue_depth() -> int:
+    return JobItem.query.filter_by(status="queued").count()
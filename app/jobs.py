@@ -1,59 +1,209 @@
+import os
+import asyncio
+import time
+import uuid
+import socket
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
 from . import db
-from .models import Job
+from .models import JobItem
+from .job_queue import enqueue_job, lease_next, heartbeat, complete, recover
+from .waba_store import get_entry, update_entry
 from .services.waba_flow import process_one_waba_add_phone
+from .services.waba_flow_async import process_one_waba_add_phone_async
+from .services.async_engine import get_async_engine
+from .services import async_http
+from .services.event_log import get_event_log
+from .services.job_progress import get_job_progress
+from .services.sms24h import sms24h_cancel
+from .services import ledger
+from .services import metrics
 
-def start_add_phone_job(user_id: int, waba_ids: list[str]) -> int:
-    job = Job(
-        user_id=user_id,
-        type="add_phone",
-        status="queued",
-        total=len(waba_ids),
-        done=0
-    )
-    # optional fields if your Job model has them; harmless if not
-    if hasattr(job, "failed"):
-        job.failed = 0
-
-    db.session.add(job)
-    db.session.commit()
-
-    job_id = job.id
-
-    def runner(app):
-        with app.app_context():
-            job = db.session.get(Job, job_id)
-            if not job:
+class QueueWorker:
+    """
+    Pulls JobItems from the database and runs them on a local thread pool.
+    One dispatcher thread leases work, heartbeats every in-flight item and
+    periodically runs the crash-recovery pass. With ADD_PHONE_ENGINE=async the
+    items run as coroutines on the async engine instead of the thread pool.
+    """
+
+    def __init__(self, app, workers: int | None = None):
+        cfg = app.config
+        self.app = app
+        self.engine = None
+        if cfg["ADD_PHONE_ENGINE"] == "async":
+            if async_http.available():
+                self.engine = get_async_engine(int(cfg["ASYNC_HTTP_MAX_CONNECTIONS"]), int(cfg["ASYNC_BLOCKING_THREADS"]))
+            else:
+                app.logger.warning("ADD_PHONE_ENGINE=async needs httpx; falling back to threads")
+        if self.engine is not None:
+            self.workers = max(1, int(workers or cfg["ASYNC_MAX_IN_FLIGHT"]))
+        else:
+            self.workers = max(1, int(workers or cfg["QUEUE_WORKERS"]))
+        self.lease_seconds = int(cfg["JOB_LEASE_SECONDS"])
+        self.heartbeat_seconds = int(cfg["JOB_HEARTBEAT_SECONDS"])
+        self.poll_interval = float(cfg["QUEUE_POLL_INTERVAL"])
+        self.job_limit = int(cfg["JOB_CONCURRENCY"])
+        self.user_limit = int(cfg["USER_JOB_CONCURRENCY"])
+        self.max_attempts = int(cfg["JOB_MAX_ITEM_ATTEMPTS"])
+        self.hold_ttl = int(cfg["BALANCE_HOLD_TTL"])
+
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._pool = None
+        if self.engine is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+        self._in_flight: set[int] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="queue-dispatcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout: float = 60.0) -> int:
+        """
+        Stops leasing new items and waits up to `timeout` for the in-flight ones.
+        Returns how many were still running; their leases expire and another
+        worker resumes them.
+        """
+        self._stopping.set()
+        self._wake.set()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._in_flight:
+                    break
+            time.sleep(0.5)
+        with self._lock:
+            left = len(self._in_flight)
+        if self._pool is not None and not left:
+            self._pool.shutdown(wait=False)
+        with self.app.app_context():
+            get_event_log(self.app).flush()
+        get_job_progress(self.app).flush()
+        return left
+
+    def _loop(self):
+        last_recover = 0.0
+        last_beat = time.monotonic()
+        while True:
+            try:
+                with self.app.app_context():
+                    now = time.monotonic()
+                    if now - last_recover >= self.lease_seconds / 2:
+                        recover(self.max_attempts, _abandon_item, grace_seconds=self.lease_seconds)
+                        ledger.release_stale_holds(self.hold_ttl)
+                        last_recover = now
+                    if now - last_beat >= self.heartbeat_seconds:
+                        with self._lock:
+                            ids = list(self._in_flight)
+                        heartbeat(self.owner, ids, self.lease_seconds)
+                        last_beat = now
+                    self._dispatch()
+            except Exception:
+                self.app.logger.exception("queue dispatcher iteration failed")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _dispatch(self):
+        if self._stopping.is_set():
+            return
+        while self._slots.acquire(blocking=False):
+            item = lease_next(self.owner, self.lease_seconds, self.job_limit, self.user_limit)
+            if item is None:
+                self._slots.release()
                 return
+            with self._lock:
+                self._in_flight.add(item.id)
+            if self.engine is not None:
+                self.engine.submit(self._run_async(item.id, item.job_id, item.user_id, item.waba_id))
+            else:
+                self._pool.submit(self._run, item.id, item.job_id, item.user_id, item.waba_id)
 
-            job.status = "running"
-            db.session.commit()
+    def _run(self, item_id: int, job_id: int, user_id: int, waba_id: str):
+        try:
+            # own app context -> own DB session per worker
+            with self.app.app_context(), metrics.track_flow() as run:
+                try:
+                    ok = process_one_waba_add_phone(user_id=user_id, waba_id=waba_id, job_id=job_id)
+                except Exception:
+                    db.session.rollback()
+                    ok = False
+                run.ok = ok
+            self._complete(item_id, ok)
+        except Exception:
+            self.app.logger.exception("job item %s failed to complete", item_id)
+        finally:
+            self._release(item_id)
 
-            failed = 0
+    async def _run_async(self, item_id: int, job_id: int, user_id: int, waba_id: str):
+        try:
+            with metrics.track_flow() as run:
+                try:
+                    ok = await process_one_waba_add_phone_async(self.app, self.engine.http, user_id, waba_id, job_id)
+                except Exception:
+                    ok = False
+                run.ok = ok
+            await asyncio.to_thread(self._complete, item_id, ok)
+        except Exception:
+            self.app.logger.exception("job item %s failed to complete", item_id)
+        finally:
+            self._release(item_id)
 
-            for idx, waba_id in enumerate(waba_ids, start=1):
-                job.current_label = str(waba_id)
-                job.last_message = f"Processando {idx}/{len(waba_ids)}"
-                db.session.commit()
+    def _complete(self, item_id: int, ok: bool):
+        with self.app.app_context():
+            get_event_log(self.app).flush()
+            complete(item_id, self.owner, ok)
 
-                ok = process_one_waba_add_phone(user_id=user_id, waba_id=str(waba_id), job_id=job_id)
-                if not ok:
-                    failed += 1
-                    # keep job running, but record it
-                    job.last_message = f"Falhou em {waba_id} (veja logs/last_error no bms.json)"
-                    db.session.commit()
+    def _release(self, item_id: int):
+        with self._lock:
+            self._in_flight.discard(item_id)
+        self._slots.release()
+        self._wake.set()
 
-                job.done = idx
-                if hasattr(job, "failed"):
-                    job.failed = failed
-                db.session.commit()
+def _abandon_item(item: JobItem) -> None:
+    # Item gave up after repeated crashes: refund the number it may have bought
+    # and the balance held for it.
+    entry = get_entry(item.user_id, item.waba_id) or {}
+    activation_id = str(entry.get("sms24h_activation_id") or "")
+    if not activation_id or entry.get("otp_received"):
+        return
+    # like the flow's _cancel_number: the hold goes back even if the cancel fails
+    try:
+        sms24h_cancel(current_app.config["SMS24H_API_KEY"], current_app.config["SMS24H_BASE_URL"], activation_id, None)
+    except Exception:
+        current_app.logger.exception("recovery: cancel of activation %s failed", activation_id)
+    finally:
+        ledger.release(int(entry.get("balance_hold_id") or 0) or None)
+        update_entry(item.user_id, item.waba_id, {
+            "pending_phone_number_id": "",
+            "sms24h_activation_id": "",
+            "sms24h_full_phone": "",
+            "balance_hold_id": 0,
+            "last_add_phone_error": "Interrompido (servidor reiniciado); número cancelado.",
+        })
 
-            job.status = "done" if failed == 0 else "done_with_errors"
-            job.last_message = "Finalizado." if failed == 0 else f"Finalizado com erros ({failed})."
-            db.session.commit()
+_worker: QueueWorker | None = None
+_worker_lock = threading.Lock()
 
-    t = threading.Thread(target=runner, args=(current_app._get_current_object(),), daemon=True)
-    t.start()
+def start_queue_worker(app, workers: int | None = None) -> QueueWorker:
+    global _worker
+    if _worker is not None:
+        return _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = QueueWorker(app, workers)
+            _worker.start()
+        return _worker
 
+def start_add_phone_job(user_id: int, waba_ids: list[str]) -> int:
+    job_id = enqueue_job(user_id, "add_phone", [str(w) for w in waba_ids])
+    if current_app.config["QUEUE_WORKER_ENABLED"]:
+        start_queue_worker(current_app._get_current_object()).notify()
     return job_id
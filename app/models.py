@@ -47,17 +47,46 @@ class Waba(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
 class BalanceTx(db.Model):
+    __table_args__ = (
+        db.Index("ix_balance_tx_user_kind_created", "user_id", "kind", "created_at"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
 
     amount_cents = db.Column(db.Integer, nullable=False)  # negative = debit
     reason = db.Column(db.String(255), nullable=False)
+    kind = db.Column(db.String(16), default="", nullable=False)  # otp/admin_add/admin_remove
 
     waba_id = db.Column(db.String(64), default="", nullable=False)
     phone_number_id = db.Column(db.String(64), default="", nullable=False)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+class BalanceHold(db.Model):
+    """Funds set aside for one add-phone attempt: captured when the OTP arrives, released on cancel."""
+    __table_args__ = (
+        db.Index("ix_balance_hold_status_created", "status", "created_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+
+    amount_cents = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), default="held", nullable=False)  # held/captured/released
+
+    job_id = db.Column(db.Integer, default=0, nullable=False)
+    waba_id = db.Column(db.String(64), default="", nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    closed_at = db.Column(db.DateTime, nullable=True)
+
+class OtpDailyStat(db.Model):
+    """OTPs debited per user per UTC day; maintained by _debit_otp, read by the admin page."""
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
 class Job(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
@@ -67,8 +96,91 @@ class Job(db.Model):
 
     total = db.Column(db.Integer, default=0, nullable=False)
     done = db.Column(db.Integer, default=0, nullable=False)
+    failed = db.Column(db.Integer, default=0, nullable=False)
 
     current_label = db.Column(db.String(255), default="", nullable=False)
     last_message = db.Column(db.Text, default="", nullable=False)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class ServiceLease(db.Model):
+    """Single-owner background services (e.g. the sync scheduler) across processes: the owner renews expires_at."""
+    name = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(128), default="", nullable=False)
+    expires_at = db.Column(db.Integer, default=0, nullable=False)  # epoch seconds
+
+class DataMigration(db.Model):
+    """One-shot startup backfills that already ran (by name), so create_app skips them."""
+    name = db.Column(db.String(64), primary_key=True)
+    done_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class WabaEntry(db.Model):
+    """One bms.json entry per row. `data` is the entry JSON; the other columns are indexed copies."""
+    __tablename__ = "waba_entry"
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "key", name="uq_waba_entry_user_key"),
+        db.Index("ix_waba_entry_user_waba", "user_id", "waba_id"),
+        # dashboard sort orders (keyset pagination on (column, id))
+        db.Index("ix_waba_entry_user_sync", "user_id", "last_sync_at", "id"),
+        db.Index("ix_waba_entry_user_status", "user_id", "status_label", "id"),
+        db.Index("ix_waba_entry_user_approved", "user_id", "tpl_approved", "id"),
+        db.Index("ix_waba_entry_user_paused", "user_id", "tpl_paused", "id"),
+        db.Index("ix_waba_entry_user_disabled", "user_id", "tpl_disabled", "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+
+    key = db.Column(db.String(128), nullable=False)  # original bms.json key
+    waba_id = db.Column(db.String(64), nullable=False)
+    phone_number_id = db.Column(db.String(64), default="", nullable=False, index=True)
+
+    status_label = db.Column(db.String(32), default="", nullable=False)
+    last_sync_at = db.Column(db.Integer, default=0, nullable=False, index=True)
+    tpl_approved = db.Column(db.Integer, default=0, nullable=False)
+    tpl_paused = db.Column(db.Integer, default=0, nullable=False)
+    tpl_disabled = db.Column(db.Integer, default=0, nullable=False)
+    has_phone = db.Column(db.Boolean, default=False, nullable=False)
+    error_text = db.Column(db.String(1000), default="", nullable=False)  # sync + add-phone errors
+    index_version = db.Column(db.Integer, default=0, nullable=False)  # see waba_store.INDEX_VERSION
+
+    data = db.Column(db.Text, default="{}", nullable=False)
+    version = db.Column(db.Integer, default=0, nullable=False)  # optimistic concurrency
+
+class JobEvent(db.Model):
+    """Append-only add-phone log: one row per step, written in batches by services.event_log."""
+    __table_args__ = (
+        db.Index("ix_job_event_job_waba", "job_id", "waba_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    waba_id = db.Column(db.String(64), default="", nullable=False)
+
+    step = db.Column(db.String(64), default="", nullable=False)
+    http_status = db.Column(db.Integer, nullable=True)
+    latency_ms = db.Column(db.Integer, nullable=True)
+    message = db.Column(db.Text, default="", nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class JobItem(db.Model):
+    """One WABA of a job. Workers lease items (lease_owner/lease_expires_at) and heartbeat while working."""
+    __table_args__ = (
+        db.Index("ix_job_item_status_lease", "status", "lease_expires_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey("job.id"), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    waba_id = db.Column(db.String(64), nullable=False)
+
+    status = db.Column(db.String(16), default="queued", nullable=False)  # queued/running/done/failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+
+    lease_owner = db.Column(db.String(128), default="", nullable=False)
+    lease_expires_at = db.Column(db.Integer, default=0, nullable=False)  # epoch seconds
+    heartbeat_at = db.Column(db.Integer, default=0, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
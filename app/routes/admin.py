@@ -1,17 +1,29 @@
-from datetime import datetime, timedelta
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+import hmac
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, Response
 from flask_login import login_required, current_user
 from .. import db
 from ..models import User, BalanceTx, Waba
 from ..json_store import ensure_user_bms_file
+from ..services.otp_stats import otp_stats_by_user
+from ..services import ledger
+from ..services.proxy_manager import get_proxy_manager
+from ..services import metrics
 
 bp = Blueprint("admin", __name__, url_prefix="/admin")
 
 def _is_admin():
     return current_user.is_authenticated and bool(getattr(current_user, "is_admin", False))
 
+def _metrics_token_ok() -> bool:
+    # scrapers authenticate with "Authorization: Bearer <METRICS_TOKEN>" instead of a session
+    expected = current_app.config["METRICS_TOKEN"]
+    auth = request.headers.get("Authorization", "")
+    return bool(expected) and auth.startswith("Bearer ") and hmac.compare_digest(auth[7:], expected)
+
 @bp.before_request
 def guard():
+    if request.endpoint == "admin.admin_metrics" and _metrics_token_ok():
+        return None
     if not _is_admin():
         return redirect(url_for("dashboard.dashboard"))
 
@@ -20,18 +32,10 @@ def guard():
 def admin_users():
     users = User.query.order_by(User.is_admin.desc(), User.id.asc()).all()
 
-    now = datetime.utcnow()
-    start_today = datetime(now.year, now.month, now.day)
-    start_week = now - timedelta(days=7)
-
-    stats = {}
-    for u in users:
-        # Opção A: OTP debitados
-        q = BalanceTx.query.filter_by(user_id=u.id).filter(BalanceTx.reason.like("OTP recebido%"))
-        total = q.count()
-        today = q.filter(BalanceTx.created_at >= start_today).count()
-        week = q.filter(BalanceTx.created_at >= start_week).count()
-        stats[u.id] = {"today": today, "week": week, "total": total}
+    # Opção A: OTP debitados (rollup diário, uma única consulta agrupada)
+    stats = otp_stats_by_user()
+    empty = {"today": 0, "week": 0, "total": 0}
+    stats = {u.id: stats.get(u.id, empty) for u in users}
 
     return render_template("admin_users.html", title="Admin • Usuários", users=users, stats=stats)
 
@@ -126,17 +130,27 @@ def admin_adjust_balance(user_id: int):
         return redirect(url_for("admin.admin_user_detail", user_id=user_id))
 
     if op == "remove":
-        if u.balance_cents < cents:
+        if not ledger.debit(u.id, cents, "Ajuste Admin: remoção", ledger.TX_KIND_ADMIN_REMOVE):
             flash("Saldo insuficiente para remover.", "error")
             return redirect(url_for("admin.admin_user_detail", user_id=user_id))
-        u.balance_cents -= cents
-        tx = BalanceTx(user_id=u.id, amount_cents=-cents, reason="Ajuste Admin: remoção")
     else:
-        u.balance_cents += cents
-        tx = BalanceTx(user_id=u.id, amount_cents=cents, reason="Ajuste Admin: adição")
-
-    db.session.add(tx)
-    db.session.commit()
+        ledger.credit(u.id, cents, "Ajuste Admin: adição", ledger.TX_KIND_ADMIN_ADD)
 
     flash("Saldo atualizado.", "success")
     return redirect(url_for("admin.admin_user_detail", user_id=user_id))
+
+@bp.route("/proxies", methods=["GET"])
+@login_required
+def admin_proxies():
+    return render_template("admin_proxies.html", title="Admin • Proxies", proxies=get_proxy_manager().snapshot())
+
+@bp.route("/proxies/probe", methods=["POST"])
+@login_required
+def admin_probe_proxies():
+    n = get_proxy_manager().probe_quarantined()
+    flash(f"Proxies em quarentena testados; {n} liberado(s).", "success")
+    return redirect(url_for("admin.admin_proxies"))
+
+@bp.route("/metrics", methods=["GET"])
+def admin_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
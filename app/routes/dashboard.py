@@ -1,6 +1,8 @@
-import time
+import json
 from flask import (
     Blueprint,
+    Response,
+    stream_with_context,
     render_template,
     current_app,
     redirect,
@@ -11,129 +13,109 @@ from flask import (
 )
 from flask_login import login_required, current_user
 
-from ..json_store import (
-    ensure_user_bms_file,
-    load_user_bms,
-    update_snapshot,
-)
-from ..services.meta import (
-    get_waba_name,
-    get_phone_numbers,
-    get_templates,
-    templates_status_summary,
+from ..waba_store import (
+    has_wabas,
+    page_entries,
+    filtered_entries,
+    iter_entries_by_waba_ids,
+    iter_filtered_entries,
+    SORT_COLUMNS,
 )
+from ..services.sync import sync_user_wabas
 
 bp = Blueprint("dashboard", __name__)
 
-API_BLOCKED_MARK = "API access blocked."
+API_PAGE_MAX = 500
+
+def _row(data: dict) -> dict:
+    waba_id = str(data.get("waba_id") or "").strip()
+    snap = data.get("snapshot", {}) or {}
+    return {
+        "waba_id": waba_id,
+        "waba_name": snap.get("waba_name") or "—",
+        "phone_numbers": [
+            {"display_phone_number": p.get("display_phone_number") or ""}
+            for p in (snap.get("phone_numbers") or []) if isinstance(p, dict)
+        ],
+        "t": snap.get("template_counts") or {
+            "APPROVED": 0,
+            "PAUSED": 0,
+            "DISABLED": 0,
+            "OTHER": 0,
+        },
+        "last_sync_at": snap.get("last_sync_at") or 0,
+        "status_label": snap.get("status_label") or "",
+        "last_error": snap.get("last_error") or "",
+        "last_add_phone_error": data.get("last_add_phone_error") or "",
+    }
+
+def _filters(args) -> dict:
+    # query string or export JSON payload
+    has_phone = str(args.get("has_phone", ""))
+    return {
+        "status": str(args.get("status") or "").strip(),
+        "has_phone": {"1": True, "0": False}.get(has_phone),
+        "q": str(args.get("q") or "").strip()[:200],
+    }
 
 @bp.route("/", methods=["GET"])
 @login_required
 def dashboard():
-    ensure_user_bms_file(current_user.id)
-    bms = load_user_bms(current_user.id)
-
-    rows = []
-    for key, data in (bms or {}).items():
-        if not isinstance(data, dict):
-            continue
-
-        waba_id = str(data.get("waba_id") or "").strip()
-        snap = data.get("snapshot", {}) or {}
-
-        rows.append({
-            "waba_id": waba_id,
-            "waba_name": snap.get("waba_name") or "—",
-            "phone_numbers": snap.get("phone_numbers") or [],
-            "t": snap.get("template_counts") or {
-                "APPROVED": 0,
-                "PAUSED": 0,
-                "DISABLED": 0,
-                "OTHER": 0,
-            },
-            "last_sync_at": snap.get("last_sync_at") or 0,
-            "status_label": snap.get("status_label") or "",
-            "last_error": snap.get("last_error") or "",
-            "last_add_phone_error": data.get("last_add_phone_error") or "",
-        })
-
+    # rows come from /api/wabas
     job_id = request.args.get("job", "")
     return render_template(
         "dashboard.html",
         title="Gerenciador de BM's",
-        rows=rows,
         job_id=job_id,
     )
 
+@bp.route("/api/wabas", methods=["GET"])
+@login_required
+def api_wabas():
+    """
+    WABA rows for the dashboard table.
+
+    Query: sort (last_sync_at|status|approved|paused|disabled|waba_id),
+    order (asc|desc), status, has_phone (1|0), q (error text / waba_id),
+    limit, cursor (from the previous page's next_cursor).
+    """
+    sort = request.args.get("sort", "last_sync_at")
+    if sort not in SORT_COLUMNS:
+        return jsonify({"error": "invalid_sort"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), API_PAGE_MAX))
+    except ValueError:
+        return jsonify({"error": "invalid_limit"}), 400
+
+    filters = _filters(request.args)
+    items, next_cursor = page_entries(
+        current_user.id,
+        sort=sort,
+        desc=request.args.get("order", "desc") != "asc",
+        cursor=request.args.get("cursor", ""),
+        limit=limit,
+        **filters,
+    )
+    out = {"rows": [_row(data) for _, data in items], "next_cursor": next_cursor}
+    if not request.args.get("cursor"):
+        out["total"] = filtered_entries(current_user.id, **filters).count()
+    return jsonify(out)
+
 @bp.route("/sync", methods=["POST"])
 @login_required
 def sync_now():
-    ensure_user_bms_file(current_user.id)
-    bms = load_user_bms(current_user.id)
     api_version = current_app.config["META_API_VERSION"]
 
-    if not bms:
+    if not has_wabas(current_user.id):
         flash("Você não tem WABAs cadastrados.", "error")
         return redirect(url_for("dashboard.dashboard"))
 
-    synced = 0
-    blocked = 0
-    errors = 0
-
-    for key, data in bms.items():
-        if not isinstance(data, dict):
-            continue
-
-        waba_id = str(data.get("waba_id") or "").strip()
-        token = (data.get("token") or "").strip()
-        if not waba_id or not token:
-            continue
-
-        waba_name, err_name = get_waba_name(api_version, token, waba_id)
-        phones, err_phones = get_phone_numbers(api_version, token, waba_id)
-        templates, err_tpl = get_templates(api_version, token, waba_id)
-
-        all_errors = " ".join(e for e in (err_name, err_phones, err_tpl) if e)
-
-        if API_BLOCKED_MARK in all_errors:
-            update_snapshot(
-                current_user.id,
-                waba_id,
-                waba_name="—",
-                phone_numbers=[],
-                template_counts={"APPROVED": 0, "PAUSED": 0, "DISABLED": 0, "OTHER": 0},
-                last_error="",
-                status_label="Developers Travado",
-                last_sync_at=int(time.time()),
-            )
-            blocked += 1
-            continue
-
-        if all_errors:
-            update_snapshot(
-                current_user.id,
-                waba_id,
-                waba_name=waba_name or "—",
-                phone_numbers=phones or [],
-                template_counts=templates_status_summary(templates or []),
-                last_error=all_errors[:900],
-                status_label="Erro",
-                last_sync_at=int(time.time()),
-            )
-            errors += 1
-            continue
-
-        update_snapshot(
-            current_user.id,
-            waba_id,
-            waba_name=waba_name or "—",
-            phone_numbers=phones or [],
-            template_counts=templates_status_summary(templates or []),
-            last_error="",
-            status_label="OK",
-            last_sync_at=int(time.time()),
-        )
-        synced += 1
+    counts = sync_user_wabas(
+        current_user.id,
+        api_version,
+        max_workers=int(current_app.config["SYNC_CONCURRENCY"]),
+    )
+    synced, blocked, errors = counts["ok"], counts["blocked"], counts["error"]
 
     flash(
         f"Atualizado • OK: {synced} • Developers travado: {blocked} • Erros: {errors}",
@@ -161,39 +143,42 @@ def export_selected():
     - não reaproveita templates reais
     - ordem dos campos respeitada
     """
-    ensure_user_bms_file(current_user.id)
-    bms = load_user_bms(current_user.id)
-
     payload = request.get_json(silent=True) or {}
-    waba_ids = payload.get("waba_ids") or []
-    if not isinstance(waba_ids, list):
-        return jsonify({"error": "invalid_payload"}), 400
-
-    # Mapeia waba_id -> chave original
-    key_by_waba_id = {}
-    for original_key, entry in (bms or {}).items():
-        if not isinstance(entry, dict):
-            continue
-        wid = str(entry.get("waba_id") or "").strip()
-        if wid:
-            key_by_waba_id[wid] = str(original_key)
-
-    out = {}
-
-    for wid in [str(x).strip() for x in waba_ids if str(x).strip()]:
-        original_key = key_by_waba_id.get(wid)
-        if not original_key:
+    if payload.get("all"):
+        # "export all matching filter": same filters as /api/wabas, nothing sent per WABA
+        items = iter_filtered_entries(current_user.id, **_filters(payload))
+    else:
+        waba_ids = payload.get("waba_ids") or []
+        if not isinstance(waba_ids, list):
+            return jsonify({"error": "invalid_payload"}), 400
+        items = iter_entries_by_waba_ids(current_user.id, waba_ids)
+
+    return Response(stream_with_context(_export_chunks(items)), mimetype="application/json")
+
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+def _export_chunks(items):
+    """Streams the export object entry by entry, flushing every EXPORT_FLUSH_BYTES."""
+    buf = ["{"]
+    size = 1
+    seen = set()
+    for original_key, entry in items:
+        if original_key in seen:
             continue
+        seen.add(original_key)
 
-        entry = bms.get(original_key)
-        if not isinstance(entry, dict):
-            continue
-
-        out[original_key] = {
+        wid = str(entry.get("waba_id") or "").strip() or original_key
+        item = {
             "waba_id": wid,
             "phone_number_id": str(entry.get("phone_number_id") or ""),
             "token": str(entry.get("token") or ""),
             "templates": [""],  # <-- SEMPRE EM BRANCO
         }
-
-    return jsonify(out)
+        part = ("," if len(seen) > 1 else "") + json.dumps(str(original_key)) + ":" + json.dumps(item, separators=(",", ":"))
+        buf.append(part)
+        size += len(part)
+        if size >= EXPORT_FLUSH_BYTES:
+            yield "".join(buf)
+            buf, size = [], 0
+    buf.append("}")
+    yield "".join(buf)
@@ -1,8 +1,14 @@
-from flask import Blueprint, request, redirect, url_for, jsonify, flash
+import json
+import queue
+from flask import (Blueprint, request, redirect, url_for, jsonify, flash, render_template, Response,
+                   stream_with_context, current_app)
 from flask_login import login_required, current_user
-from ..models import Job
+from ..models import Job, JobEvent
 from .. import db
 from ..jobs import start_add_phone_job
+from ..services.preflight import preflight_add_phone
+from ..services.pubsub import hub, job_topic
+from ..services.job_progress import get_job_progress
 
 bp = Blueprint("jobs", __name__, url_prefix="/jobs")
 
@@ -16,9 +22,29 @@ def start_add_phone():
         flash("Selecione pelo menos 1 WABA.", "error")
         return redirect(url_for("dashboard.dashboard"))
 
-    job_id = start_add_phone_job(current_user.id, waba_ids)
+    # DB-only here; tokens are checked by the job itself
+    pf = preflight_add_phone(current_user.id, waba_ids, check_graph=False)
+    skipped = sum(1 for r in pf["report"] if r["status"] == "skip")
+    failed = sum(1 for r in pf["report"] if r["status"] == "error")
+    if skipped or failed:
+        flash(f"Pré-verificação: {len(pf['viable'])} prontos, {skipped} já com número, "
+              f"{failed} com problema (motivo em cada WABA).", "error" if failed else "success")
+    if not pf["viable"]:
+        return redirect(url_for("dashboard.dashboard"))
+
+    job_id = start_add_phone_job(current_user.id, pf["viable"])
     return redirect(url_for("dashboard.dashboard", job=job_id))
 
+@bp.route("/preflight/add-phone", methods=["POST"])
+@login_required
+def preflight_add_phone_report():
+    """Dry run of the add-phone preflight: per-WABA report, nothing enqueued or written."""
+    data = request.get_json(silent=True) or {}
+    waba_ids = [str(w).strip() for w in (data.get("waba_ids") or []) if str(w).strip()]
+    if not waba_ids:
+        return jsonify({"error": "no_wabas"}), 400
+    return jsonify(preflight_add_phone(current_user.id, waba_ids, write_errors=False))
+
 @bp.route("/<int:job_id>/status", methods=["GET"])
 @login_required
 def job_status(job_id: int):
@@ -26,11 +52,99 @@ def job_status(job_id: int):
     if not job or job.user_id != current_user.id:
         return jsonify({"error": "not_found"}), 404
 
-    return jsonify({
+    return jsonify(_job_payload(job))
+
+def _job_payload(job: Job) -> dict:
+    payload = {
         "id": job.id,
         "status": job.status,
         "total": job.total,
         "done": job.done,
+        "failed": job.failed,
         "current_label": job.current_label,
         "last_message": job.last_message,
-    })
+    }
+    if job.status in ("queued", "running"):
+        # progress text not flushed to the Job row yet
+        payload.update(get_job_progress(current_app._get_current_object()).pending(job.id))
+    return payload
+
+# If nothing is published for this long (e.g. the job runs in another process),
+# the stream re-reads the Job row itself.
+SSE_REFRESH_SECONDS = 5
+
+@bp.route("/<int:job_id>/events", methods=["GET"])
+@login_required
+def job_events(job_id: int):
+    """Server-Sent Events: pushes job progress as runners publish it. /status stays as the polling fallback."""
+    job = db.session.get(Job, job_id)
+    if not job or job.user_id != current_user.id:
+        return jsonify({"error": "not_found"}), 404
+
+    state = _job_payload(job)
+    db.session.close()  # don't hold a connection for the lifetime of the stream
+
+    def stream():
+        q = hub.subscribe(job_topic(job_id))
+        try:
+            yield f"data: {json.dumps(state)}\n\n"
+            while state["status"] in ("queued", "running"):
+                try:
+                    delta = q.get(timeout=SSE_REFRESH_SECONDS)
+                except queue.Empty:
+                    row = db.session.get(Job, job_id)
+                    delta = _job_payload(row) if row else {"status": "error"}
+                    db.session.close()
+                    if all(state.get(k) == v for k, v in delta.items()):
+                        yield ": keep-alive\n\n"
+                        continue
+                state.update(delta)
+                yield f"data: {json.dumps(state)}\n\n"
+        finally:
+            hub.unsubscribe(job_topic(job_id), q)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@bp.route("/<int:job_id>/log", methods=["GET"])
+@login_required
+def job_log(job_id: int):
+    job = db.session.get(Job, job_id)
+    if not job or job.user_id != current_user.id:
+        return jsonify({"error": "not_found"}), 404
+
+    waba_id = (request.args.get("waba_id") or "").strip()
+    after = request.args.get("after", 0, type=int)
+    limit = max(1, min(request.args.get("limit", 500, type=int), 2000))
+
+    q = JobEvent.query.filter(JobEvent.job_id == job_id, JobEvent.id > after)
+    if waba_id:
+        q = q.filter(JobEvent.waba_id == waba_id)
+    events = q.order_by(JobEvent.id.asc()).limit(limit).all()
+
+    if request.args.get("format") == "json":
+        return jsonify({
+            "job_id": job_id,
+            "events": [{
+                "id": e.id,
+                "waba_id": e.waba_id,
+                "step": e.step,
+                "http_status": e.http_status,
+                "latency_ms": e.latency_ms,
+                "message": e.message,
+                "created_at": e.created_at.isoformat(),
+            } for e in events],
+            "next_after": events[-1].id if events else after,
+        })
+
+    return render_template(
+        "job_log.html",
+        title=f"Job #{job_id} • Log",
+        job=job,
+        events=events,
+        waba_id=waba_id,
+        next_after=events[-1].id if len(events) == limit else None,
+    )
@@ -1,6 +1,11 @@
-from flask import Blueprint, request, redirect, url_for, flash
+import threading
+from werkzeug.exceptions import RequestEntityTooLarge
+from flask import Blueprint, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
-from ..json_store import upsert_waba, ensure_user_bms_file
+from ..waba_store import upsert_waba, export_user_bms, bulk_upsert
+from ..services.bulk_import import iter_entries, validate_entry, ImportFormatError
+from ..services.sync import sync_user_wabas
+from ..services.sync_scheduler import get_sync_scheduler
 
 bp = Blueprint("wabas", __name__, url_prefix="/wabas")
 
@@ -14,10 +19,82 @@ def add():
         flash("Informe WABA ID e Token.", "error")
         return redirect(url_for("dashboard.dashboard"))
 
-    ensure_user_bms_file(current_user.id)
-
-    # Write/update in user's bms.json
+    # Write/update the user's WABA row
     upsert_waba(current_user.id, waba_id=waba_id, token=token)
 
     flash("WABA adicionado com sucesso.", "success")
     return redirect(url_for("dashboard.dashboard"))
+
+def _queue_initial_sync(user_id: int, waba_ids: list[str]) -> None:
+    scheduler = get_sync_scheduler()
+    if scheduler is not None:
+        scheduler.request_sync(user_id, waba_ids)
+        return
+    # scheduler disabled: one background pass over the imported WABAs
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            sync_user_wabas(user_id, app.config["META_API_VERSION"],
+                            max_workers=int(app.config["SYNC_CONCURRENCY"]), waba_ids=waba_ids)
+
+    threading.Thread(target=run, name="import-sync", daemon=True).start()
+
+@bp.route("/import", methods=["POST"])
+@login_required
+def bulk_import():
+    """
+    Bulk upload: bms.json, a JSON list or CSV (waba_id,token), as the `file`
+    field of a form or as the raw request body. `sync=1` queues an initial sync
+    of the imported WABAs. Returns per-row results.
+    """
+    # MAX_CONTENT_LENGTH also caps bodies without a Content-Length: reading
+    # past it raises RequestEntityTooLarge
+    if request.content_length and request.content_length > current_app.config["IMPORT_MAX_BYTES"]:
+        return jsonify({"error": "arquivo muito grande"}), 413
+
+    rows = []
+    items = {}  # waba_id -> (key, entry); first occurrence wins
+    try:
+        upload = request.files.get("file")
+        if upload is not None:
+            stream, filename, content_type = upload.stream, upload.filename or "", upload.mimetype or ""
+        else:
+            stream, filename, content_type = request.stream, "", request.mimetype or ""
+        for row_no, key, raw in iter_entries(stream, filename, content_type):
+            waba_id, entry, err = validate_entry(key, raw)
+            if err:
+                rows.append({"row": row_no, "waba_id": waba_id, "status": "invalid", "error": err})
+            elif waba_id in items:
+                rows.append({"row": row_no, "waba_id": waba_id, "status": "duplicate", "error": ""})
+            else:
+                items[waba_id] = (key, entry)
+                rows.append({"row": row_no, "waba_id": waba_id, "status": "", "error": ""})
+    except RequestEntityTooLarge:
+        return jsonify({"error": "arquivo muito grande"}), 413
+    except (ImportFormatError, UnicodeDecodeError) as e:
+        return jsonify({"error": f"Arquivo inválido: {e}"}), 400
+
+    result = bulk_upsert(current_user.id, list(items.values()))
+    for r in rows:
+        if not r["status"]:
+            r["status"] = result[r["waba_id"]]
+
+    created = [w for w, st in result.items() if st == "created"]
+    sync_queued = False
+    if request.values.get("sync") == "1" and items:
+        _queue_initial_sync(current_user.id, list(items))
+        sync_queued = True
+
+    summary = {st: 0 for st in ("created", "updated", "duplicate", "invalid")}
+    for r in rows:
+        summary[r["status"]] += 1
+    return jsonify({**summary, "new_waba_ids": created, "sync_queued": sync_queued, "rows": rows})
+
+@bp.route("/export/bms.json", methods=["GET"])
+@login_required
+def export_bms():
+    # Full store in the original bms.json format (same keys/fields), as a download
+    resp = jsonify(export_user_bms(current_user.id))
+    resp.headers["Content-Disposition"] = "attachment; filename=bms.json"
+    return resp
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from .async_http import AsyncHttp
+
+class AsyncEngine:
+    """
+    A dedicated event loop thread that runs add-phone coroutines.
+    Blocking work (database, ledger, number pool) goes to the loop's default
+    executor, so the number of threads stays fixed however many WABAs are in flight.
+    """
+
+    def __init__(self, max_connections: int = 200, blocking_threads: int = 16):
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=max(1, blocking_threads),
+                                                          thread_name_prefix="async-blocking"))
+        self.http = AsyncHttp(max_connections=max_connections)
+        self._thread = threading.Thread(target=self._run, name="async-engine", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro) -> Future:
+        """Schedules a coroutine from any thread; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+_engine: AsyncEngine | None = None
+_engine_lock = threading.Lock()
+
+def get_async_engine(max_connections: int = 200, blocking_threads: int = 16) -> AsyncEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncEngine(max_connections, blocking_threads)
+        return _engine
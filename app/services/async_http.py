@@ -0,0 +1,174 @@
+import time
+import asyncio
+from ..config import Config
+from .http import proxy_url
+from .meta import graph_url, get_graph_cache, cache_key, put_result, invalidate_waba, UnsentError
+from .throttle import get_throttle, RateLimitedError, CircuitOpenError, UnsentResponse
+from .proxy_manager import get_proxy_manager, PROXY_FAILURE_STATUSES
+from . import metrics
+
+try:
+    import httpx
+except ImportError:  # optional: only needed for ADD_PHONE_ENGINE=async
+    httpx = None
+
+# Async counterparts of the meta.py / sms24h.py calls used by the add-phone
+# flow. Same throttling, breakers and proxy stats as services.http; responses
+# are httpx.Response (status_code / text / json() like requests). Like meta.py
+# the Graph calls read settings from current_app: the flow runs each WABA
+# inside its own app context.
+
+def available() -> bool:
+    return httpx is not None
+
+class AsyncHttp:
+    """One httpx.AsyncClient per proxy ("" = direct). Must be used from a single event loop."""
+
+    def __init__(self, max_connections: int = 200):
+        self.max_connections = max_connections
+        self._clients: dict[str, "httpx.AsyncClient"] = {}
+
+    def _client(self, proxy_str: str | None) -> "httpx.AsyncClient":
+        key = proxy_str or ""
+        c = self._clients.get(key)
+        if c is None:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            # connect retries only, like the requests adapter in services.http
+            transport = httpx.AsyncHTTPTransport(
+                retries=Config.HTTP_CONNECT_RETRIES,
+                limits=limits,
+                proxy=proxy_url(proxy_str) if proxy_str else None,
+            )
+            c = self._clients[key] = httpx.AsyncClient(transport=transport)
+        return c
+
+    async def request(self, method: str, url: str, proxy_str: str | None = None, **kwargs):
+        throttle = get_throttle()
+        upstream, endpoint = metrics.classify(url, kwargs.get("params"))
+        try:
+            call = throttle.check(url, kwargs.get("headers"), kwargs.get("params"), proxy_str or "")
+        except CircuitOpenError:
+            metrics.upstream_done(upstream, endpoint, "circuit_open")
+            raise
+        max_wait = throttle.max_wait_for(call)
+        deadline = time.monotonic() + max_wait
+        for label, bucket in throttle.buckets(call):
+            while (wait := bucket.try_take()) > 0:
+                if time.monotonic() + wait > deadline:
+                    throttle.abort(call)
+                    metrics.upstream_done(upstream, endpoint, "rate_limited")
+                    raise RateLimitedError(f"rate limit: no slot for {label} within {max_wait:.0f}s")
+                await asyncio.sleep(wait)
+
+        t0 = time.monotonic()
+        metrics.UPSTREAM_IN_FLIGHT.inc(upstream)
+        try:
+            r = await self._client(proxy_str).request(method, url, timeout=30, **kwargs)
+        except httpx.HTTPError as e:
+            throttle.after_error(call, e)
+            if proxy_str:
+                get_proxy_manager().record(proxy_str, (time.monotonic() - t0) * 1000, False, f"{type(e).__name__}: {e}")
+            metrics.upstream_done(upstream, endpoint, "error", time.monotonic() - t0)
+            raise
+        finally:
+            metrics.UPSTREAM_IN_FLIGHT.dec(upstream)
+        throttle.after_response(call, r)
+        if proxy_str:
+            failed = r.status_code in PROXY_FAILURE_STATUSES
+            get_proxy_manager().record(proxy_str, (time.monotonic() - t0) * 1000, not failed,
+                                       f"HTTP {r.status_code}" if failed else "")
+        metrics.upstream_done(upstream, endpoint, r.status_code, time.monotonic() - t0)
+        return r
+
+    async def aclose(self) -> None:
+        for c in self._clients.values():
+            await c.aclose()
+        self._clients.clear()
+
+# --- Meta ---
+
+def _auth(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+async def _post(http: AsyncHttp, url: str, token: str, payload: dict, proxy_str: str | None):
+    try:
+        return await http.request("POST", url, proxy_str=proxy_str, headers=_auth(token), json=payload)
+    except (CircuitOpenError, RateLimitedError) as e:
+        return UnsentResponse(e)
+
+async def get_waba_name(http: AsyncHttp, api_version: str, token: str, waba_id: str):
+    # shares the "info" entries of meta.get_waba_info
+    key = cache_key(api_version, token, waba_id, "info")
+    hit, info = get_graph_cache().get(key)
+    if not hit:
+        info = await _fetch_waba_info(http, api_version, token, waba_id)
+        put_result(key, info)
+    j, err = info
+    return (j.get("name") if j else None), err
+
+async def _fetch_waba_info(http: AsyncHttp, api_version: str, token: str, waba_id: str):
+    try:
+        r = await http.request("GET", f"{graph_url()}/{api_version}/{waba_id}", headers=_auth(token))
+    except Exception as e:
+        return None, UnsentError(f"HTTP None: {str(e)[:800]}")
+    try:
+        j = r.json()
+    except Exception:
+        j = None
+    if r.status_code != 200 or not isinstance(j, dict):
+        return None, f"HTTP {r.status_code}: {(r.text or '').strip()[:800]}"
+    if "error" in j:
+        return None, f"Meta error: {str(j.get('error'))[:800]}"
+    return j, None
+
+async def add_phone_number(http: AsyncHttp, api_version: str, token: str, waba_id: str, cc: str,
+                           local_number: str, verified_name: str, proxy_str: str | None):
+    payload = {"cc": cc, "phone_number": local_number, "verified_name": verified_name}
+    r = await _post(http, f"{graph_url()}/{api_version}/{waba_id}/phone_numbers", token, payload, proxy_str)
+    if r.status_code == 200:
+        invalidate_waba(waba_id)
+    return r
+
+async def request_code(http: AsyncHttp, api_version: str, token: str, phone_id: str,
+                       code_method: str, language: str, proxy_str: str | None):
+    payload = {"code_method": code_method, "language": language}
+    return await _post(http, f"{graph_url()}/{api_version}/{phone_id}/request_code", token, payload, proxy_str)
+
+async def verify_code(http: AsyncHttp, api_version: str, token: str, phone_id: str, code: str, proxy_str: str | None):
+    return await _post(http, f"{graph_url()}/{api_version}/{phone_id}/verify_code", token, {"code": code}, proxy_str)
+
+async def register_number(http: AsyncHttp, api_version: str, token: str, phone_id: str, pin: str,
+                          proxy_str: str | None, waba_id: str | None = None):
+    payload = {"messaging_product": "whatsapp", "pin": pin}
+    r = await _post(http, f"{graph_url()}/{api_version}/{phone_id}/register", token, payload, proxy_str)
+    if r.status_code == 200 and waba_id:
+        invalidate_waba(waba_id)
+    return r
+
+# --- SMS24h ---
+
+async def sms24h_get_number(http: AsyncHttp, api_key: str, base_url: str, service: str, country: str,
+                            operator: str, proxy_str: str | None):
+    params = {"api_key": api_key, "action": "getNumber", "service": service, "country": country}
+    if operator and operator.strip():
+        params["operator"] = operator.strip()
+    try:
+        r = await http.request("GET", base_url, proxy_str=proxy_str, params=params)
+    except (CircuitOpenError, RateLimitedError):
+        return None, None
+    text = (r.text or "").strip()
+    if text.startswith("ACCESS_NUMBER"):
+        parts = text.split(":")
+        if len(parts) >= 3:
+            return parts[1], parts[2]
+    return None, None
+
+async def sms24h_get_status(http: AsyncHttp, api_key: str, base_url: str, activation_id: str, proxy_str: str | None) -> str:
+    params = {"api_key": api_key, "action": "getStatus", "id": activation_id}
+    r = await http.request("GET", base_url, proxy_str=proxy_str, params=params)
+    return (r.text or "").strip()
+
+async def sms24h_cancel(http: AsyncHttp, api_key: str, base_url: str, activation_id: str, proxy_str: str | None) -> None:
+    params = {"api_key": api_key, "action": "setStatus", "id": activation_id, "status": "8"}
+    await http.request("GET", base_url, proxy_str=proxy_str, params=params)
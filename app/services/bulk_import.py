@@ -0,0 +1,139 @@
+import io
+import csv
+import json
+from typing import Any, Dict, IO, Iterator
+
+# Streaming readers for bulk WABA uploads. Each yields (row_no, key, entry)
+# without loading the whole upload: JSON is decoded value by value from a
+# sliding buffer, CSV line by line. Accepted shapes:
+#   - bms.json: {"<key>": {"waba_id": ..., "token": ..., ...}, ...}
+#   - JSON list: [{"waba_id": ..., "token": ...}, ...]
+#   - CSV with a waba_id,token header (key/phone_number_id optional) or
+#     headerless waba_id,token rows
+
+CHUNK = 64 * 1024
+MAX_ID_LEN = 64
+
+class ImportFormatError(ValueError):
+    pass
+
+class _JsonStream:
+    def __init__(self, stream: IO[bytes]):
+        self.reader = io.TextIOWrapper(stream, encoding="utf-8-sig")
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.consumed = 0  # chars dropped from the front of buf, for error offsets
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.reader.read(CHUNK)
+        if not chunk:
+            self.eof = True
+            return False
+        self.consumed += self.pos
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace char ("" at end of input)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if not c or c not in chars:
+            raise ImportFormatError(f"JSON inválido perto do caractere {self.consumed + self.pos}: esperado {chars!r}")
+        self.pos += 1
+        return c
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise ImportFormatError(f"JSON inválido perto do caractere {self.consumed + self.pos}")
+            # a scalar cut at the end of the buffer ("12" of "123") decodes fine: make sure it ended
+            if end >= len(self.buf) and not self.eof:
+                if self._fill():
+                    continue
+            self.pos = end
+            return obj
+
+def iter_json_entries(stream: IO[bytes]) -> Iterator[tuple[int, str, Any]]:
+    js = _JsonStream(stream)
+    opener = js.expect("{[")
+    closer = "}" if opener == "{" else "]"
+    row = 0
+    if js.peek() == closer:
+        js.pos += 1
+        return
+    while True:
+        row += 1
+        if opener == "{":
+            key = js.value()
+            if not isinstance(key, str):
+                raise ImportFormatError(f"JSON inválido na entrada {row}: chave deve ser texto")
+            js.expect(":")
+            entry = js.value()
+        else:
+            entry = js.value()
+            key = ""
+        yield row, key, entry
+        if js.expect("," + closer) == closer:
+            return
+
+def iter_csv_entries(stream: IO[bytes]) -> Iterator[tuple[int, str, Any]]:
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    header = None
+    row = 0
+    for cells in reader:
+        cells = [c.strip() for c in cells]
+        if not any(cells):
+            continue
+        if header is None and row == 0 and "waba_id" in [c.lower() for c in cells]:
+            header = [c.lower() for c in cells]
+            continue
+        row += 1
+        if header:
+            rec = dict(zip(header, cells))
+        else:
+            rec = {"waba_id": cells[0], "token": cells[1] if len(cells) > 1 else ""}
+        entry = {"waba_id": rec.get("waba_id", ""), "token": rec.get("token", "")}
+        if rec.get("phone_number_id"):
+            entry["phone_number_id"] = rec["phone_number_id"]
+        yield row, rec.get("key", ""), entry
+
+def iter_entries(stream: IO[bytes], filename: str = "", content_type: str = "") -> Iterator[tuple[int, str, Any]]:
+    name = (filename or "").lower()
+    if name.endswith(".csv") or "csv" in (content_type or ""):
+        return iter_csv_entries(stream)
+    return iter_json_entries(stream)
+
+def validate_entry(key: str, entry: Any) -> tuple[str, Dict[str, Any] | None, str]:
+    """(waba_id, normalized entry, error). The entry keeps any extra bms.json fields."""
+    if not isinstance(entry, dict):
+        return "", None, "entrada não é um objeto"
+    waba_id = str(entry.get("waba_id") or key or "").strip()
+    token = str(entry.get("token") or "").strip()
+    if not waba_id:
+        return "", None, "waba_id ausente"
+    if len(waba_id) > MAX_ID_LEN or any(c.isspace() for c in waba_id):
+        return waba_id, None, "waba_id inválido"
+    if not token:
+        return waba_id, None, "token ausente"
+    out = dict(entry)
+    out["waba_id"] = waba_id
+    out["token"] = token
+    return waba_id, out, ""
@@ -0,0 +1,83 @@
+import time
+import queue
+import threading
+from datetime import datetime
+from .. import db
+from ..models import JobEvent
+from . import metrics
+
+MAX_MESSAGE = 4000
+
+class EventLog:
+    """
+    O(1) logging for the add-phone flow: log() only enqueues; a background
+    thread bulk-inserts JobEvent rows every `flush_interval` or `batch_size` events.
+    """
+
+    def __init__(self, app, flush_interval: float = 0.5, batch_size: int = 500):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._q: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="event-log", daemon=True)
+        self._thread.start()
+
+    def log(self, job_id: int, user_id: int, waba_id: str, step: str, message: str = "",
+            http_status: int | None = None, latency_ms: int | None = None) -> None:
+        metrics.observe_step(step, latency_ms)
+        self._q.put({
+            "job_id": int(job_id),
+            "user_id": int(user_id),
+            "waba_id": str(waba_id),
+            "step": step[:64],
+            "http_status": http_status,
+            "latency_ms": latency_ms,
+            "message": (message or "")[:MAX_MESSAGE],
+            "created_at": datetime.utcnow(),
+        })
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Blocks until everything logged so far is in the database."""
+        done = threading.Event()
+        self._q.put(done)
+        done.wait(timeout)
+
+    def _loop(self) -> None:
+        while True:
+            batch, waiters = [], []
+            item = self._q.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                remaining = 0 if waiters else deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining < 0:
+                    break
+                try:
+                    item = self._q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    with self.app.app_context():
+                        db.session.execute(db.insert(JobEvent), batch)
+                        db.session.commit()
+                except Exception:
+                    self.app.logger.exception("event log: failed to write %d events", len(batch))
+            for w in waiters:
+                w.set()
+
+_log: EventLog | None = None
+_log_lock = threading.Lock()
+
+def get_event_log(app) -> EventLog:
+    global _log
+    if _log is not None:
+        return _log
+    with _log_lock:
+        if _log is None:
+            _log = EventLog(app)
+        return _log
@@ -0,0 +1,94 @@
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ..config import Config
+from .throttle import get_throttle, CircuitOpenError, RateLimitedError
+from . import metrics
+from .proxy_manager import get_proxy_manager, PROXY_FAILURE_STATUSES
+
+_sessions: dict[str, requests.Session] = {}
+_lock = threading.Lock()
+
+def proxy_url(proxy_str: str) -> str:
+    ip, port, user, pwd = proxy_str.split(":")
+    return f"http://{user}:{pwd}@{ip}:{port}"
+
+class ThrottledSession(requests.Session):
+    """
+    Every request waits for its rate-limit slots and reports back to the circuit
+    breakers; requests through a proxy also feed that proxy's health stats.
+    """
+
+    def __init__(self, proxy_str: str | None = None):
+        super().__init__()
+        self.proxy_key = proxy_str or ""
+
+    def request(self, method, url, **kwargs):
+        throttle = get_throttle()
+        upstream, endpoint = metrics.classify(url, kwargs.get("params"))
+        try:
+            call = throttle.before(url, kwargs.get("headers"), kwargs.get("params"), self.proxy_key)
+        except (CircuitOpenError, RateLimitedError) as e:
+            metrics.upstream_done(upstream, endpoint, "circuit_open" if isinstance(e, CircuitOpenError) else "rate_limited")
+            raise
+        t0 = time.monotonic()
+        metrics.UPSTREAM_IN_FLIGHT.inc(upstream)
+        try:
+            r = super().request(method, url, **kwargs)
+        except requests.RequestException as e:
+            throttle.after_error(call, e)
+            self._record_proxy(t0, False, f"{type(e).__name__}: {e}")
+            metrics.upstream_done(upstream, endpoint, "error", time.monotonic() - t0)
+            raise
+        finally:
+            metrics.UPSTREAM_IN_FLIGHT.dec(upstream)
+        throttle.after_response(call, r)
+        failed = r.status_code in PROXY_FAILURE_STATUSES
+        self._record_proxy(t0, not failed, f"HTTP {r.status_code}" if failed else "")
+        metrics.upstream_done(upstream, endpoint, r.status_code, time.monotonic() - t0)
+        return r
+
+    def _record_proxy(self, t0: float, ok: bool, error: str) -> None:
+        if self.proxy_key:
+            get_proxy_manager().record(self.proxy_key, (time.monotonic() - t0) * 1000, ok, error)
+
+def _build_session(proxy_str: str | None) -> requests.Session:
+    s = ThrottledSession(proxy_str)
+    # Only connection failures are retried: the request never reached the
+    # server, so this is safe even for getNumber / add_phone_number.
+    # Retry-After is handled by services.throttle, not by urllib3.
+    retry = Retry(total=Config.HTTP_CONNECT_RETRIES, connect=Config.HTTP_CONNECT_RETRIES,
+                  read=0, status=0, other=0, backoff_factor=0.3,
+                  respect_retry_after_header=False)
+    adapter = HTTPAdapter(
+        pool_connections=Config.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers["Connection"] = "keep-alive"
+    if proxy_str:
+        url = proxy_url(proxy_str)
+        s.proxies.update({"http": url, "https": url})
+    return s
+
+def get_session(proxy_str: str | None = None) -> requests.Session:
+    """Shared keep-alive session per proxy ("" = direct), safe to use from worker threads."""
+    key = proxy_str or ""
+    s = _sessions.get(key)
+    if s is not None:
+        return s
+    with _lock:
+        s = _sessions.get(key)
+        if s is None:
+            s = _sessions[key] = _build_session(proxy_str)
+        return s
+
+def close_all() -> None:
+    with _lock:
+        for s in _sessions.values():
+            s.close()
+        _sessions.clear()
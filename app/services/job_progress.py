@@ -0,0 +1,83 @@
+import time
+import atexit
+import threading
+from .. import db
+from ..models import Job
+from .pubsub import publish_job
+
+OPEN_STATUSES = ("queued", "running")
+
+class JobProgress:
+    """
+    Write-behind buffer for job progress text (last_message and friends).
+    update() is visible at once: SSE listeners get it through pubsub and the
+    status endpoint overlays pending() on the Job row. A background thread
+    writes every dirty job in one transaction at most once per `flush_interval`.
+    Counters and terminal states are written at once by job_queue's conditional
+    UPDATEs; the flush only touches jobs that are still open, so a job's final
+    message always wins over buffered text.
+    """
+
+    def __init__(self, app, flush_interval: float = 2.0):
+        self.app = app
+        self.flush_interval = flush_interval
+        self._dirty: dict[int, dict] = {}
+        self._flushing: dict[int, dict] = {}  # taken by the flusher, not committed yet
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="job-progress", daemon=True)
+        self._thread.start()
+
+    def update(self, job_id: int, **fields) -> None:
+        job_id = int(job_id)
+        with self._lock:
+            self._dirty.setdefault(job_id, {}).update(fields)
+        publish_job(job_id, **fields)
+
+    def pending(self, job_id: int) -> dict:
+        job_id = int(job_id)
+        with self._lock:
+            return {**self._flushing.get(job_id, {}), **self._dirty.get(job_id, {})}
+
+    def flush(self) -> int:
+        """Writes buffered fields of open jobs; returns how many jobs were updated."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                self._flushing, self._dirty = self._dirty, {}
+            written = 0
+            try:
+                with self.app.app_context():
+                    for job_id, fields in self._flushing.items():
+                        written += Job.query.filter(Job.id == job_id, Job.status.in_(OPEN_STATUSES)).update(
+                            fields, synchronize_session=False)
+                    db.session.commit()
+            except Exception:
+                self.app.logger.exception("job progress: flush of %d jobs failed", len(self._flushing))
+                with self._lock:
+                    # keep newer values that arrived meanwhile
+                    for job_id, fields in self._flushing.items():
+                        self._dirty[job_id] = {**fields, **self._dirty.get(job_id, {})}
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            return written
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+_progress: JobProgress | None = None
+_progress_lock = threading.Lock()
+
+def get_job_progress(app) -> JobProgress:
+    global _progress
+    if _progress is not None:
+        return _progress
+    with _progress_lock:
+        if _progress is None:
+            _progress = JobProgress(app, float(app.config["JOB_PROGRESS_FLUSH_INTERVAL"]))
+            atexit.register(_progress.flush)
+        return _progress
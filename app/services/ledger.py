@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from .. import db
+from ..models import User, BalanceTx, BalanceHold, JobItem
+from .otp_stats import TX_KIND_OTP, bump_otp_rollup
+
+# Balance changes are single conditional UPDATEs on user.balance_cents, so
+# concurrent workers can never overdraw or lose each other's debits.
+# A hold moves the money out of the balance for the length of an add-phone
+# attempt; capture turns it into a ledger row, release puts it back.
+
+TX_KIND_ADMIN_ADD = "admin_add"
+TX_KIND_ADMIN_REMOVE = "admin_remove"
+
+def _take(user_id: int, amount_cents: int) -> bool:
+    res = db.session.execute(
+        sa.update(User)
+        .where(User.id == user_id, User.balance_cents >= amount_cents)
+        .values(balance_cents=User.balance_cents - amount_cents)
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount == 1
+
+def _give(user_id: int, amount_cents: int) -> None:
+    db.session.execute(
+        sa.update(User)
+        .where(User.id == user_id)
+        .values(balance_cents=User.balance_cents + amount_cents)
+        .execution_options(synchronize_session=False)
+    )
+
+def _record(user_id: int, amount_cents: int, reason: str, kind: str,
+            waba_id: str = "", phone_number_id: str = "") -> None:
+    db.session.add(BalanceTx(
+        user_id=user_id,
+        amount_cents=amount_cents,
+        reason=reason,
+        kind=kind,
+        waba_id=str(waba_id or ""),
+        phone_number_id=str(phone_number_id or ""),
+    ))
+    if kind == TX_KIND_OTP:
+        bump_otp_rollup(user_id)
+
+def balance(user_id: int) -> int | None:
+    return db.session.scalar(sa.select(User.balance_cents).where(User.id == user_id))
+
+def debit(user_id: int, amount_cents: int, reason: str, kind: str,
+          waba_id: str = "", phone_number_id: str = "") -> bool:
+    """Takes amount_cents if the balance covers it. False (nothing written) otherwise."""
+    if not _take(user_id, amount_cents):
+        db.session.rollback()
+        return False
+    _record(user_id, -amount_cents, reason, kind, waba_id, phone_number_id)
+    db.session.commit()
+    return True
+
+def credit(user_id: int, amount_cents: int, reason: str, kind: str) -> None:
+    _give(user_id, amount_cents)
+    _record(user_id, amount_cents, reason, kind)
+    db.session.commit()
+
+def reserve(user_id: int, amount_cents: int, job_id: int = 0, waba_id: str = "") -> int | None:
+    """Holds amount_cents for one attempt. Returns the hold id, or None if the balance is short."""
+    if not _take(user_id, amount_cents):
+        db.session.rollback()
+        return None
+    hold = BalanceHold(user_id=user_id, amount_cents=amount_cents, job_id=job_id or 0, waba_id=str(waba_id or ""))
+    db.session.add(hold)
+    db.session.flush()
+    hold_id = hold.id
+    db.session.commit()
+    return hold_id
+
+def _close(hold_id: int, status: str) -> BalanceHold | None:
+    """held -> status. Returns the hold if this call closed it, None if it was already closed."""
+    res = db.session.execute(
+        sa.update(BalanceHold)
+        .where(BalanceHold.id == hold_id, BalanceHold.status == "held")
+        .values(status=status, closed_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if res.rowcount != 1:
+        return None
+    return db.session.execute(
+        sa.select(BalanceHold.user_id, BalanceHold.amount_cents).where(BalanceHold.id == hold_id)
+    ).first()
+
+def capture(hold_id: int, reason: str, kind: str, waba_id: str = "", phone_number_id: str = "") -> bool:
+    """Turns a hold into a debit. False if the hold was already captured or released."""
+    hold = _close(hold_id, "captured")
+    if hold is None:
+        db.session.rollback()
+        return False
+    _record(hold.user_id, -hold.amount_cents, reason, kind, waba_id, phone_number_id)
+    db.session.commit()
+    return True
+
+def release(hold_id: int | None) -> bool:
+    """Gives a held amount back. Safe to call more than once."""
+    if not hold_id:
+        return False
+    hold = _close(int(hold_id), "released")
+    if hold is None:
+        db.session.rollback()
+        return False
+    _give(hold.user_id, hold.amount_cents)
+    db.session.commit()
+    return True
+
+def release_stale_holds(max_age_seconds: int) -> int:
+    """Recovery: releases old holds whose job item is no longer being worked on."""
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age_seconds)
+    live = sa.select(JobItem.id).where(
+        JobItem.job_id == BalanceHold.job_id,
+        JobItem.waba_id == BalanceHold.waba_id,
+        JobItem.status.in_(("queued", "running")),
+    )
+    stale = db.session.scalars(
+        sa.select(BalanceHold.id).where(
+            BalanceHold.status == "held",
+            BalanceHold.created_at < cutoff,
+            ~live.exists(),
+        )
+    ).all()
+    db.session.commit()
+    return sum(1 for hold_id in stale if release(hold_id))
@@ -1,11 +1,132 @@
-import requests
+import json
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app
+from .http import get_session
+from .throttle import token_fingerprint, CircuitOpenError, RateLimitedError, UnsentResponse
+
+# Settings come from current_app.config: callers run inside an app context
+# (worker threads and the async engine push their own).
+
+def graph_url() -> str:
+    return current_app.config["META_GRAPH_BASE_URL"]
+
+class UnsentError(str):
+    """Error text for a read Graph never answered (throttle refusal, timeout, connection error)."""
+
+class GraphCache:
+    """
+    Read-through cache for Graph reads: TTL per resource, LRU eviction bounded
+    by entry count and approximate size. Errors Graph answered with are cached
+    too (negative TTL) so a broken WABA is not re-asked on every pass; an
+    UnsentError is not, the next read tries again. Cached values are shared:
+    treat them as read-only.
+    """
+
+    def __init__(self, ttls: dict[str, float], error_ttl: float, max_entries: int, max_bytes: int):
+        self.ttls = ttls
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: OrderedDict[tuple, tuple[float, int, object]] = OrderedDict()  # key -> (expires, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> tuple[bool, object]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    self._drop(key)
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, item[2]
+
+    def put(self, key: tuple, value, error: bool) -> None:
+        ttl = self.error_ttl if error else self.ttls.get(key[2], 0)
+        if ttl <= 0:
+            return
+        size = len(json.dumps(value, default=str))
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._data)))
+
+    def _drop(self, key: tuple) -> None:
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def invalidate_waba(self, waba_id: str) -> None:
+        waba_id = str(waba_id)
+        with self._lock:
+            for key in [k for k in self._data if k[1] == waba_id]:
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+_graph_cache: GraphCache | None = None
+_graph_cache_lock = threading.Lock()
+
+def get_graph_cache() -> GraphCache:
+    global _graph_cache
+    if _graph_cache is not None:
+        return _graph_cache
+    with _graph_cache_lock:
+        if _graph_cache is None:
+            cfg = current_app.config
+            _graph_cache = GraphCache(
+                ttls={
+                    "info": float(cfg["GRAPH_CACHE_TTL_INFO"]),
+                    "phones": float(cfg["GRAPH_CACHE_TTL_PHONES"]),
+                    "templates": float(cfg["GRAPH_CACHE_TTL_TEMPLATES"]),
+                    "overview": float(cfg["GRAPH_CACHE_TTL_OVERVIEW"]),
+                },
+                error_ttl=float(cfg["GRAPH_CACHE_TTL_ERROR"]),
+                max_entries=int(cfg["GRAPH_CACHE_MAX_ENTRIES"]),
+                max_bytes=int(cfg["GRAPH_CACHE_MAX_BYTES"]),
+            )
+        return _graph_cache
+
+def cache_key(api_version: str, token: str, waba_id: str, resource: str) -> tuple:
+    # token fingerprint in the key: two users may hold the same WABA with different access
+    return (api_version, str(waba_id), resource, token_fingerprint(token))
+
+def put_result(key: tuple, value: tuple) -> None:
+    """Caches a fetch result whose last element is the error (None on success)."""
+    err = value[-1]
+    if isinstance(err, UnsentError):
+        return
+    get_graph_cache().put(key, value, error=err is not None)
+
+def _cached(api_version: str, token: str, waba_id: str, resource: str, fetch):
+    key = cache_key(api_version, token, waba_id, resource)
+    hit, value = get_graph_cache().get(key)
+    if hit:
+        return value
+    value = fetch()
+    put_result(key, value)
+    return value
+
+def invalidate_waba(waba_id: str) -> None:
+    get_graph_cache().invalidate_waba(waba_id)
 
 def _auth_headers(token: str) -> dict:
     return {"Authorization": f"Bearer {token}"}
 
-def _get(url: str, token: str):
+def _get(url: str, token: str, params: dict | None = None):
     try:
-        r = requests.get(url, headers=_auth_headers(token), timeout=30)
+        r = get_session().get(url, headers=_auth_headers(token), params=params, timeout=30)
         txt = (r.text or "").strip()
         try:
             j = r.json()
@@ -15,15 +136,22 @@ def _get(url: str, token: str):
     except Exception as e:
         return None, None, str(e)[:800]
 
-def get_waba_info(api_version: str, token: str, waba_id: str):
-    url = f"https://graph.facebook.com/{api_version}/{waba_id}"
+def _http_error(status: int | None, snippet: str) -> str:
+    msg = f"HTTP {status}: {snippet}"
+    return UnsentError(msg) if status is None else msg
+
+def _fetch_waba_info(api_version: str, token: str, waba_id: str):
+    url = f"{graph_url()}/{api_version}/{waba_id}"
     status, j, snippet = _get(url, token)
     if status != 200 or not isinstance(j, dict):
-        return None, f"HTTP {status}: {snippet}"
+        return None, _http_error(status, snippet)
     if "error" in j:
         return None, f"Meta error: {str(j.get('error'))[:800]}"
     return j, None
 
+def get_waba_info(api_version: str, token: str, waba_id: str):
+    return _cached(api_version, token, waba_id, "info", lambda: _fetch_waba_info(api_version, token, waba_id))
+
 def get_waba_name(api_version: str, token: str, waba_id: str):
     info, err = get_waba_info(api_version, token, waba_id)
     if err:
@@ -31,26 +159,129 @@ def get_waba_name(api_version: str, token: str, waba_id: str):
     name = info.get("name")
     return name, None
 
-def get_phone_numbers(api_version: str, token: str, waba_id: str):
-    url = f"https://graph.facebook.com/{api_version}/{waba_id}/phone_numbers"
-    status, j, snippet = _get(url, token)
+MULTI_ID_MAX = 50  # Graph's cap on ?ids=
+
+def get_waba_infos(api_version: str, token: str, waba_ids: list[str]) -> dict[str, tuple]:
+    """
+    get_waba_info for many WABAs of one token: cache hits first, then one
+    multi-ID lookup (?ids=) per 50 misses. Graph fails the whole lookup if any
+    ID is unreadable, so a failed chunk is retried one WABA at a time.
+    """
+    cache = get_graph_cache()
+    out = {}
+    misses = []
+    for waba_id in dict.fromkeys(str(w) for w in waba_ids):
+        hit, value = cache.get(cache_key(api_version, token, waba_id, "info"))
+        if hit:
+            out[waba_id] = value
+        else:
+            misses.append(waba_id)
+
+    for i in range(0, len(misses), MULTI_ID_MAX):
+        chunk = misses[i:i + MULTI_ID_MAX]
+        status, j, _ = _get(f"{graph_url()}/{api_version}/", token, {"ids": ",".join(chunk), "fields": "id,name"})
+        if status == 200 and isinstance(j, dict) and "error" not in j and all(isinstance(j.get(w), dict) for w in chunk):
+            for waba_id in chunk:
+                out[waba_id] = (j[waba_id], None)
+                cache.put(cache_key(api_version, token, waba_id, "info"), out[waba_id], error=False)
+        else:
+            for waba_id in chunk:
+                out[waba_id] = get_waba_info(api_version, token, waba_id)
+    return out
+
+class GraphPageError(Exception):
+    pass
+
+def _page(url: str, token: str, params: dict | None = None) -> dict:
+    status, j, snippet = _get(url, token, params)
     if status != 200 or not isinstance(j, dict):
-        return [], f"HTTP {status}: {snippet}"
+        raise GraphPageError(_http_error(status, snippet))
     if "error" in j:
-        return [], f"Meta error: {str(j.get('error'))[:800]}"
-    return (j.get("data") or []), None
+        raise GraphPageError(f"Meta error: {str(j.get('error'))[:800]}")
+    return j
+
+def iter_edge(url: str, token: str, params: dict | None = None, first_page: dict | None = None):
+    """
+    Yields the items of a Graph edge one page at a time, following paging.next.
+    `first_page` is a page already in hand (e.g. from field expansion); only
+    the following pages are fetched. Raises GraphPageError when a page fails
+    or the edge has more than GRAPH_MAX_PAGES pages.
+    """
+    max_pages = int(current_app.config["GRAPH_MAX_PAGES"])
+    page = first_page if first_page is not None else _page(url, token, params)
+    pages = 1
+    while True:
+        yield from page.get("data") or []
+        nxt = (page.get("paging") or {}).get("next")
+        if not nxt:
+            return
+        if pages >= max_pages:
+            # partial data must not pass for the full count
+            current_app.logger.warning("graph paging stopped at GRAPH_MAX_PAGES=%d: %s", max_pages, url or nxt)
+            raise GraphPageError(f"Paginação interrompida após {max_pages} páginas (GRAPH_MAX_PAGES): dados incompletos")
+        page = _page(nxt, token)  # next already carries fields/limit/after
+        pages += 1
+
+PHONE_FIELDS = "id,display_phone_number,verified_name,code_verification_status,quality_rating,platform_type,throughput"
+
+def get_phone_numbers(api_version: str, token: str, waba_id: str):
+    return _cached(api_version, token, waba_id, "phones", lambda: _fetch_phone_numbers(api_version, token, waba_id))
 
-def get_templates(api_version: str, token: str, waba_id: str):
-    url = f"https://graph.facebook.com/{api_version}/{waba_id}/message_templates"
+def _fetch_phone_numbers(api_version: str, token: str, waba_id: str):
+    url = f"{graph_url()}/{api_version}/{waba_id}/phone_numbers"
+    params = {"fields": PHONE_FIELDS, "limit": current_app.config["GRAPH_PHONES_PAGE_LIMIT"]}
+    phones = []
+    try:
+        phones.extend(iter_edge(url, token, params))
+    except GraphPageError as e:
+        return phones, e.args[0]
+    return phones, None
+
+def get_template_counts(api_version: str, token: str, waba_id: str):
+    """Template status counts over every page; templates themselves are never kept. Returns (counts, err)."""
+    return _cached(api_version, token, waba_id, "templates", lambda: _fetch_template_counts(api_version, token, waba_id))
+
+def _fetch_template_counts(api_version: str, token: str, waba_id: str):
+    url = f"{graph_url()}/{api_version}/{waba_id}/message_templates"
+    params = {"fields": "status", "limit": current_app.config["GRAPH_TEMPLATES_PAGE_LIMIT"]}
+    counts = templates_status_summary(())
+    try:
+        templates_status_summary(iter_edge(url, token, params), counts)
+    except GraphPageError as e:
+        return counts, e.args[0]
+    return counts, None
+
+def get_waba_overview(api_version: str, token: str, waba_id: str):
+    """
+    name + phone numbers + template statuses via field expansion; further
+    pages of either edge are followed from there.
+    Returns (name, phones, template_counts, err).
+    """
+    return _cached(api_version, token, waba_id, "overview", lambda: _fetch_waba_overview(api_version, token, waba_id))
+
+def _fetch_waba_overview(api_version: str, token: str, waba_id: str):
+    cfg = current_app.config
+    fields = (f"name,phone_numbers.limit({cfg['GRAPH_PHONES_PAGE_LIMIT']}){{{PHONE_FIELDS}}},"
+              f"message_templates.limit({cfg['GRAPH_TEMPLATES_PAGE_LIMIT']}){{status}}")
+    url = f"{graph_url()}/{api_version}/{waba_id}?fields={fields}"
     status, j, snippet = _get(url, token)
     if status != 200 or not isinstance(j, dict):
-        return [], f"HTTP {status}: {snippet}"
+        return None, [], templates_status_summary(()), _http_error(status, snippet)
     if "error" in j:
-        return [], f"Meta error: {str(j.get('error'))[:800]}"
-    return (j.get("data") or []), None
+        return None, [], templates_status_summary(()), f"Meta error: {str(j.get('error'))[:800]}"
+    phones = []
+    counts = templates_status_summary(())
+    try:
+        phones.extend(iter_edge("", token, first_page=j.get("phone_numbers") or {}))
+        templates_status_summary(iter_edge("", token, first_page=j.get("message_templates") or {}), counts)
+    except GraphPageError as e:
+        return j.get("name"), phones, counts, e.args[0]
+    return j.get("name"), phones, counts, None
 
-def templates_status_summary(templates: list[dict]) -> dict:
-    out = {"APPROVED": 0, "PAUSED": 0, "DISABLED": 0, "OTHER": 0}
+def templates_status_summary(templates, out: dict | None = None) -> dict:
+    """Counts statuses from any iterable of templates, adding into `out` when given."""
+    if out is None:
+        out = {"APPROVED": 0, "PAUSED": 0, "DISABLED": 0, "OTHER": 0}
     for t in templates:
         st = (t.get("status") or "").upper()
         if st in out:
@@ -62,42 +293,38 @@ def templates_status_summary(templates: list[dict]) -> dict:
 # --- functions used by add-phone flow (unchanged signatures) ---
 
 def _session_with_proxy(proxy_str: str | None):
-    s = requests.Session()
-    if proxy_str:
-        ip, port, user, pwd = proxy_str.split(":")
-        proxy_url = f"http://{user}:{pwd}@{ip}:{port}"
-        s.proxies.update({"http": proxy_url, "https": proxy_url})
-    return s
+    return get_session(proxy_str)
+
+def _post(proxy_str: str | None, url: str, token: str, payload: dict):
+    try:
+        return _session_with_proxy(proxy_str).post(url, headers={"Authorization": f"Bearer {token}"},
+                                                    json=payload, timeout=30)
+    except (CircuitOpenError, RateLimitedError) as e:
+        return UnsentResponse(e)
 
 def add_phone_number(api_version: str, token: str, waba_id: str, cc: str, local_number: str, verified_name: str, proxy_str: str | None):
-    s = _session_with_proxy(proxy_str)
-    url = f"https://graph.facebook.com/{api_version}/{waba_id}/phone_numbers"
+    url = f"{graph_url()}/{api_version}/{waba_id}/phone_numbers"
     payload = {"cc": cc, "phone_number": local_number, "verified_name": verified_name}
-    r = s.post(
-        url,
-        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-        json=payload,
-        timeout=30
-    )
+    r = _post(proxy_str, url, token, payload)
+    if r.status_code == 200:
+        invalidate_waba(waba_id)
     return r
 
 def request_code(api_version: str, token: str, phone_id: str, code_method: str, language: str, proxy_str: str | None):
-    s = _session_with_proxy(proxy_str)
-    url = f"https://graph.facebook.com/{api_version}/{phone_id}/request_code"
+    url = f"{graph_url()}/{api_version}/{phone_id}/request_code"
     payload = {"code_method": code_method, "language": language}
-    r = s.post(url, headers={"Authorization": f"Bearer {token}"}, json=payload, timeout=30)
-    return r
+    return _post(proxy_str, url, token, payload)
 
 def verify_code(api_version: str, token: str, phone_id: str, code: str, proxy_str: str | None):
-    s = _session_with_proxy(proxy_str)
-    url = f"https://graph.facebook.com/{api_version}/{phone_id}/verify_code"
+    url = f"{graph_url()}/{api_version}/{phone_id}/verify_code"
     payload = {"code": code}
-    r = s.post(url, headers={"Authorization": f"Bearer {token}"}, json=payload, timeout=30)
-    return r
+    return _post(proxy_str, url, token, payload)
 
-def register_number(api_version: str, token: str, phone_id: str, pin: str, proxy_str: str | None):
-    s = _session_with_proxy(proxy_str)
-    url = f"https://graph.facebook.com/{api_version}/{phone_id}/register"
+def register_number(api_version: str, token: str, phone_id: str, pin: str, proxy_str: str | None,
+                    waba_id: str | None = None):
+    url = f"{graph_url()}/{api_version}/{phone_id}/register"
     payload = {"messaging_product": "whatsapp", "pin": pin}
-    r = s.post(url, headers={"Authorization": f"Bearer {token}"}, json=payload, timeout=30)
+    r = _post(proxy_str, url, token, payload)
+    if r.status_code == 200 and waba_id:
+        invalidate_waba(waba_id)
     return r
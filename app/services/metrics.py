@@ -0,0 +1,198 @@
+import time
+import bisect
+import threading
+from urllib.parse import urlsplit
+from .. import db
+from ..config import Config
+from ..models import JobItem
+
+# In-process metrics in the Prometheus text format (served by /admin/metrics).
+# Everything lives in memory and is rendered on scrape; the only query is the
+# job queue depth. Label values are bounded: Graph calls are labelled by edge,
+# SMS24h calls by action, add-phone steps by the step names of the event log.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+GRAPH_EDGES = {"phone_numbers", "message_templates", "request_code", "verify_code", "register"}
+
+def _fmt_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(self.labels, k)} {_num(v)}" for k, v in items]
+
+class Gauge(Counter):
+    """Set/inc/dec gauge; `fn` makes it a callback gauge evaluated on scrape."""
+    kind = "gauge"
+
+    def __init__(self, name, doc, labels=(), fn=None):
+        super().__init__(name, doc, labels)
+        self.fn = fn
+
+    def dec(self, *labels, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        with self._lock:
+            self._values[labels] = float(value)
+
+    def render(self) -> list[str]:
+        if self.fn is not None:
+            for labels, value in self.fn():
+                self.set(*labels, value=value)
+        return super().render()
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+        self._values: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, *labels, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(labels)
+            if v is None:
+                v = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = self.header()
+        for k, v in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, v):
+                cumulative += n
+                le = 'le="%s"' % _num(bound)
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, le)} {cumulative}")
+            inf = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, inf)} {v[-1]}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, k)} {repr(float(v[-2]))}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, k)} {v[-1]}")
+        return out
+
+_registry: list[_Metric] = []
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+def render() -> str:
+    lines = []
+    for m in _registry:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+# --- upstream calls (services.http / services.async_http) ---
+
+UPSTREAM_SECONDS = _register(Histogram(
+    "upstream_request_seconds", "Latency of Graph / SMS24h calls (network time, after throttling)",
+    ("upstream", "endpoint")))
+UPSTREAM_REQUESTS = _register(Counter(
+    "upstream_requests_total", "Graph / SMS24h calls by outcome (HTTP status, error, circuit_open, rate_limited)",
+    ("upstream", "endpoint", "status")))
+UPSTREAM_IN_FLIGHT = _register(Gauge(
+    "upstream_in_flight", "Graph / SMS24h calls currently waiting for a response", ("upstream",)))
+
+_sms24h_host = urlsplit(Config.SMS24H_BASE_URL).netloc
+
+def classify(url: str, params: dict | None) -> tuple[str, str]:
+    """(upstream, endpoint) labels for a call."""
+    parts = urlsplit(url)
+    params = params or {}
+    if parts.netloc == _sms24h_host or ("action" in params and "api_key" in params):
+        return "sms24h", str(params.get("action") or "unknown")
+    last = parts.path.rstrip("/").rsplit("/", 1)[-1]
+    return "graph", last if last in GRAPH_EDGES else "node"
+
+def upstream_done(upstream: str, endpoint: str, status, seconds: float | None = None) -> None:
+    UPSTREAM_REQUESTS.inc(upstream, endpoint, str(status))
+    if seconds is not None:
+        UPSTREAM_SECONDS.observe(upstream, endpoint, value=seconds)
+
+# --- add-phone flow ---
+
+FLOW_STEP_SECONDS = _register(Histogram(
+    "add_phone_step_seconds", "Duration of add-phone steps (get_waba_name, sms24h_get_number, otp_wait, ...)",
+    ("step",)))
+FLOW_SECONDS = _register(Histogram(
+    "add_phone_run_seconds", "Duration of one WABA's add-phone run", ("outcome",)))
+FLOW_IN_FLIGHT = _register(Gauge("add_phone_in_flight", "WABAs currently in the add-phone flow"))
+
+def observe_step(step: str, latency_ms: int | None) -> None:
+    if latency_ms is not None:
+        FLOW_STEP_SECONDS.observe(step, value=latency_ms / 1000.0)
+
+class track_flow:
+    """Context manager around one add-phone run; set .ok before leaving."""
+
+    def __init__(self):
+        self.ok = False
+
+    def __enter__(self):
+        self.t0 = time.monotonic()
+        FLOW_IN_FLIGHT.inc()
+        return self
+
+    def __exit__(self, *exc):
+        FLOW_IN_FLIGHT.dec()
+        FLOW_SECONDS.observe("done" if self.ok else "failed", value=time.monotonic() - self.t0)
+        return False
+
+# --- sync ---
+
+SYNC_WABA_SECONDS = _register(Histogram(
+    "sync_waba_seconds", "Time to sync one WABA (Graph reads, cache hits included)", ("outcome",)))
+
+# --- job queue (read on scrape) ---
+
+def _queue_depth():
+    rows = (
+        db.session.query(JobItem.status, db.func.count())
+        .filter(JobItem.status.in_(["queued", "running"]))
+        .group_by(JobItem.status)
+        .all()
+    )
+    counts = {"queued": 0, "running": 0, **dict(rows)}
+    return [((status,), n) for status, n in counts.items()]
+
+QUEUE_DEPTH = _register(Gauge("job_queue_items", "Job items by status", ("status",), fn=_queue_depth))
@@ -0,0 +1,155 @@
+import time
+import atexit
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .sms24h import sms24h_get_number, sms24h_cancel
+
+class _Slot:
+    """Warm numbers for one (SMS24h account, service, country, operator) combination."""
+
+    def __init__(self, api_key: str, base_url: str, service: str, country: str, operator: str, cc: str):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.service = service
+        self.country = country
+        self.operator = operator
+        self.cc = cc
+        self.proxy_str: str | None = None
+        self.numbers: deque[tuple[str, str, float]] = deque()  # (activation_id, full_phone, bought_at)
+        self.buying = 0
+        self.last_demand = 0.0
+        self.retry_at = 0.0
+
+class NumberPool:
+    """
+    Keeps `size` pre-purchased SMS24h numbers per combination while add-phone
+    attempts are asking for them, so the next attempt (or the replacement for a
+    number Meta rejected) starts without a getNumber round-trip.
+    Numbers with the wrong country prefix are cancelled at purchase; pooled numbers
+    are cancelled after max_age seconds (keep it below the SMS24h activation
+    lifetime) or once nobody has asked for one in idle_seconds.
+    """
+
+    RETRY_AFTER_FAILURE = 5.0
+
+    def __init__(self, size: int = 3, max_age: float = 600.0, idle_seconds: float = 60.0, workers: int = 4):
+        self.size = max(0, size)
+        self.max_age = max_age
+        self.idle_seconds = idle_seconds
+        self._slots: dict[tuple, _Slot] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="number-pool")
+        self._thread = threading.Thread(target=self._loop, name="number-pool", daemon=True)
+        self._thread.start()
+
+    def take(self, api_key: str, base_url: str, service: str, country: str, operator: str,
+             cc: str, proxy_str: str | None) -> tuple[str | None, str | None]:
+        """A warm number if there is one, otherwise a direct purchase (same result as sms24h_get_number)."""
+        key = (base_url, api_key, service, country, operator, cc)
+        now = time.monotonic()
+        stale = []
+        hit = None
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _Slot(api_key, base_url, service, country, operator, cc)
+            slot.last_demand = now
+            slot.proxy_str = proxy_str
+            while slot.numbers:
+                activation_id, full_phone, bought_at = slot.numbers.popleft()
+                if now - bought_at < self.max_age:
+                    hit = (activation_id, full_phone)
+                    break
+                stale.append(activation_id)
+        self._wake.set()  # refill behind us
+
+        for activation_id in stale:
+            self._pool.submit(self._cancel, slot, activation_id)
+        if hit:
+            return hit
+        return sms24h_get_number(
+            api_key=api_key, base_url=base_url, service=service,
+            country=country, operator=operator, proxy_str=proxy_str,
+        )
+
+    def warm_count(self) -> int:
+        with self._lock:
+            return sum(len(s.numbers) for s in self._slots.values())
+
+    def drain(self) -> None:
+        """Cancels every pooled number (shutdown)."""
+        with self._lock:
+            items = [(s, n[0]) for s in self._slots.values() for n in s.numbers]
+            for s in self._slots.values():
+                s.numbers.clear()
+        for slot, activation_id in items:
+            self._cancel(slot, activation_id)
+
+    def _cancel(self, slot: _Slot, activation_id: str) -> None:
+        try:
+            sms24h_cancel(slot.api_key, slot.base_url, activation_id, slot.proxy_str)
+        except Exception:
+            pass
+
+    def _buy(self, slot: _Slot) -> None:
+        try:
+            activation_id, full_phone = sms24h_get_number(
+                api_key=slot.api_key, base_url=slot.base_url, service=slot.service,
+                country=slot.country, operator=slot.operator, proxy_str=slot.proxy_str,
+            )
+        except Exception:
+            activation_id, full_phone = None, None
+        keep = False
+        with self._lock:
+            slot.buying -= 1
+            if not activation_id:
+                slot.retry_at = time.monotonic() + self.RETRY_AFTER_FAILURE  # e.g. NO_NUMBERS
+            elif str(full_phone).startswith(slot.cc):
+                keep = time.monotonic() - slot.last_demand <= self.idle_seconds
+                if keep:
+                    slot.numbers.append((str(activation_id), str(full_phone), time.monotonic()))
+        if activation_id and not keep:
+            self._cancel(slot, str(activation_id))
+        if keep:
+            self._wake.set()
+
+    def _loop(self) -> None:
+        while True:
+            now = time.monotonic()
+            to_cancel = []
+            to_buy = []
+            with self._lock:
+                for slot in self._slots.values():
+                    while slot.numbers and now - slot.numbers[0][2] >= self.max_age:
+                        to_cancel.append((slot, slot.numbers.popleft()[0]))
+                    if now - slot.last_demand > self.idle_seconds:
+                        to_cancel += [(slot, n[0]) for n in slot.numbers]
+                        slot.numbers.clear()
+                        continue
+                    if now < slot.retry_at:
+                        continue
+                    missing = self.size - len(slot.numbers) - slot.buying
+                    if missing > 0:
+                        slot.buying += missing
+                        to_buy += [slot] * missing
+
+            for slot, activation_id in to_cancel:
+                self._pool.submit(self._cancel, slot, activation_id)
+            for slot in to_buy:
+                self._pool.submit(self._buy, slot)
+
+            self._wake.wait(1.0)
+            self._wake.clear()
+
+_number_pool: NumberPool | None = None
+_number_pool_lock = threading.Lock()
+
+def get_number_pool(size: int = 3, max_age: float = 600.0, idle_seconds: float = 60.0) -> NumberPool:
+    global _number_pool
+    with _number_pool_lock:
+        if _number_pool is None:
+            _number_pool = NumberPool(size, max_age, idle_seconds)
+            atexit.register(_number_pool.drain)
+        return _number_pool
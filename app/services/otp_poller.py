@@ -0,0 +1,172 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from .sms24h import sms24h_get_status
+
+class _Waiter:
+    def __init__(self, api_key: str, base_url: str, activation_id: str, proxy_str: str | None, interval: float,
+                 on_done=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.activation_id = activation_id
+        self.proxy_str = proxy_str
+        self.interval = interval
+        self.next_check = time.monotonic()
+        self.last_status = ""
+        self.done = threading.Event()
+        self.on_done = on_done  # called from a poller thread once done is set
+
+    def finish(self) -> None:
+        self.done.set()
+        if self.on_done is not None:
+            self.on_done()
+
+def _is_final(status: str) -> bool:
+    if status == "STATUS_CANCEL":
+        return True
+    if status.startswith("STATUS_OK"):
+        code = status.split(":", 1)[1] if ":" in status else ""
+        return any(c.isdigit() for c in code)
+    return False
+
+class OtpPoller:
+    """
+    Single background loop that checks every outstanding SMS24h activation.
+    Each activation starts at min_interval and backs off to max_interval;
+    waiters are woken as soon as STATUS_OK (with a code) or STATUS_CANCEL arrives.
+    Several waiters on one activation share its checks. A round waits at most
+    min_interval for its checks: a slow one stays in flight and its activation
+    is skipped until it returns, without holding up the others.
+    """
+
+    def __init__(self, min_interval: float = 2.0, max_interval: float = 12.0, workers: int = 8):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._pending: dict[str, list[_Waiter]] = {}
+        self._in_flight: set[str] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="otp-poll")
+        self._thread = threading.Thread(target=self._loop, name="otp-poller", daemon=True)
+        self._thread.start()
+
+    def wait(self, api_key: str, base_url: str, activation_id: str, proxy_str: str | None, timeout: float) -> str:
+        """Blocks until a final status or timeout. Returns the last status seen ("" if none)."""
+        w = _Waiter(api_key, base_url, str(activation_id), proxy_str, self.min_interval)
+        self._add(w)
+        try:
+            w.done.wait(timeout)
+        finally:
+            self._remove(w)
+        return w.last_status
+
+    async def wait_async(self, api_key: str, base_url: str, activation_id: str, proxy_str: str | None,
+                         timeout: float) -> str:
+        """wait() for coroutines: the loop is woken from the poller thread, nothing blocks it."""
+        loop = asyncio.get_running_loop()
+        woken = loop.create_future()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(None))
+            except RuntimeError:
+                pass  # loop already closed
+
+        w = _Waiter(api_key, base_url, str(activation_id), proxy_str, self.min_interval, on_done=wake)
+        self._add(w)
+        try:
+            await asyncio.wait_for(woken, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._remove(w)
+        return w.last_status
+
+    def _add(self, w: _Waiter) -> None:
+        with self._lock:
+            waiters = self._pending.setdefault(w.activation_id, [])
+            if waiters:
+                # join the activation's schedule instead of restarting it
+                w.interval, w.next_check = waiters[0].interval, waiters[0].next_check
+            waiters.append(w)
+        self._wake.set()
+
+    def _remove(self, w: _Waiter) -> None:
+        with self._lock:
+            waiters = self._pending.get(w.activation_id, [])
+            if w in waiters:
+                waiters.remove(w)
+            if not waiters:
+                self._pending.pop(w.activation_id, None)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(ws) for ws in self._pending.values())
+
+    def _check(self, activation_id: str) -> None:
+        with self._lock:
+            waiters = list(self._pending.get(activation_id, []))
+        if not waiters:
+            return
+        w = waiters[0]
+        try:
+            st = sms24h_get_status(
+                api_key=w.api_key,
+                base_url=w.base_url,
+                activation_id=w.activation_id,
+                proxy_str=w.proxy_str,
+            )
+        except Exception:
+            st = ""
+        interval = min(w.interval * 1.5, self.max_interval)
+        next_check = time.monotonic() + interval
+        for x in waiters:
+            x.last_status = st or x.last_status
+            if _is_final(st):
+                x.finish()
+            else:
+                x.interval, x.next_check = interval, next_check
+
+    def _finished(self, activation_id: str) -> None:
+        with self._lock:
+            self._in_flight.discard(activation_id)
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while True:
+            self._wake.clear()  # before the scan, so a wake during it is not lost
+            now = time.monotonic()
+            with self._lock:
+                due = [aid for aid, ws in self._pending.items()
+                       if aid not in self._in_flight and ws
+                       and ws[0].next_check <= now and not ws[0].done.is_set()]
+                self._in_flight.update(due)
+
+            # one batched round: all due activations checked concurrently
+            futures = []
+            for aid in due:
+                fut = self._pool.submit(self._check, aid)
+                fut.add_done_callback(lambda _f, aid=aid: self._finished(aid))
+                futures.append(fut)
+            try:
+                for _ in as_completed(futures, timeout=self.min_interval):
+                    pass
+            except FutureTimeout:
+                pass  # stragglers finish in the background
+
+            with self._lock:
+                upcoming = [ws[0].next_check for aid, ws in self._pending.items()
+                            if ws and aid not in self._in_flight and not ws[0].done.is_set()]
+            sleep_for = (min(upcoming) - time.monotonic()) if upcoming else 60.0
+            self._wake.wait(max(0.05, sleep_for))
+
+_poller: OtpPoller | None = None
+_poller_lock = threading.Lock()
+
+def get_otp_poller(min_interval: float = 2.0, max_interval: float = 12.0, workers: int = 8) -> OtpPoller:
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = OtpPoller(min_interval, max_interval, workers)
+        return _poller
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from .. import db
+from ..models import BalanceTx, OtpDailyStat, DataMigration
+
+TX_KIND_OTP = "otp"
+
+def bump_otp_rollup(user_id: int, day=None) -> None:
+    """+1 on today's row, inside the caller's transaction (same commit as the debit)."""
+    day = day or datetime.utcnow().date()
+    dialect = db.engine.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(OtpDailyStat).values(user_id=user_id, day=day, count=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[OtpDailyStat.user_id, OtpDailyStat.day],
+            set_={"count": OtpDailyStat.count + 1},
+        )
+        db.session.execute(stmt)
+        return
+
+    res = db.session.execute(
+        sa.update(OtpDailyStat)
+        .where(OtpDailyStat.user_id == user_id, OtpDailyStat.day == day)
+        .values(count=OtpDailyStat.count + 1)
+    )
+    if res.rowcount == 0:
+        db.session.add(OtpDailyStat(user_id=user_id, day=day, count=1))
+
+def otp_stats_by_user() -> dict[int, dict]:
+    """{user_id: {today, week, total}} from one grouped query over the rollup."""
+    today = datetime.utcnow().date()
+    week_start = today - timedelta(days=6)  # last 7 UTC days, today included
+    rows = db.session.execute(
+        sa.select(
+            OtpDailyStat.user_id,
+            sa.func.sum(sa.case((OtpDailyStat.day >= today, OtpDailyStat.count), else_=0)),
+            sa.func.sum(sa.case((OtpDailyStat.day >= week_start, OtpDailyStat.count), else_=0)),
+            sa.func.sum(OtpDailyStat.count),
+        ).group_by(OtpDailyStat.user_id)
+    ).all()
+    return {uid: {"today": int(t or 0), "week": int(w or 0), "total": int(n or 0)} for uid, t, w, n in rows}
+
+BACKFILL_NAME = "otp_stats_backfill"
+
+def backfill_otp_stats() -> None:
+    """One-shot: tag legacy ledger rows with `kind` and build the rollup from them."""
+    if db.session.get(DataMigration, BACKFILL_NAME) is not None:
+        return
+    db.session.execute(
+        sa.update(BalanceTx)
+        .where(BalanceTx.kind == "", BalanceTx.reason.like("OTP recebido%"))
+        .values(kind=TX_KIND_OTP)
+    )
+    db.session.execute(
+        sa.update(BalanceTx)
+        .where(BalanceTx.kind == "", BalanceTx.reason.like("Ajuste Admin%"))
+        .values(kind=sa.case((BalanceTx.amount_cents < 0, "admin_remove"), else_="admin_add"))
+    )
+    db.session.commit()
+
+    if db.session.scalar(sa.select(OtpDailyStat.user_id).limit(1)) is None:
+        counts: dict[tuple[int, object], int] = {}
+        for user_id, created_at in db.session.execute(
+            sa.select(BalanceTx.user_id, BalanceTx.created_at).where(BalanceTx.kind == TX_KIND_OTP)
+        ):
+            key = (user_id, created_at.date())
+            counts[key] = counts.get(key, 0) + 1
+        for (user_id, day), n in counts.items():
+            db.session.add(OtpDailyStat(user_id=user_id, day=day, count=n))
+    db.session.add(DataMigration(name=BACKFILL_NAME))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # another process finished it first (rollup included)
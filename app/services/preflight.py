@@ -0,0 +1,121 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from ..waba_store import load_user_wabas, update_entries
+from . import ledger
+from .meta import get_waba_infos
+from .waba_flow import COUNTRY_CODE_MAP, normalize_verified_name
+
+# Preflight for add-phone jobs: the checks process_one_waba_add_phone would
+# only hit one WABA at a time after the job started, run for the whole
+# selection before anything is bought. Local checks come from one query and
+# the number purchases must fit the balance. With check_graph, tokens are also
+# validated with one Graph multi-ID lookup per token (the results land in the
+# Graph cache, so the flow's get_waba_name is a hit); starting a job skips
+# that and leaves it to the flow's first step, so the POST never waits on
+# Graph. The flow keeps its own checks: state can still change between
+# preflight and lease.
+
+NO_RESULT = ("error", "Sem resposta da pré-verificação")
+
+def _cooldown_message(entry: dict, lock_hours: int, now: float) -> str:
+    received_at = int(entry.get("otp_received_at") or 0)
+    if not entry.get("otp_received") or not received_at:
+        return ""
+    elapsed = now - received_at
+    if elapsed >= lock_hours * 3600:
+        return ""  # expired: the flow clears it
+    remaining_min = int(((lock_hours * 3600) - elapsed) // 60)
+    return f"Cooldown OTP ativo ({lock_hours}h). Faltam ~{remaining_min} min."
+
+def _resumes(entry: dict) -> bool:
+    # a bought number waiting for its OTP: the flow resumes it on the hold it already has
+    return bool(str(entry.get("pending_phone_number_id") or "").strip()
+                and str(entry.get("sms24h_activation_id") or "").strip()
+                and not entry.get("otp_received"))
+
+def preflight_add_phone(user_id: int, waba_ids: list[str], write_errors: bool = True,
+                        check_graph: bool = True) -> dict:
+    """
+    Returns {"viable": [waba_id...], "report": [{"waba_id", "status", "message"}...],
+    "cost_cents", "balance_cents"}. status is "ok", "skip" (already has a phone)
+    or "error". With write_errors, failures go to last_add_phone_error like the
+    flow's own aborts. Without check_graph, only DB-side checks run.
+    """
+    cfg = current_app.config
+    api_version = cfg["META_API_VERSION"]
+    cost = int(cfg["OTP_COST_CENTS"])
+    lock_hours = int(cfg["OTP_LOCK_HOURS"])
+    now = time.time()
+
+    waba_ids = list(dict.fromkeys(str(w).strip() for w in waba_ids if str(w).strip()))
+    entries = {str(e.get("waba_id") or "").strip(): e
+               for e in load_user_wabas(user_id, waba_ids).values() if isinstance(e, dict)}
+    results: dict[str, tuple[str, str]] = {}
+    by_token: dict[str, list[str]] = {}
+
+    country_error = ""
+    if not COUNTRY_CODE_MAP.get(str(cfg["COUNTRY"])):
+        country_error = f"COUNTRY {cfg['COUNTRY']} sem CC mapeado"
+
+    for waba_id in waba_ids:
+        entry = entries.get(waba_id)
+        token = str((entry or {}).get("token") or "").strip()
+        cooldown = _cooldown_message(entry, lock_hours, now) if entry else ""
+        if entry is None:
+            results[waba_id] = ("error", f"WABA {waba_id} não encontrado no bms.json")
+        elif not token:
+            results[waba_id] = ("error", "Token vazio no bms.json")
+        elif str(entry.get("phone_number_id") or "").strip():
+            results[waba_id] = ("skip", "Já possui phone_number_id. Pulando.")
+        elif cooldown:
+            results[waba_id] = ("error", cooldown)
+        elif country_error:
+            results[waba_id] = ("error", country_error)
+        else:
+            by_token.setdefault(token, []).append(waba_id)
+
+    if not check_graph:
+        for ids in by_token.values():
+            results.update((w, ("ok", "")) for w in ids)
+    elif by_token:
+        workers = max(1, min(int(cfg["PREFLIGHT_CONCURRENCY"]), len(by_token)))
+        app = current_app._get_current_object()
+
+        def lookup(item):
+            with app.app_context():
+                return get_waba_infos(api_version, item[0], item[1])
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            lookups = pool.map(lookup, by_token.items())
+            for infos in lookups:
+                for waba_id, (info, err) in infos.items():
+                    if err:
+                        results[waba_id] = ("error", f"get_waba_name: {err}")
+                    elif not normalize_verified_name((info or {}).get("name")):
+                        results[waba_id] = ("error", "verified_name vazio")
+                    else:
+                        results[waba_id] = ("ok", "")
+
+    # one number per WABA up front; WABAs resuming a bought number are already held
+    bal = ledger.balance(user_id) or 0
+    results = {w: results.get(w, NO_RESULT) for w in waba_ids}
+    buying = [w for w in waba_ids if results[w][0] == "ok" and not _resumes(entries[w])]
+    affordable = bal // cost if cost > 0 else len(buying)
+    if len(buying) > affordable:
+        msg = (f"Saldo insuficiente: R$ {bal/100:.2f} cobre {affordable} de {len(buying)} números "
+               f"(R$ {cost/100:.2f} cada).")
+        for waba_id in buying[affordable:]:
+            results[waba_id] = ("error", msg)
+        buying = buying[:affordable]
+
+    if write_errors:
+        update_entries(user_id, {w: {"last_add_phone_error": msg}
+                                 for w, (status, msg) in results.items() if status == "error" and w in entries})
+
+    return {
+        "viable": [w for w in waba_ids if results[w][0] == "ok"],
+        "report": [{"waba_id": w, "status": results[w][0], "message": results[w][1]} for w in waba_ids],
+        "cost_cents": len(buying) * cost,
+        "balance_cents": bal,
+    }
@@ -0,0 +1,158 @@
+import time
+import random
+import threading
+import requests
+from ..config import Config
+
+# Health of each configured proxy, fed by every call made through a
+# services.http session. Attempts pick proxies by score instead of round-robin;
+# proxies that keep failing are quarantined and re-probed in the background.
+
+EWMA_ALPHA = 0.2
+DEFAULT_LATENCY_MS = 500.0
+PROXY_FAILURE_STATUSES = {407, 502, 504}
+
+class ProxyStats:
+    def __init__(self, proxy_str: str):
+        self.proxy_str = proxy_str
+        self.latency_ms = DEFAULT_LATENCY_MS  # EWMA
+        self.success = 1.0                    # EWMA of ok=1 / error=0
+        self.ok = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.quarantined_until = 0.0
+        self.last_error = ""
+        self.last_used = 0.0
+
+    @property
+    def label(self) -> str:
+        # ip:port only, credentials stay out of the admin page
+        return ":".join(self.proxy_str.split(":")[:2])
+
+    def score(self) -> float:
+        return (self.success ** 2) * 1000.0 / max(self.latency_ms, 50.0)
+
+    def quarantined(self, now: float) -> bool:
+        return now < self.quarantined_until
+
+class ProxyManager:
+    def __init__(self, proxies: list[str], quarantine_failures: int = 3,
+                 quarantine_seconds: float = 120.0, probe_interval: float = 60.0, probe_url: str = ""):
+        self.quarantine_failures = quarantine_failures
+        self.quarantine_seconds = quarantine_seconds
+        self.probe_interval = probe_interval
+        self.probe_url = probe_url
+        self._stats: dict[str, ProxyStats] = {p: ProxyStats(p) for p in proxies}
+        self._order = list(proxies)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="proxy-probe", daemon=True)
+        if self._order and probe_url:
+            self._thread.start()
+
+    def _get(self, proxy_str: str) -> ProxyStats:
+        st = self._stats.get(proxy_str)
+        if st is None:
+            st = self._stats[proxy_str] = ProxyStats(proxy_str)
+        return st
+
+    def record(self, proxy_str: str, latency_ms: float, ok: bool, error: str = "") -> None:
+        if not proxy_str:
+            return
+        with self._lock:
+            st = self._get(proxy_str)
+            st.last_used = time.time()
+            st.latency_ms += EWMA_ALPHA * (latency_ms - st.latency_ms)
+            st.success += EWMA_ALPHA * ((1.0 if ok else 0.0) - st.success)
+            if ok:
+                st.ok += 1
+                st.consecutive_errors = 0
+                return
+            st.errors += 1
+            st.consecutive_errors += 1
+            st.last_error = error[:200]
+            if st.consecutive_errors >= self.quarantine_failures:
+                st.quarantined_until = time.monotonic() + self.quarantine_seconds
+
+    def pick(self, exclude: tuple[str, ...] = ()) -> str | None:
+        """Weighted random pick among healthy proxies; None when no proxy is configured."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [self._stats[p] for p in self._order if p not in exclude] or \
+                         [self._stats[p] for p in self._order]
+            if not candidates:
+                return None
+            healthy = [st for st in candidates if not st.quarantined(now)]
+            if not healthy:
+                # everything is quarantined: use the one closest to being re-probed
+                return min(candidates, key=lambda st: st.quarantined_until).proxy_str
+            weights = [st.score() for st in healthy]
+        return random.choices(healthy, weights=weights, k=1)[0].proxy_str
+
+    def probe(self, proxy_str: str) -> bool:
+        """Any HTTP answer through the proxy counts as healthy; lifts or extends the quarantine."""
+        from .http import proxy_url
+        url = proxy_url(proxy_str)
+        t0 = time.monotonic()
+        try:
+            requests.get(self.probe_url, proxies={"http": url, "https": url}, timeout=10)
+            ok, error = True, ""
+        except requests.RequestException as e:
+            ok, error = False, f"probe: {type(e).__name__}: {e}"
+        latency = (time.monotonic() - t0) * 1000
+        with self._lock:
+            st = self._get(proxy_str)
+            if ok:
+                st.quarantined_until = 0.0
+                st.consecutive_errors = 0
+                st.latency_ms = latency
+                st.success = max(st.success, 0.5)  # back in rotation, but below proven proxies
+            else:
+                st.last_error = error[:200]
+                st.quarantined_until = time.monotonic() + self.quarantine_seconds
+        return ok
+
+    def probe_quarantined(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            due = [p for p, st in self._stats.items() if st.quarantined(now)]
+        return sum(1 for p in due if self.probe(p))
+
+    def snapshot(self) -> list[dict]:
+        now = time.monotonic()
+        with self._lock:
+            rows = [{
+                "proxy": st.label,
+                "score": round(st.score(), 2),
+                "latency_ms": int(st.latency_ms),
+                "success_rate": round(st.success * 100, 1),
+                "ok": st.ok,
+                "errors": st.errors,
+                "quarantined_for": max(0, int(st.quarantined_until - now)),
+                "last_error": st.last_error,
+                "last_used": int(st.last_used),
+            } for st in self._stats.values()]
+        return sorted(rows, key=lambda r: (r["quarantined_for"] > 0, -r["score"]))
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                self.probe_quarantined()
+            except Exception:
+                pass
+
+_manager: ProxyManager | None = None
+_manager_lock = threading.Lock()
+
+def get_proxy_manager() -> ProxyManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ProxyManager(
+                Config.PROXIES_RAW,
+                quarantine_failures=Config.PROXY_QUARANTINE_FAILURES,
+                quarantine_seconds=Config.PROXY_QUARANTINE_SECONDS,
+                probe_interval=Config.PROXY_PROBE_INTERVAL,
+                probe_url=Config.PROXY_PROBE_URL,
+            )
+        return _manager
@@ -0,0 +1,52 @@
+import queue
+import threading
+from collections import defaultdict
+
+class PubSub:
+    """In-process fan-out: each subscriber gets its own bounded queue per topic."""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._subs: dict[str, set[queue.Queue]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic: str) -> queue.Queue:
+        q: queue.Queue = queue.Queue(maxsize=self.maxsize)
+        with self._lock:
+            self._subs[topic].add(q)
+        return q
+
+    def unsubscribe(self, topic: str, q: queue.Queue) -> None:
+        with self._lock:
+            subs = self._subs.get(topic)
+            if subs is None:
+                return
+            subs.discard(q)
+            if not subs:
+                del self._subs[topic]
+
+    def publish(self, topic: str, message) -> None:
+        with self._lock:
+            subs = list(self._subs.get(topic, ()))
+        for q in subs:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # slow consumer: drop its oldest message rather than block the publisher
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    q.put_nowait(message)
+                except queue.Full:
+                    pass
+
+hub = PubSub()
+
+def job_topic(job_id: int) -> str:
+    return f"job:{int(job_id)}"
+
+def publish_job(job_id: int, **fields) -> None:
+    """Job progress delta (status/done/failed/current_label/last_message) for SSE listeners."""
+    hub.publish(job_topic(job_id), fields)
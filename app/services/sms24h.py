@@ -1,12 +1,8 @@
-import requests
+from .http import get_session
+from .throttle import CircuitOpenError, RateLimitedError
 
 def _session_with_proxy(proxy_str: str | None):
-    s = requests.Session()
-    if proxy_str:
-        ip, port, user, pwd = proxy_str.split(":")
-        proxy_url = f"http://{user}:{pwd}@{ip}:{port}"
-        s.proxies.update({"http": proxy_url, "https": proxy_url})
-    return s
+    return get_session(proxy_str)
 
 def sms24h_get_number(api_key: str, base_url: str, service: str, country: str, operator: str, proxy_str: str | None):
     s = _session_with_proxy(proxy_str)
@@ -14,7 +10,10 @@ def sms24h_get_number(api_key: str, base_url: str, service: str, country: str, o
     if operator and operator.strip():
         params["operator"] = operator.strip()
 
-    r = s.get(base_url, params=params, timeout=30)
+    try:
+        r = s.get(base_url, params=params, timeout=30)
+    except (CircuitOpenError, RateLimitedError):
+        return None, None  # same as NO_NUMBERS: the caller moves on to its next attempt
     text = (r.text or "").strip()
 
     if text.startswith("ACCESS_NUMBER"):
@@ -0,0 +1,112 @@
+import time
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ..waba_store import load_user_wabas, update_snapshots
+from .throttle import API_BLOCKED_MARK
+from . import metrics
+from .meta import (
+    get_waba_overview,
+    get_waba_name,
+    get_phone_numbers,
+    get_template_counts,
+)
+
+EMPTY_COUNTS = {"APPROVED": 0, "PAUSED": 0, "DISABLED": 0, "OTHER": 0}
+
+def sync_one_waba(api_version: str, token: str, waba_id: str) -> tuple[str, dict]:
+    """
+    Fetches one WABA from Meta and returns (outcome, snapshot_fields),
+    outcome in ok/blocked/error.
+    """
+    waba_name, phones, template_counts, err = get_waba_overview(api_version, token, waba_id)
+
+    if err and API_BLOCKED_MARK not in err:
+        # The expanded call fails as a whole (e.g. no permission on one edge);
+        # fall back to the three separate reads so partial data is still kept.
+        waba_name, err_name = get_waba_name(api_version, token, waba_id)
+        phones, err_phones = get_phone_numbers(api_version, token, waba_id)
+        template_counts, err_tpl = get_template_counts(api_version, token, waba_id)
+        err = " ".join(e for e in (err_name, err_phones, err_tpl) if e)
+
+    now = int(time.time())
+
+    if err and API_BLOCKED_MARK in err:
+        return "blocked", {
+            "waba_name": "—",
+            "phone_numbers": [],
+            "template_counts": dict(EMPTY_COUNTS),
+            "last_error": "",
+            "status_label": "Developers Travado",
+            "last_sync_at": now,
+        }
+
+    return ("error" if err else "ok"), {
+        "waba_name": waba_name or "—",
+        "phone_numbers": phones or [],
+        "template_counts": dict(template_counts or EMPTY_COUNTS),
+        "last_error": (err or "")[:900],
+        "status_label": "Erro" if err else "OK",
+        "last_sync_at": now,
+    }
+
+def _timed_sync(api_version: str, token: str, waba_id: str) -> tuple[str, dict]:
+    t0 = time.monotonic()
+    outcome = "error"
+    try:
+        outcome, fields = sync_one_waba(api_version, token, waba_id)
+        return outcome, fields
+    finally:
+        metrics.SYNC_WABA_SECONDS.observe(outcome, value=time.monotonic() - t0)
+
+def _in_app(app, fn, *args):
+    # Graph reads take their settings from current_app
+    with app.app_context():
+        return fn(*args)
+
+def sync_user_wabas(user_id: int, api_version: str, max_workers: int = 8,
+                    waba_ids: list[str] | None = None, write_batch: int = 50) -> dict:
+    """
+    Syncs the user's WABAs (or only `waba_ids`) with a bounded fan-out.
+    Snapshot writes are coalesced: one transaction per `write_batch` results.
+    """
+    bms = load_user_wabas(user_id, waba_ids)
+
+    targets = []
+    no_token = {}
+    for data in bms.values():
+        if not isinstance(data, dict):
+            continue
+        waba_id = str(data.get("waba_id") or "").strip()
+        token = (data.get("token") or "").strip()
+        if not waba_id:
+            continue
+        if not token:
+            no_token[waba_id] = {"last_error": "Token vazio", "status_label": "Erro"}
+            continue
+        targets.append((waba_id, token))
+
+    update_snapshots(user_id, no_token)
+
+    counts = {"ok": 0, "blocked": 0, "error": 0}
+    if not targets:
+        return counts
+
+    app = current_app._get_current_object()
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as pool:
+        futures = {pool.submit(_in_app, app, _timed_sync, api_version, token, waba_id): waba_id
+                   for waba_id, token in targets}
+        for fut in as_completed(futures):
+            waba_id = futures[fut]
+            try:
+                outcome, fields = fut.result()
+            except Exception as e:
+                outcome, fields = "error", {"last_error": f"EXCEPTION: {type(e).__name__}: {e}"[:900], "status_label": "Erro"}
+            counts[outcome] += 1
+            pending[waba_id] = fields
+            if len(pending) >= write_batch:
+                update_snapshots(user_id, pending)
+                pending = {}
+
+    update_snapshots(user_id, pending)
+    return counts
@@ -0,0 +1,152 @@
+import os
+import time
+import uuid
+import socket
+import threading
+from collections import defaultdict
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from .. import db
+from ..models import User, WabaEntry, ServiceLease
+from .sync import sync_user_wabas
+from .throttle import TokenBucket
+
+LEASE_NAME = "sync_scheduler"
+
+class SyncScheduler:
+    """
+    Keeps every user's snapshots fresh in the background.
+    Each tick picks the most overdue WABAs (age / interval for their status_label),
+    limited by a global Graph request budget, and syncs them per user.
+    Only the process holding the "sync_scheduler" lease scans for stale WABAs;
+    any process syncs the WABAs its own users requested (request_sync).
+    """
+
+    def __init__(self, app):
+        cfg = app.config
+        self.app = app
+        self.tick = float(cfg["SYNC_SCHEDULER_TICK"])
+        self.intervals = {
+            "OK": int(cfg["SYNC_INTERVAL_OK"]),
+            "Erro": int(cfg["SYNC_INTERVAL_ERROR"]),
+            "Developers Travado": int(cfg["SYNC_INTERVAL_BLOCKED"]),
+        }
+        budget = float(cfg["SYNC_BUDGET_PER_MIN"])
+        self.bucket = TokenBucket(budget / 60.0, budget)
+        self.cost = max(1, int(cfg["SYNC_REQUESTS_PER_WABA"]))
+        self.concurrency = int(cfg["SYNC_CONCURRENCY"])
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = int(self.tick * 3) + 30
+        self._requested: dict[int, set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="sync-scheduler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def request_sync(self, user_id: int, waba_ids: list[str]) -> None:
+        """Queues WABAs ahead of the staleness order (e.g. right after an import)."""
+        with self._lock:
+            self._requested[int(user_id)].update(str(w) for w in waba_ids)
+        self._wake.set()
+
+    def _hold_lease(self, now: int) -> bool:
+        """Takes or renews the scheduler lease; False while another process holds it."""
+        res = db.session.execute(
+            sa.update(ServiceLease)
+            .where(ServiceLease.name == LEASE_NAME,
+                   sa.or_(ServiceLease.owner == self.owner, ServiceLease.expires_at < now))
+            .values(owner=self.owner, expires_at=now + self.lease_seconds)
+        )
+        if res.rowcount == 1:
+            db.session.commit()
+            return True
+        db.session.rollback()
+        try:
+            db.session.add(ServiceLease(name=LEASE_NAME, owner=self.owner, expires_at=now + self.lease_seconds))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+
+    def _due(self, now: int, limit: int) -> list[tuple[int, str]]:
+        """The `limit` most overdue WABAs of non-banned users, most overdue first."""
+        if limit <= 0:
+            return []
+        # indexed columns only; the entry JSON is never parsed here
+        interval = sa.case(
+            *[(WabaEntry.status_label == label, seconds) for label, seconds in self.intervals.items() if label != "OK"],
+            else_=self.intervals["OK"],
+        )
+        never = WabaEntry.last_sync_at == 0
+        rows = (
+            db.session.query(WabaEntry.user_id, WabaEntry.waba_id)
+            .join(User, User.id == WabaEntry.user_id)
+            .filter(User.is_banned.is_(False))
+            .filter(sa.or_(never, WabaEntry.last_sync_at <= now - interval))
+            .order_by(never.desc(), ((now - WabaEntry.last_sync_at) * 1.0 / interval).desc())
+            .limit(limit)
+            .all()
+        )
+        return [(user_id, waba_id) for user_id, waba_id in rows]
+
+    def run_once(self) -> int:
+        now = int(time.time())
+        with self._lock:
+            requested = self._requested
+            self._requested = defaultdict(set)
+
+        # the budget is in Graph requests; a WABA costs self.cost of them
+        tokens = self.bucket.take_up_to(int(self.bucket.capacity))
+        slots = tokens // self.cost
+        queue = [(uid, w) for uid, ws in requested.items() for w in ws]
+        granted = queue[:slots]
+
+        # what did not fit in the budget stays requested for the next tick
+        with self._lock:
+            for uid, waba_id in queue[slots:]:
+                self._requested[uid].add(waba_id)
+
+        if len(granted) < slots and self._hold_lease(now):
+            extra = slots - len(granted)
+            stale = self._due(now, extra + len(queue))
+            granted += [(uid, w) for uid, w in stale if w not in requested.get(uid, ())][:extra]
+
+        self.bucket.put_back(tokens - len(granted) * self.cost)
+
+        picked: dict[int, list[str]] = defaultdict(list)
+        for uid, waba_id in granted:
+            picked[uid].append(waba_id)
+
+        api_version = self.app.config["META_API_VERSION"]
+        for uid, waba_ids in picked.items():
+            sync_user_wabas(uid, api_version, max_workers=self.concurrency, waba_ids=waba_ids)
+        return len(granted)
+
+    def _loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.run_once()
+            except Exception:
+                self.app.logger.exception("sync scheduler tick failed")
+            self._wake.wait(self.tick)
+            self._wake.clear()
+
+_scheduler: SyncScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+def start_sync_scheduler(app) -> SyncScheduler:
+    global _scheduler
+    if _scheduler is not None:
+        return _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = SyncScheduler(app)
+            _scheduler.start()
+        return _scheduler
+
+def get_sync_scheduler() -> SyncScheduler | None:
+    return _scheduler
@@ -0,0 +1,390 @@
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urlsplit
+import requests
+from ..config import Config
+
+# Client-side rate limiting and circuit breaking for every outbound call made
+# through services.http sessions. Buckets exist per upstream host, per Graph
+# token and per proxy; breakers per upstream endpoint, per token and per proxy.
+# Graph endpoint breakers are per token too, so one broken WABA/token (or the
+# background sync hitting 5xx) doesn't stop every other user's add-phone.
+# SMS24h cancels (setStatus, the refund) have their own bucket, skip breakers
+# and wait for their slot however long it takes: a refund is never dropped.
+
+API_BLOCKED_MARK = "API access blocked."
+
+# Graph error codes that mean "slow down" (app, user, page, WABA and pair rate limits)
+GRAPH_THROTTLE_CODES = {4, 17, 32, 613, 80001, 80002, 80003, 80004, 80005, 80006, 80007, 80008, 130429}
+
+SMS24H_FAILURE_BODIES = ("NO_NUMBERS", "NO_BALANCE", "ERROR_SQL")
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request while its breaker is open."""
+
+class RateLimitedError(requests.ConnectionError):
+    """Raised when no request slot became free within THROTTLE_MAX_WAIT."""
+
+class UnsentResponse:
+    """
+    Stands in for the response of a call the throttle refused to send, so the
+    add-phone flow takes its usual "status_code != 200" path (cancel + refund).
+    """
+    status_code = None
+
+    def __init__(self, exc: Exception):
+        self.text = f"não enviado: {exc}"
+
+    def json(self):
+        return {}
+
+REFUND_ACTIONS = {"setStatus"}
+
+def token_fingerprint(token: str) -> str:
+    return hashlib.sha1(token.encode("utf-8")).hexdigest()[:12] if token else ""
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.base_rate = rate_per_sec
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take_up_to(self, n: int) -> int:
+        """Takes at most n whole tokens without waiting; returns how many were granted."""
+        with self._lock:
+            self._refill(time.monotonic())
+            granted = int(min(n, self.tokens))
+            self.tokens -= granted
+            return granted
+
+    def put_back(self, n: float) -> None:
+        """Returns tokens taken but not used."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + n)
+
+    def try_take(self) -> float:
+        """Takes one token if available and returns 0, else the seconds until one will be."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / max(self.rate, 1e-6)
+
+    def acquire(self, timeout: float) -> bool:
+        """Waits for one token, up to timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_take()
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def scale(self, factor: float) -> None:
+        """Runs the bucket at factor x its configured rate (usage headers near the limit)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = self.base_rate * factor
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive failures; after the cooldown one
+    trial request is let through (half-open). Each reopening doubles the cooldown.
+    """
+
+    def __init__(self, failures: int, cooldown: float, max_cooldown: float):
+        self.failures = failures
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.open_until = 0.0
+        self.trial = False
+        self.reason = ""
+        self._lock = threading.Lock()
+
+    def allow(self) -> tuple[bool, float, bool]:
+        """(allowed, seconds until retry, this request is the half-open trial)."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.open_until:
+                return False, self.open_until - now, False
+            if self.consecutive >= self.failures:
+                if self.trial:
+                    return False, 1.0, False
+                self.trial = True  # half-open
+                return True, 0.0, True
+            return True, 0.0, False
+
+    def success(self) -> None:
+        with self._lock:
+            self.consecutive = 0
+            self.cooldown = self.base_cooldown
+            self.trial = False
+            self.reason = ""
+
+    def failure(self, reason: str) -> None:
+        with self._lock:
+            self.consecutive += 1
+            self.reason = reason
+            if self.consecutive >= self.failures:
+                if self.trial:
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self.open_until = time.monotonic() + self.cooldown
+            self.trial = False
+
+    def release_trial(self) -> None:
+        """The trial request failed for another breaker's reason: let the next one try."""
+        with self._lock:
+            self.trial = False
+
+    def pause(self, seconds: float, reason: str) -> None:
+        """Server told us to back off (Retry-After / usage headers)."""
+        with self._lock:
+            self.open_until = max(self.open_until, time.monotonic() + seconds)
+            self.reason = reason
+
+    def is_open(self) -> bool:
+        return time.monotonic() < self.open_until
+
+class _Call:
+    def __init__(self, throttle: "Throttle", upstream: str, endpoint: tuple, token: tuple | None, proxy: tuple | None):
+        self.throttle = throttle
+        self.upstream = upstream
+        self.endpoint = endpoint
+        self.token = token
+        self.proxy = proxy
+        self.refund = False
+        self.trials: list[CircuitBreaker] = []
+
+    def breakers(self) -> list[CircuitBreaker]:
+        return [self.throttle._breaker(k) for k in (self.endpoint, self.token, self.proxy) if k]
+
+class Throttle:
+    def __init__(self, cfg=Config):
+        self.enabled = bool(cfg.THROTTLE_ENABLED)
+        self.max_wait = float(cfg.THROTTLE_MAX_WAIT)
+        self.rates = {
+            "graph": (float(cfg.GRAPH_RATE_PER_SEC), float(cfg.GRAPH_BURST)),
+            "graph_token": (float(cfg.GRAPH_TOKEN_RATE_PER_SEC), float(cfg.GRAPH_TOKEN_BURST)),
+            "sms24h": (float(cfg.SMS24H_RATE_PER_SEC), float(cfg.SMS24H_BURST)),
+            "sms24h_refund": (float(cfg.SMS24H_REFUND_RATE_PER_SEC), float(cfg.SMS24H_REFUND_BURST)),
+            "proxy": (float(cfg.PROXY_RATE_PER_SEC), float(cfg.PROXY_BURST)),
+        }
+        self.breaker_args = (int(cfg.BREAKER_FAILURES), float(cfg.BREAKER_COOLDOWN), float(cfg.BREAKER_MAX_COOLDOWN))
+        self.sms24h_host = urlsplit(cfg.SMS24H_BASE_URL).netloc
+        self._buckets: dict[tuple, TokenBucket] = {}
+        self._breakers: dict[tuple, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key: tuple, kind: str) -> TokenBucket:
+        b = self._buckets.get(key)
+        if b is None:
+            with self._lock:
+                b = self._buckets.get(key)
+                if b is None:
+                    b = self._buckets[key] = TokenBucket(*self.rates[kind])
+        return b
+
+    def _breaker(self, key: tuple) -> CircuitBreaker:
+        b = self._breakers.get(key)
+        if b is None:
+            with self._lock:
+                b = self._breakers.get(key)
+                if b is None:
+                    b = self._breakers[key] = CircuitBreaker(*self.breaker_args)
+        return b
+
+    def before(self, url: str, headers: dict | None, params: dict | None, proxy_str: str) -> _Call:
+        """Blocking entry point: breakers, then waits for every bucket (up to max_wait)."""
+        call = self.check(url, headers, params, proxy_str)
+        max_wait = self.max_wait_for(call)
+        for label, bucket in self.buckets(call):
+            if not bucket.acquire(max_wait):
+                self.abort(call)
+                raise RateLimitedError(f"rate limit: no slot for {label} within {max_wait:.0f}s")
+        return call
+
+    def max_wait_for(self, call: _Call) -> float:
+        return float("inf") if call.refund else self.max_wait
+
+    def check(self, url: str, headers: dict | None, params: dict | None, proxy_str: str) -> _Call:
+        """Classifies the call and raises CircuitOpenError if any of its breakers is open."""
+        host = urlsplit(url).netloc
+        if host == self.sms24h_host:
+            upstream = "sms24h"
+            action = str((params or {}).get("action") or "")
+            endpoint = ("sms24h", host, action)
+            token = None
+        else:
+            upstream = "graph"
+            auth = str((headers or {}).get("Authorization") or "")
+            fp = token_fingerprint(auth[7:]) if auth.startswith("Bearer ") else ""
+            endpoint = ("graph", host, fp)
+            token = ("token", fp) if fp else None
+        proxy = ("proxy", proxy_str) if proxy_str else None
+        call = _Call(self, upstream, endpoint, token, proxy)
+        call.refund = upstream == "sms24h" and endpoint[2] in REFUND_ACTIONS
+        if not self.enabled or call.refund:
+            return call
+
+        for key in (call.endpoint, call.token, call.proxy):
+            if not key:
+                continue
+            breaker = self._breaker(key)
+            ok, retry_in, trial = breaker.allow()
+            if trial:
+                call.trials.append(breaker)
+            if not ok:
+                self.abort(call)
+                raise CircuitOpenError(f"circuit open for {key[0]} (retry in {retry_in:.0f}s): {breaker.reason}")
+        return call
+
+    def buckets(self, call: _Call) -> list[tuple[str, TokenBucket]]:
+        """The buckets a call must take a slot from (none when throttling is disabled)."""
+        if not self.enabled:
+            return []
+        if call.refund:
+            return [("sms24h_refund", self._bucket(("sms24h_refund", call.endpoint[1]), "sms24h_refund"))]
+        out = [(call.upstream, self._bucket((call.upstream, call.endpoint[1]), call.upstream))]
+        if call.token:
+            out.append(("token", self._bucket(call.token, "graph_token")))
+        if call.proxy:
+            out.append(("proxy", self._bucket(call.proxy, "proxy")))
+        return out
+
+    def abort(self, call: _Call) -> None:
+        """The call will not be sent: give back any half-open trial it was holding."""
+        for b in call.trials:
+            b.release_trial()
+
+    def after_error(self, call: _Call, exc: Exception) -> None:
+        if not self.enabled:
+            return
+        self._fail(call, call.proxy or call.endpoint, f"{type(exc).__name__}: {exc}"[:200])
+
+    def _fail(self, call: _Call, key: tuple, reason: str) -> CircuitBreaker:
+        target = self._breaker(key)
+        for b in call.trials:
+            if b is not target:
+                b.release_trial()
+        target.failure(reason)
+        return target
+
+    def after_response(self, call: _Call, r: requests.Response) -> None:
+        if not self.enabled:
+            return
+        self._read_usage(call, r)
+
+        failure = self._classify(call, r)
+        if failure is None:
+            for b in call.breakers():
+                b.success()
+            return
+        scope, reason = failure
+        target = self._fail(call, getattr(call, scope) or call.endpoint, reason)
+
+        retry_after = _retry_after(r.headers.get("Retry-After"))
+        if retry_after:
+            target.pause(retry_after, f"Retry-After {retry_after:.0f}s: {reason}")
+
+    def _classify(self, call: _Call, r: requests.Response) -> tuple[str, str] | None:
+        """(breaker scope, reason) for a failed response, None for success."""
+        if call.upstream == "sms24h":
+            body = (r.text or "").strip()
+            if r.status_code >= 500 or body.startswith(SMS24H_FAILURE_BODIES):
+                return "endpoint", f"HTTP {r.status_code}: {body[:100]}"
+            return None
+
+        if r.status_code < 400:
+            return None
+        body = r.text or ""
+        if API_BLOCKED_MARK in body:
+            return "token", API_BLOCKED_MARK
+        if r.status_code == 407:
+            return "proxy", "HTTP 407 proxy auth"
+        if r.status_code >= 500:
+            return "endpoint", f"HTTP {r.status_code}"
+        code = _graph_error_code(body)
+        if r.status_code in (401, 403, 429) or code in GRAPH_THROTTLE_CODES:
+            return "token", f"HTTP {r.status_code} code={code}"
+        return None  # plain 400s are request errors (bad number etc.), not upstream trouble
+
+    def _read_usage(self, call: _Call, r: requests.Response) -> None:
+        # X-App-Usage -> whole app (host bucket); X-Business-Use-Case-Usage -> this token
+        app_pct, _ = _usage(r.headers.get("X-App-Usage"))
+        if app_pct is not None:
+            self._bucket(("graph", call.endpoint[1]), "graph").scale(_usage_factor(app_pct))
+        if call.token is None:
+            return
+        buc_pct, regain_min = _usage(r.headers.get("X-Business-Use-Case-Usage"))
+        if buc_pct is None:
+            return
+        self._bucket(call.token, "graph_token").scale(_usage_factor(buc_pct))
+        if regain_min:
+            self._breaker(call.token).pause(regain_min * 60, f"X-Business-Use-Case-Usage: {buc_pct:.0f}%")
+
+    def open_breakers(self) -> list[dict]:
+        with self._lock:
+            items = list(self._breakers.items())
+        return [
+            {"key": ":".join(str(p) for p in key), "reason": b.reason, "retry_in": max(0, int(b.open_until - time.monotonic()))}
+            for key, b in items if b.is_open()
+        ]
+
+def _retry_after(value: str | None) -> float:
+    try:
+        return max(0.0, float(value)) if value else 0.0
+    except ValueError:
+        return 0.0  # HTTP-date form: not sent by Graph/SMS24h
+
+def _graph_error_code(body: str) -> int | None:
+    try:
+        return int((json.loads(body).get("error") or {}).get("code"))
+    except Exception:
+        return None
+
+def _usage(value: str | None) -> tuple[float | None, float]:
+    """Highest usage percent and estimated minutes to regain access from a Graph usage header."""
+    if not value:
+        return None, 0.0
+    try:
+        data = json.loads(value)
+    except ValueError:
+        return None, 0.0
+    if not isinstance(data, dict):
+        return None, 0.0
+    # X-App-Usage is one dict; X-Business-Use-Case-Usage maps business id -> list of dicts
+    entries = [data] if "call_count" in data else [e for v in data.values() for e in (v or [])]
+    pct, regain = 0.0, 0.0
+    for e in entries:
+        pct = max(pct, *(float(e.get(k) or 0) for k in ("call_count", "total_cputime", "total_time")))
+        regain = max(regain, float(e.get("estimated_time_to_regain_access") or 0))
+    return pct, regain
+
+def _usage_factor(pct: float) -> float:
+    # full speed below 75%, then linearly down to 10% of the rate at 100%
+    if pct < 75:
+        return 1.0
+    return max(0.1, (100 - pct) / 25)
+
+_throttle: Throttle | None = None
+_throttle_lock = threading.Lock()
+
+def get_throttle() -> Throttle:
+    global _throttle
+    with _throttle_lock:
+        if _throttle is None:
+            _throttle = Throttle()
+        return _throttle
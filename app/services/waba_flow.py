@@ -2,9 +2,16 @@ import time
 import traceback
 from flask import current_app
 from .. import db
-from ..models import User, BalanceTx, Job
-from ..json_store import load_user_bms, save_user_bms
-from .sms24h import sms24h_get_number, sms24h_get_status, sms24h_cancel
+from ..models import Job
+from ..waba_store import get_entry, update_entry, mutate_entry
+from .event_log import get_event_log
+from .job_progress import get_job_progress
+from .sms24h import sms24h_get_number, sms24h_cancel
+from .otp_poller import get_otp_poller
+from .number_pool import get_number_pool
+from .proxy_manager import get_proxy_manager
+from . import ledger
+from .otp_stats import TX_KIND_OTP
 from .meta import (
     get_waba_name,
     add_phone_number,
@@ -48,37 +55,23 @@ def normalize_verified_name(value) -> str:
                     return candidate
     return s
 
-def _job_update(job: Job, **fields):
-    for k, v in fields.items():
-        setattr(job, k, v)
-    db.session.commit()
-
 def _update_bms_entry(user_id: int, waba_id: str, patch: dict):
-    bms = load_user_bms(user_id)
-    key = str(waba_id).strip()
-    if key not in bms or not isinstance(bms.get(key), dict):
-        return False
-    entry = bms[key]
-    entry.update(patch)
-    bms[key] = entry
-    save_user_bms(user_id, bms)
-    return True
-
-def _append_debug(user_id: int, waba_id: str, msg: str):
-    bms = load_user_bms(user_id)
-    key = str(waba_id).strip()
-    if key not in bms or not isinstance(bms.get(key), dict):
-        # If the key doesn't exist yet, nothing to append.
-        return
-    entry = bms[key]
-    debug = entry.get("last_add_phone_debug", [])
-    if not isinstance(debug, list):
-        debug = []
-    debug.append(msg[:1200])
-    debug = debug[-30:]  # keep last 30
-    entry["last_add_phone_debug"] = debug
-    bms[key] = entry
-    save_user_bms(user_id, bms)
+    return update_entry(user_id, waba_id, patch)
+
+def _ms(t0: float) -> int:
+    return int((time.monotonic() - t0) * 1000)
+
+def _clear_pending(user_id: int, waba_id: str):
+    _update_bms_entry(user_id, waba_id, {
+        "pending_phone_number_id": "",
+        "sms24h_activation_id": "",
+        "sms24h_full_phone": "",
+        "balance_hold_id": 0,
+    })
+
+def _reset_add_phone_error(entry: dict):
+    entry["last_add_phone_error"] = ""
+    entry.pop("last_add_phone_debug", None)
 
 def _set_error(user_id: int, waba_id: str, msg: str):
     # Always try to write the error if the entry exists
@@ -86,293 +79,425 @@ def _set_error(user_id: int, waba_id: str, msg: str):
     return ok
 
 def _has_balance_for_otp(user_id: int) -> tuple[bool, str]:
+    # advisory only; the binding check is the hold taken per attempt
     cost = int(current_app.config["OTP_COST_CENTS"])
-    u = db.session.get(User, user_id)
-    if not u:
+    bal = ledger.balance(user_id)
+    if bal is None:
         return False, "Usuário não encontrado"
-    if u.balance_cents < cost:
+    if bal < cost:
         return False, f"Saldo insuficiente. Necessário R$ {cost/100:.2f} para iniciar."
     return True, "OK"
 
-def _debit_otp(user_id: int, waba_id: str, phone_number_id: str):
+def _debit_otp(user_id: int, waba_id: str, phone_number_id: str, hold_id: int | None = None):
     cost = int(current_app.config["OTP_COST_CENTS"])
-    u = db.session.get(User, user_id)
-    if not u:
-        return False, "Usuário não encontrado"
-    if u.balance_cents < cost:
-        return False, "Saldo insuficiente para debitar OTP"
-
-    u.balance_cents -= cost
-    tx = BalanceTx(
-        user_id=user_id,
-        amount_cents=-cost,
-        reason=f"OTP recebido (R$ {cost/100:.2f})",
-        waba_id=str(waba_id),
-        phone_number_id=str(phone_number_id or "")
-    )
-    db.session.add(tx)
-    db.session.commit()
-    return True, "OTP debitado"
-
-def process_one_waba_add_phone(user_id: int, waba_id: str, job_id: int) -> bool:
+    reason = f"OTP recebido (R$ {cost/100:.2f})"
+    if hold_id and ledger.capture(hold_id, reason, TX_KIND_OTP, waba_id, phone_number_id):
+        return True, "OTP debitado (reserva capturada)"
+    # no hold (or it was released by recovery): plain conditional debit
+    if ledger.debit(user_id, cost, reason, TX_KIND_OTP, waba_id, phone_number_id):
+        return True, "OTP debitado"
+    return False, "Saldo insuficiente para debitar OTP"
+
+def _job_exists(job_id: int) -> bool:
+    return db.session.get(Job, job_id) is not None
+
+class FlowIO:
     """
-    Returns True if completed OK (or saved phone_id in terms-not-accepted case),
-    False on any failure. ALWAYS tries to write last_add_phone_error/debug to bms.json.
+    Everything one add-phone run reads or writes outside add_phone_steps:
+    database, Graph, SMS24h, the OTP wait, job progress and the event log.
+    Methods are coroutines so the one step sequence serves both engines;
+    this blocking version never suspends (run_blocking drives it) and
+    waba_flow_async.AsyncFlowIO overrides the I/O to await on the engine loop.
     """
-    job = db.session.get(Job, job_id)
-    if not job:
-        return False
 
-    waba_id = str(waba_id).strip()
+    engine = "sync"
+
+    def __init__(self, app, user_id: int, waba_id: str, job_id: int):
+        self.app = app
+        self.cfg = app.config
+        self.user_id = user_id
+        self.waba_id = waba_id
+        self.job_id = job_id
+
+    def log(self, step: str, msg: str, http_status: int | None = None, latency_ms: int | None = None):
+        # append-only, batched (see services.event_log); never touches the WABA row
+        get_event_log(self.app).log(self.job_id, self.user_id, self.waba_id, step, msg,
+                                    http_status=http_status, latency_ms=latency_ms)
+
+    async def job(self, **fields):
+        # buffered in memory (see services.job_progress), no database round trip
+        get_job_progress(self.app).update(self.job_id, **fields)
+
+    async def db(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    async def error(self, msg: str):
+        await self.db(_set_error, self.user_id, self.waba_id, msg)
 
+    async def patch(self, fields: dict):
+        await self.db(_update_bms_entry, self.user_id, self.waba_id, fields)
+
+    async def get_waba_name(self, api_version: str, token: str):
+        return get_waba_name(api_version, token, self.waba_id)
+
+    async def get_number(self, number_pool, service: str, country: str, operator: str, cc: str,
+                         proxy_str: str | None):
+        if number_pool is not None:
+            # warm number when available; the pool refills while this attempt runs
+            return number_pool.take(self.cfg["SMS24H_API_KEY"], self.cfg["SMS24H_BASE_URL"],
+                                    service, country, operator, cc, proxy_str)
+        return sms24h_get_number(self.cfg["SMS24H_API_KEY"], self.cfg["SMS24H_BASE_URL"],
+                                 service, country, operator, proxy_str)
+
+    async def sms24h_cancel(self, activation_id: str, proxy_str: str | None):
+        sms24h_cancel(self.cfg["SMS24H_API_KEY"], self.cfg["SMS24H_BASE_URL"], activation_id, proxy_str)
+
+    async def cancel_number(self, activation_id: str, proxy_str: str | None, hold_id: int | None):
+        # SMS24h refunds the number, so the attempt's balance hold goes back too
+        # (even if the cancel call fails: the user must not pay for it either way).
+        # A failed refund call is logged, not raised: the run goes on to its next attempt.
+        try:
+            await self.sms24h_cancel(activation_id, proxy_str)
+        except Exception as e:
+            self.log("sms24h_cancel", f"cancel of activation {activation_id} failed: {type(e).__name__}: {e}"[:900])
+        finally:
+            await self.db(ledger.release, hold_id)
+
+    def otp_poller(self):
+        # shared poller: one loop checks every pending activation and wakes us on OK/CANCEL
+        return get_otp_poller(
+            min_interval=float(self.cfg["OTP_POLL_MIN_INTERVAL"]),
+            max_interval=float(self.cfg["OTP_POLL_MAX_INTERVAL"]),
+            workers=int(self.cfg["OTP_POLL_WORKERS"]),
+        )
+
+    async def wait_otp(self, activation_id: str, proxy_str: str | None, timeout: float) -> str:
+        return self.otp_poller().wait(self.cfg["SMS24H_API_KEY"], self.cfg["SMS24H_BASE_URL"],
+                                      activation_id, proxy_str, timeout)
+
+    async def add_phone_number(self, api_version: str, token: str, cc: str, local_number: str,
+                               verified_name: str, proxy_str: str | None):
+        return add_phone_number(api_version, token, self.waba_id, cc, local_number, verified_name, proxy_str)
+
+    async def request_code(self, api_version: str, token: str, phone_id: str, code_method: str,
+                           language: str, proxy_str: str | None):
+        return request_code(api_version, token, phone_id, code_method, language, proxy_str)
+
+    async def verify_code(self, api_version: str, token: str, phone_id: str, code: str, proxy_str: str | None):
+        return verify_code(api_version, token, phone_id, code, proxy_str)
+
+    async def register_number(self, api_version: str, token: str, phone_id: str, proxy_str: str | None):
+        return register_number(api_version, token, phone_id, pin="123456", proxy_str=proxy_str, waba_id=self.waba_id)
+
+def run_blocking(coro):
+    """Runs a coroutine that never suspends (the blocking FlowIO) to completion on this thread."""
     try:
-        _job_update(job, last_message="Inicializando...")
-        # Load bms first (so we can log errors into it)
-        bms = load_user_bms(user_id)
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("add_phone_steps suspended under a blocking FlowIO")
+
+async def _finish_with_otp(io: FlowIO, api_version: str, token: str, phone_id: str, otp_code: str,
+                           proxy_str: str | None, hold_id: int | None) -> bool:
+    """OTP in hand: debit, verify_code and register. Shared by fresh attempts and resumed runs."""
+    await io.patch({"otp_received": True, "otp_received_at": int(time.time())})
+
+    ok, msg = await io.db(_debit_otp, io.user_id, io.waba_id, phone_id, hold_id)
+    io.log("debit", f"DEBIT otp -> ok={ok} msg={msg}")
+    if not ok:
+        msg2 = f"OTP chegou mas {msg}"
+        await io.error(msg2)
+        await io.job(last_message=msg2)
+        return False
 
-        if not bms:
-            _job_update(job, last_message="bms.json vazio")
-            return False
+    await io.job(last_message="Verificando OTP (verify_code)...")
+    t0 = time.monotonic()
+    r_ver = await io.verify_code(api_version, token, phone_id, otp_code, proxy_str)
+    io.log("verify_code", f"verify_code body={r_ver.text[:900]}", http_status=r_ver.status_code, latency_ms=_ms(t0))
+
+    if r_ver.status_code != 200:
+        await io.error(f"verify_code falhou: {r_ver.text[:900]}")
+        await io.job(last_message="OTP recebido, mas verify_code falhou. Veja last_add_phone_error.")
+        return False
+
+    await io.job(last_message="Registrando número (register)...")
+    t0 = time.monotonic()
+    r_reg = await io.register_number(api_version, token, phone_id, proxy_str)
+    io.log("register", f"register body={r_reg.text[:900]}", http_status=r_reg.status_code, latency_ms=_ms(t0))
+
+    if r_reg.status_code == 200:
+        await io.patch({
+            "phone_number_id": str(phone_id),
+            "pending_phone_number_id": "",
+            "sms24h_activation_id": "",
+            "sms24h_full_phone": "",
+            "balance_hold_id": 0,
+            "otp_received": False,
+            "otp_received_at": 0,
+            "last_add_phone_error": "",
+        })
+        await io.job(last_message="Número registrado com sucesso!")
+        return True
+
+    await io.error(f"register falhou: {r_reg.text[:900]}")
+    await io.job(last_message="verify ok, mas register falhou. Veja last_add_phone_error.")
+    return False
+
+async def add_phone_steps(io: FlowIO) -> bool:
+    """
+    The add-phone run for io.waba_id, shared by both engines. Returns True if
+    completed OK (or the WABA already has a phone), False on any failure.
+    ALWAYS tries to write last_add_phone_error to the WABA entry; every step
+    is recorded in the job event log (JobEvent).
+    """
+    user_id, waba_id, job_id = io.user_id, io.waba_id, io.job_id
+    cfg = io.cfg
+    hold_id = None
+    activation_id = None  # number bought by this run and not yet cancelled or used
+
+    if not await io.db(_job_exists, job_id):
+        return False
 
-        data = bms.get(waba_id)
+    try:
+        await io.job(last_message="Inicializando...")
+        # Load the entry first (so we can log errors into it)
+        data = await io.db(get_entry, user_id, waba_id)
         if not isinstance(data, dict):
             # If the key isn't present, we can't write inside it.
-            _job_update(job, last_message=f"WABA {waba_id} não encontrado no bms.json")
+            await io.job(last_message=f"WABA {waba_id} não encontrado no bms.json")
             return False
 
-        # reset error/debug every run
-        _update_bms_entry(user_id, waba_id, {"last_add_phone_error": "", "last_add_phone_debug": []})
-        _append_debug(user_id, waba_id, f"START user_id={user_id} waba_id={waba_id} job_id={job_id}")
+        # reset error every run (the old capped debug list now lives in the job event log)
+        await io.db(mutate_entry, user_id, waba_id, _reset_add_phone_error)
+        io.log("start", f"START user_id={user_id} waba_id={waba_id} job_id={job_id} engine={io.engine}")
 
         token = (data.get("token") or "").strip()
         if not token:
-            _set_error(user_id, waba_id, "Token vazio no bms.json")
-            _append_debug(user_id, waba_id, "ABORT token vazio")
-            _job_update(job, last_message="Token vazio")
-            return False
-
-        # ✅ Pre-check saldo
-        ok_bal, msg_bal = _has_balance_for_otp(user_id)
-        _append_debug(user_id, waba_id, f"balance_check ok={ok_bal} msg={msg_bal}")
-        if not ok_bal:
-            _set_error(user_id, waba_id, msg_bal)
-            _job_update(job, last_message=msg_bal)
+            await io.error("Token vazio no bms.json")
+            io.log("abort", "ABORT token vazio")
+            await io.job(last_message="Token vazio")
             return False
 
         existing_phone = str(data.get("phone_number_id") or "").strip()
         if existing_phone:
-            _append_debug(user_id, waba_id, f"SKIP existing phone_number_id={existing_phone}")
-            _job_update(job, last_message="Já possui phone_number_id. Pulando.")
+            io.log("skip", f"SKIP existing phone_number_id={existing_phone}")
+            await io.job(last_message="Já possui phone_number_id. Pulando.")
             return True
 
         otp_received = bool(data.get("otp_received", False))
         otp_received_at = int(data.get("otp_received_at") or 0)
-        lock_hours = int(current_app.config["OTP_LOCK_HOURS"])
+        lock_hours = int(cfg["OTP_LOCK_HOURS"])
         if otp_received and otp_received_at:
             elapsed = time.time() - float(otp_received_at)
             if elapsed < lock_hours * 3600:
                 remaining_min = int(((lock_hours * 3600) - elapsed) // 60)
                 msg = f"Cooldown OTP ativo ({lock_hours}h). Faltam ~{remaining_min} min."
-                _set_error(user_id, waba_id, msg)
-                _append_debug(user_id, waba_id, f"ABORT cooldown elapsed={elapsed}")
-                _job_update(job, last_message=msg)
+                await io.error(msg)
+                io.log("abort", f"ABORT cooldown elapsed={elapsed}")
+                await io.job(last_message=msg)
                 return False
-            _update_bms_entry(user_id, waba_id, {
+            await io.patch({
                 "pending_phone_number_id": "",
                 "sms24h_activation_id": "",
                 "sms24h_full_phone": "",
+                "balance_hold_id": 0,
                 "otp_received": False,
                 "otp_received_at": 0,
             })
-            _append_debug(user_id, waba_id, "cooldown expired -> cleared pending fields")
-
-        api_version = current_app.config["META_API_VERSION"]
-        country = str(current_app.config["COUNTRY"])
-        operator = str(current_app.config["OPERATOR"])
-        service = str(current_app.config["SERVICE"])
-        code_method = str(current_app.config["CODE_METHOD"])
-        language = str(current_app.config["LANGUAGE"])
-        max_wait = int(current_app.config["TEMPO_MAX_ESPERA_OTP"])
-        max_attempts = int(current_app.config["MAX_TENTATIVAS_POR_WABA"])
-        proxies = current_app.config.get("PROXIES_RAW") or []
+            io.log("cooldown", "cooldown expired -> cleared pending fields")
+
+        api_version = cfg["META_API_VERSION"]
+        country = str(cfg["COUNTRY"])
+        operator = str(cfg["OPERATOR"])
+        service = str(cfg["SERVICE"])
+        code_method = str(cfg["CODE_METHOD"])
+        language = str(cfg["LANGUAGE"])
+        max_wait = int(cfg["TEMPO_MAX_ESPERA_OTP"])
+        max_attempts = int(cfg["MAX_TENTATIVAS_POR_WABA"])
+        proxies = get_proxy_manager() if cfg.get("PROXIES_RAW") else None
+        number_pool = None
+        if int(cfg["NUMBER_POOL_SIZE"]) > 0:
+            number_pool = get_number_pool(
+                size=int(cfg["NUMBER_POOL_SIZE"]),
+                max_age=float(cfg["NUMBER_POOL_MAX_AGE"]),
+                idle_seconds=float(cfg["NUMBER_POOL_IDLE_SECONDS"]),
+            )
 
         cc = COUNTRY_CODE_MAP.get(country)
         if not cc:
             msg = f"COUNTRY {country} sem CC mapeado"
-            _set_error(user_id, waba_id, msg)
-            _append_debug(user_id, waba_id, f"ABORT {msg}")
-            _job_update(job, last_message=msg)
+            await io.error(msg)
+            io.log("abort", f"ABORT {msg}")
+            await io.job(last_message=msg)
+            return False
+
+        # Resume: a previous run (worker crash / deploy) left a bought number on this WABA
+        pending_phone = str(data.get("pending_phone_number_id") or "").strip()
+        pending_activation = str(data.get("sms24h_activation_id") or "").strip()
+        pending_hold = int(data.get("balance_hold_id") or 0) or None
+        if pending_phone and pending_activation and not data.get("otp_received"):
+            proxy_str = proxies.pick() if proxies else None
+            await io.job(last_message="Retomando número pendente (aguardando OTP)...")
+            t0 = time.monotonic()
+            st = await io.wait_otp(pending_activation, proxy_str, max_wait)
+            otp_code = _only_digits(st.split(":", 1)[1]) if st.startswith("STATUS_OK") and ":" in st else ""
+            io.log("resume", f"resume phone_id={pending_phone} activation_id={pending_activation} status='{st}'",
+                   latency_ms=_ms(t0))
+            if otp_code:
+                return await _finish_with_otp(io, api_version, token, pending_phone, otp_code, proxy_str, pending_hold)
+
+            await io.cancel_number(pending_activation, proxy_str, pending_hold)
+            await io.db(_clear_pending, user_id, waba_id)
+            io.log("resume", "no OTP for pending number -> canceled, starting over")
+
+        # ✅ Pre-check saldo (after the resume: a pending number is already held, and
+        # its hold is back in the balance once canceled)
+        ok_bal, msg_bal = await io.db(_has_balance_for_otp, user_id)
+        io.log("balance_check", f"balance_check ok={ok_bal} msg={msg_bal}")
+        if not ok_bal:
+            await io.error(msg_bal)
+            await io.job(last_message=msg_bal)
             return False
 
         # Get verified name
-        _job_update(job, last_message="Obtendo nome do WABA (verified_name)...")
-        raw = get_waba_name(api_version, token, waba_id)
-        if isinstance(raw, tuple) and len(raw) == 2:
-            verified_name, err = raw
-            _append_debug(user_id, waba_id, f"get_waba_name tuple err={err} name={verified_name}")
-            if err:
-                msg = f"get_waba_name: {err}"
-                _set_error(user_id, waba_id, msg)
-                _job_update(job, last_message=msg)
-                return False
-        else:
-            verified_name = raw
-            _append_debug(user_id, waba_id, f"get_waba_name raw={verified_name}")
+        await io.job(last_message="Obtendo nome do WABA (verified_name)...")
+        t0 = time.monotonic()
+        verified_name, err = await io.get_waba_name(api_version, token)
+        io.log("get_waba_name", f"get_waba_name tuple err={err} name={verified_name}", latency_ms=_ms(t0))
+        if err:
+            msg = f"get_waba_name: {err}"
+            await io.error(msg)
+            await io.job(last_message=msg)
+            return False
 
         verified_name = normalize_verified_name(verified_name)
-        _append_debug(user_id, waba_id, f"verified_name normalized='{verified_name}'")
+        io.log("verified_name", f"verified_name normalized='{verified_name}'")
         if not verified_name:
             msg = "verified_name vazio"
-            _set_error(user_id, waba_id, msg)
-            _job_update(job, last_message=msg)
+            await io.error(msg)
+            await io.job(last_message=msg)
             return False
 
         # Main attempts
+        proxy_str = None
         for attempt in range(1, max_attempts + 1):
-            proxy_str = proxies[(attempt - 1) % len(proxies)] if proxies else None
-            _job_update(job, last_message=f"Tentativa {attempt}/{max_attempts}: comprando número...")
-
-            activation_id, full_phone = sms24h_get_number(
-                api_key=current_app.config["SMS24H_API_KEY"],
-                base_url=current_app.config["SMS24H_BASE_URL"],
-                service=service,
-                country=country,
-                operator=operator,
-                proxy_str=proxy_str
-            )
-            _append_debug(user_id, waba_id, f"sms24h_get_number -> activation_id={activation_id} full_phone={full_phone}")
+            activation_id = None
+            # healthiest proxy by score, avoiding the one the previous attempt used
+            proxy_str = proxies.pick(exclude=(proxy_str,)) if proxies else None
+            await io.job(last_message=f"Tentativa {attempt}/{max_attempts}: comprando número...")
+
+            hold_id = await io.db(ledger.reserve, user_id, int(cfg["OTP_COST_CENTS"]), job_id, waba_id)
+            io.log("reserve", f"reserve hold_id={hold_id}")
+            if not hold_id:
+                msg = "Saldo insuficiente para reservar o OTP desta tentativa"
+                await io.error(msg)
+                await io.job(last_message=msg)
+                return False
+
+            t0 = time.monotonic()
+            activation_id, full_phone = await io.get_number(number_pool, service, country, operator, cc, proxy_str)
+            io.log("sms24h_get_number",
+                   f"sms24h_get_number{' (pool)' if number_pool is not None else ''} -> activation_id={activation_id} full_phone={full_phone}",
+                   latency_ms=_ms(t0))
 
             if not activation_id:
-                _append_debug(user_id, waba_id, "sms24h_get_number failed (no activation_id)")
+                io.log("sms24h_get_number", "sms24h_get_number failed (no activation_id)")
+                await io.db(ledger.release, hold_id)
                 continue
 
             if not str(full_phone).startswith(cc):
-                _append_debug(user_id, waba_id, f"Phone does not start with CC {cc}: {full_phone} -> cancel")
-                sms24h_cancel(current_app.config["SMS24H_API_KEY"], current_app.config["SMS24H_BASE_URL"], activation_id, proxy_str)
+                io.log("cc_check", f"Phone does not start with CC {cc}: {full_phone} -> cancel")
+                await io.cancel_number(activation_id, proxy_str, hold_id)
                 continue
 
             local_number = str(full_phone)[len(cc):]
 
-            _job_update(job, last_message="Adicionando número no WABA...")
-            r_add = add_phone_number(api_version, token, waba_id, cc, local_number, verified_name, proxy_str)
-            _append_debug(user_id, waba_id, f"add_phone_number status={r_add.status_code} body={r_add.text[:900]}")
+            await io.job(last_message="Adicionando número no WABA...")
+            t0 = time.monotonic()
+            r_add = await io.add_phone_number(api_version, token, cc, local_number, verified_name, proxy_str)
+            io.log("add_phone_number", f"add_phone_number body={r_add.text[:900]}",
+                   http_status=r_add.status_code, latency_ms=_ms(t0))
 
             if r_add.status_code != 200:
-                sms24h_cancel(current_app.config["SMS24H_API_KEY"], current_app.config["SMS24H_BASE_URL"], activation_id, proxy_str)
-                _append_debug(user_id, waba_id, "add_phone_number failed -> canceled activation")
+                await io.cancel_number(activation_id, proxy_str, hold_id)
+                io.log("add_phone_number", "add_phone_number failed -> canceled activation")
                 continue
 
             phone_id = (r_add.json() or {}).get("id")
             if not phone_id:
                 msg = "Meta não retornou phone_id no add_phone"
-                _set_error(user_id, waba_id, msg)
-                _job_update(job, last_message=msg)
+                await io.db(ledger.release, hold_id)
+                await io.error(msg)
+                await io.job(last_message=msg)
                 return False
 
-            _update_bms_entry(user_id, waba_id, {
+            await io.patch({
                 "pending_phone_number_id": str(phone_id),
                 "sms24h_activation_id": str(activation_id),
                 "sms24h_full_phone": str(full_phone),
+                "balance_hold_id": hold_id,
                 "otp_received": False,
                 "otp_received_at": 0,
             })
 
-            _job_update(job, last_message="Solicitando OTP (request_code)...")
-            r_req = request_code(api_version, token, phone_id, code_method, language, proxy_str)
-            _append_debug(user_id, waba_id, f"request_code status={r_req.status_code} body={r_req.text[:900]}")
+            await io.job(last_message="Solicitando OTP (request_code)...")
+            t0 = time.monotonic()
+            r_req = await io.request_code(api_version, token, phone_id, code_method, language, proxy_str)
+            io.log("request_code", f"request_code body={r_req.text[:900]}",
+                   http_status=r_req.status_code, latency_ms=_ms(t0))
 
             if r_req.status_code != 200:
-                msg = f"request_code falhou: {r_req.text[:900]}"
-                _set_error(user_id, waba_id, msg)
-                sms24h_cancel(current_app.config["SMS24H_API_KEY"], current_app.config["SMS24H_BASE_URL"], activation_id, proxy_str)
+                await io.error(f"request_code falhou: {r_req.text[:900]}")
+                await io.cancel_number(activation_id, proxy_str, hold_id)
+                await io.db(_clear_pending, user_id, waba_id)
                 continue
 
-            _job_update(job, last_message="Aguardando OTP (SMS24h)...")
-            start = time.time()
+            await io.job(last_message="Aguardando OTP (SMS24h)...")
+            t0 = time.monotonic()
+            st = await io.wait_otp(activation_id, proxy_str, max_wait)
             otp_code = None
-
-            while time.time() - start < max_wait:
-                st = sms24h_get_status(
-                    api_key=current_app.config["SMS24H_API_KEY"],
-                    base_url=current_app.config["SMS24H_BASE_URL"],
-                    activation_id=activation_id,
-                    proxy_str=proxy_str
-                )
-
-                if st.startswith("STATUS_OK"):
-                    raw_code = st.split(":", 1)[1] if ":" in st else ""
-                    otp_code = _only_digits(raw_code)
-                    _append_debug(user_id, waba_id, f"sms24h STATUS_OK raw='{raw_code}' normalized='{otp_code}'")
-                    if otp_code:
-                        break
-
-                elif st == "STATUS_CANCEL":
-                    _append_debug(user_id, waba_id, "sms24h STATUS_CANCEL")
-                    otp_code = None
-                    break
-
-                time.sleep(12)
+            if st.startswith("STATUS_OK"):
+                raw_code = st.split(":", 1)[1] if ":" in st else ""
+                otp_code = _only_digits(raw_code)
+                io.log("otp_wait", f"sms24h STATUS_OK raw='{raw_code}' normalized='{otp_code}'", latency_ms=_ms(t0))
+            elif st == "STATUS_CANCEL":
+                io.log("otp_wait", "sms24h STATUS_CANCEL", latency_ms=_ms(t0))
 
             if not otp_code:
-                _append_debug(user_id, waba_id, "OTP timeout -> cancel activation")
-                _job_update(job, last_message="Sem OTP → cancelando (reembolso).")
-                sms24h_cancel(current_app.config["SMS24H_API_KEY"], current_app.config["SMS24H_BASE_URL"], activation_id, proxy_str)
+                io.log("otp_wait", "OTP timeout -> cancel activation", latency_ms=_ms(t0))
+                await io.job(last_message="Sem OTP → cancelando (reembolso).")
+                await io.cancel_number(activation_id, proxy_str, hold_id)
+                await io.db(_clear_pending, user_id, waba_id)
                 continue
 
-            _update_bms_entry(user_id, waba_id, {"otp_received": True, "otp_received_at": int(time.time())})
-
-            ok, msg = _debit_otp(user_id, waba_id, phone_id)
-            _append_debug(user_id, waba_id, f"DEBIT otp -> ok={ok} msg={msg}")
-            if not ok:
-                msg2 = f"OTP chegou mas {msg}"
-                _set_error(user_id, waba_id, msg2)
-                _job_update(job, last_message=msg2)
-                return False
-
-            _job_update(job, last_message="Verificando OTP (verify_code)...")
-            r_ver = verify_code(api_version, token, phone_id, otp_code, proxy_str)
-            _append_debug(user_id, waba_id, f"verify_code status={r_ver.status_code} body={r_ver.text[:900]}")
-
-            if r_ver.status_code != 200:
-                msg = f"verify_code falhou: {r_ver.text[:900]}"
-                _set_error(user_id, waba_id, msg)
-                _job_update(job, last_message="OTP recebido, mas verify_code falhou. Veja last_add_phone_error.")
-                return False
-
-            _job_update(job, last_message="Registrando número (register)...")
-            r_reg = register_number(api_version, token, phone_id, pin="123456", proxy_str=proxy_str)
-            _append_debug(user_id, waba_id, f"register status={r_reg.status_code} body={r_reg.text[:900]}")
-
-            if r_reg.status_code == 200:
-                _update_bms_entry(user_id, waba_id, {
-                    "phone_number_id": str(phone_id),
-                    "pending_phone_number_id": "",
-                    "sms24h_activation_id": "",
-                    "sms24h_full_phone": "",
-                    "otp_received": False,
-                    "otp_received_at": 0,
-                    "last_add_phone_error": "",
-                })
-                _job_update(job, last_message="Número registrado com sucesso!")
-                return True
-
-            msg = f"register falhou: {r_reg.text[:900]}"
-            _set_error(user_id, waba_id, msg)
-            _job_update(job, last_message="verify ok, mas register falhou. Veja last_add_phone_error.")
-            return False
+            activation_id = None  # OTP received: the number is used, not refundable
+            return await _finish_with_otp(io, api_version, token, phone_id, otp_code, proxy_str, hold_id)
 
         msg = "Falha após tentativas máximas"
-        _set_error(user_id, waba_id, msg)
-        _job_update(job, last_message=msg)
+        await io.error(msg)
+        await io.job(last_message=msg)
         return False
 
     except Exception as e:
         tb = traceback.format_exc()
-        # We try to write into bms.json if entry exists
-        _set_error(user_id, waba_id, f"EXCEPTION: {type(e).__name__}: {e}")
+        await io.db(db.session.rollback)
         try:
-            _append_debug(user_id, waba_id, "EXCEPTION TRACEBACK:\n" + tb)
+            if activation_id:
+                # e.g. add_phone_number timed out: refund the number with its hold
+                await io.cancel_number(activation_id, proxy_str, hold_id)
+                await io.db(_clear_pending, user_id, waba_id)
+            else:
+                await io.db(ledger.release, hold_id)  # no-op if it was already captured
         except Exception:
-            pass
-        _job_update(job, last_message=f"EXCEPTION: {type(e).__name__}: {e}")
+            await io.db(db.session.rollback)
+        # We try to write into bms.json if entry exists
+        await io.error(f"EXCEPTION: {type(e).__name__}: {e}")
+        io.log("exception", "EXCEPTION TRACEBACK:\n" + tb)
+        await io.job(last_message=f"EXCEPTION: {type(e).__name__}: {e}")
         return False
+
+def process_one_waba_add_phone(user_id: int, waba_id: str, job_id: int) -> bool:
+    """add_phone_steps with blocking I/O, in the caller's app context."""
+    io = FlowIO(current_app._get_current_object(), user_id, str(waba_id).strip(), job_id)
+    return run_blocking(add_phone_steps(io))
@@ -0,0 +1,62 @@
+import asyncio
+from . import async_http as ah
+from .waba_flow import FlowIO, add_phone_steps
+
+# asyncio engine for waba_flow.add_phone_steps (ADD_PHONE_ENGINE=async): the
+# same steps, with HTTP awaited on the engine loop, the OTP wait on the shared
+# poller and database work in the loop's executor.
+
+def _in_app(app, fn, *args, **kwargs):
+    with app.app_context():
+        return fn(*args, **kwargs)
+
+class AsyncFlowIO(FlowIO):
+    engine = "async"
+
+    def __init__(self, app, http: ah.AsyncHttp, user_id: int, waba_id: str, job_id: int):
+        super().__init__(app, user_id, waba_id, job_id)
+        self.http = http
+
+    async def db(self, fn, *args, **kwargs):
+        return await asyncio.to_thread(_in_app, self.app, fn, *args, **kwargs)
+
+    async def get_waba_name(self, api_version: str, token: str):
+        return await ah.get_waba_name(self.http, api_version, token, self.waba_id)
+
+    async def get_number(self, number_pool, service: str, country: str, operator: str, cc: str,
+                         proxy_str: str | None):
+        if number_pool is not None:
+            return await asyncio.to_thread(number_pool.take, self.cfg["SMS24H_API_KEY"], self.cfg["SMS24H_BASE_URL"],
+                                           service, country, operator, cc, proxy_str)
+        return await ah.sms24h_get_number(self.http, self.cfg["SMS24H_API_KEY"], self.cfg["SMS24H_BASE_URL"],
+                                          service, country, operator, proxy_str)
+
+    async def sms24h_cancel(self, activation_id: str, proxy_str: str | None):
+        await ah.sms24h_cancel(self.http, self.cfg["SMS24H_API_KEY"], self.cfg["SMS24H_BASE_URL"],
+                               activation_id, proxy_str)
+
+    async def wait_otp(self, activation_id: str, proxy_str: str | None, timeout: float) -> str:
+        return await self.otp_poller().wait_async(self.cfg["SMS24H_API_KEY"], self.cfg["SMS24H_BASE_URL"],
+                                                  activation_id, proxy_str, timeout)
+
+    async def add_phone_number(self, api_version: str, token: str, cc: str, local_number: str,
+                               verified_name: str, proxy_str: str | None):
+        return await ah.add_phone_number(self.http, api_version, token, self.waba_id, cc, local_number,
+                                         verified_name, proxy_str)
+
+    async def request_code(self, api_version: str, token: str, phone_id: str, code_method: str,
+                           language: str, proxy_str: str | None):
+        return await ah.request_code(self.http, api_version, token, phone_id, code_method, language, proxy_str)
+
+    async def verify_code(self, api_version: str, token: str, phone_id: str, code: str, proxy_str: str | None):
+        return await ah.verify_code(self.http, api_version, token, phone_id, code, proxy_str)
+
+    async def register_number(self, api_version: str, token: str, phone_id: str, proxy_str: str | None):
+        return await ah.register_number(self.http, api_version, token, phone_id, "123456", proxy_str,
+                                        waba_id=self.waba_id)
+
+async def process_one_waba_add_phone_async(app, http: ah.AsyncHttp, user_id: int, waba_id: str, job_id: int) -> bool:
+    """Same contract as waba_flow.process_one_waba_add_phone."""
+    # app context per task (contextvars): the Graph calls read current_app.config
+    with app.app_context():
+        return await add_phone_steps(AsyncFlowIO(app, http, user_id, str(waba_id).strip(), job_id))
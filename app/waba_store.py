@@ -0,0 +1,415 @@
+import os
+import json
+import time
+import base64
+from typing import Any, Callable, Dict, Iterable, Iterator
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models import User, WabaEntry
+from .json_store import load_user_bms, save_user_bms, bms_path
+
+# Per-WABA rows in the waba_entry table. Each entry keeps the exact bms.json
+# shape in `data`; writes touch a single row and are guarded by `version` so
+# concurrent jobs/sync never overwrite each other's changes.
+
+MAX_RETRIES = 8
+INDEX_VERSION = 1  # bump when _index_columns derives new columns; rows are re-indexed at startup
+
+def _index_columns(entry: Dict[str, Any]) -> Dict[str, Any]:
+    snap = entry.get("snapshot") if isinstance(entry.get("snapshot"), dict) else {}
+    counts = snap.get("template_counts") if isinstance(snap.get("template_counts"), dict) else {}
+    phone_number_id = str(entry.get("phone_number_id") or "").strip()
+    errors = [str(snap.get("last_error") or ""), str(entry.get("last_add_phone_error") or "")]
+    return {
+        "waba_id": str(entry.get("waba_id") or "").strip(),
+        "phone_number_id": phone_number_id,
+        "status_label": str(snap.get("status_label") or ""),
+        "last_sync_at": int(snap.get("last_sync_at") or 0),
+        "tpl_approved": int(counts.get("APPROVED") or 0),
+        "tpl_paused": int(counts.get("PAUSED") or 0),
+        "tpl_disabled": int(counts.get("DISABLED") or 0),
+        "has_phone": bool(phone_number_id or snap.get("phone_numbers")),
+        "error_text": " | ".join(e for e in errors if e)[:1000],
+        "index_version": INDEX_VERSION,
+    }
+
+def _dumps(entry: Dict[str, Any]) -> str:
+    return json.dumps(entry, ensure_ascii=False)
+
+def _find(user_id: int, waba_id: str) -> WabaEntry | None:
+    key = str(waba_id).strip()
+    row = WabaEntry.query.filter_by(user_id=user_id, waba_id=key).order_by(WabaEntry.id.asc()).first()
+    if row is None:
+        row = WabaEntry.query.filter_by(user_id=user_id, key=key).first()
+    return row
+
+def _new_row(user_id: int, key: str, entry: Dict[str, Any]) -> WabaEntry:
+    cols = _index_columns(entry)
+    cols["waba_id"] = cols["waba_id"] or key
+    return WabaEntry(user_id=user_id, key=key, data=_dumps(entry), version=0, **cols)
+
+def _cas(row_id: int, version: int, entry: Dict[str, Any]) -> bool:
+    cols = _index_columns(entry)
+    del cols["waba_id"]  # fixed at insert time
+    n = WabaEntry.query.filter_by(id=row_id, version=version).update(
+        {"data": _dumps(entry), "version": version + 1, **cols},
+        synchronize_session=False,
+    )
+    return n == 1
+
+def get_entry(user_id: int, waba_id: str) -> Dict[str, Any] | None:
+    row = _find(user_id, waba_id)
+    return json.loads(row.data) if row else None
+
+def load_user_wabas(user_id: int, waba_ids: Iterable[str] | None = None) -> Dict[str, Dict[str, Any]]:
+    """User's entries (all, or only `waba_ids`) in the bms.json shape (original key -> entry)."""
+    q = WabaEntry.query.filter_by(user_id=user_id)
+    if waba_ids is not None:
+        q = q.filter(WabaEntry.waba_id.in_([str(w).strip() for w in waba_ids]))
+    return {r.key: json.loads(r.data) for r in q.order_by(WabaEntry.id.asc()).all()}
+
+def has_wabas(user_id: int) -> bool:
+    return db.session.query(WabaEntry.query.filter_by(user_id=user_id).exists()).scalar()
+
+def mutate_entry(user_id: int, waba_id: str, fn: Callable[[Dict[str, Any]], None]) -> bool:
+    """Applies fn to the entry and commits; retried if another writer got there first."""
+    for _ in range(MAX_RETRIES):
+        row = _find(user_id, waba_id)
+        if row is None:
+            return False
+        entry = json.loads(row.data)
+        fn(entry)
+        ok = _cas(row.id, row.version, entry)
+        db.session.commit()
+        if ok:
+            return True
+        db.session.expire_all()
+    raise RuntimeError(f"waba_store: too much contention on {waba_id}")
+
+def update_entry(user_id: int, waba_id: str, patch: Dict[str, Any]) -> bool:
+    return mutate_entry(user_id, waba_id, lambda entry: entry.update(patch))
+
+def _apply_snapshot(entry: Dict[str, Any], fields: Dict[str, Any], now: int) -> None:
+    snap = entry.get("snapshot", {}) if isinstance(entry.get("snapshot"), dict) else {}
+    snap.update(fields)
+    if "last_sync_at" not in fields:
+        snap["last_sync_at"] = now
+    entry["snapshot"] = snap
+
+def update_snapshot(user_id: int, waba_id: str, **fields) -> None:
+    now = int(time.time())
+    mutate_entry(user_id, waba_id, lambda entry: _apply_snapshot(entry, fields, now))
+
+def _mutate_many(user_id: int, updates: Dict[str, Dict[str, Any]],
+                 apply: Callable[[Dict[str, Any], Dict[str, Any]], None]) -> None:
+    if not updates:
+        return
+    rows = WabaEntry.query.filter(
+        WabaEntry.user_id == user_id,
+        WabaEntry.waba_id.in_([str(w).strip() for w in updates]),
+    ).all()
+
+    lost = []
+    for row in rows:
+        fields = updates.get(row.waba_id)
+        if fields is None:
+            continue
+        entry = json.loads(row.data)
+        apply(entry, fields)
+        if not _cas(row.id, row.version, entry):
+            lost.append(row.waba_id)
+    db.session.commit()
+
+    # rows changed by someone else in between: redo them one by one
+    for waba_id in lost:
+        mutate_entry(user_id, waba_id, lambda entry, f=updates[waba_id]: apply(entry, f))
+
+def update_snapshots(user_id: int, updates: Dict[str, Dict[str, Any]]) -> None:
+    """Snapshot fields for many WABAs in one transaction."""
+    now = int(time.time())
+    _mutate_many(user_id, updates, lambda entry, fields: _apply_snapshot(entry, fields, now))
+
+def update_entries(user_id: int, updates: Dict[str, Dict[str, Any]]) -> None:
+    """update_entry for many WABAs in one transaction."""
+    _mutate_many(user_id, updates, lambda entry, fields: entry.update(fields))
+
+def _fill_defaults(entry: Dict[str, Any]) -> None:
+    entry.setdefault("phone_number_id", "")
+    entry.setdefault("templates", [])
+
+    snap = entry.get("snapshot", {}) if isinstance(entry.get("snapshot"), dict) else {}
+    snap.setdefault("waba_name", "")
+    snap.setdefault("phone_numbers", [])
+    snap.setdefault("template_counts", {"APPROVED": 0, "PAUSED": 0, "DISABLED": 0, "OTHER": 0})
+    snap.setdefault("last_sync_at", 0)
+    snap.setdefault("last_error", "")
+    entry["snapshot"] = snap
+
+def upsert_waba(user_id: int, waba_id: str, token: str) -> None:
+    key = str(waba_id).strip()
+    if not key:
+        return
+
+    def apply(entry):
+        entry["waba_id"] = key
+        entry["token"] = token
+        _fill_defaults(entry)
+
+    if mutate_entry(user_id, key, apply):
+        return
+
+    entry = {"waba_id": key, "token": token}
+    _fill_defaults(entry)
+    db.session.add(_new_row(user_id, key, entry))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # inserted concurrently by another request: update that row instead
+        db.session.rollback()
+        mutate_entry(user_id, key, apply)
+
+def _set_token(entry: Dict[str, Any], waba_id: str, token: str) -> None:
+    entry["waba_id"] = waba_id
+    entry["token"] = token
+    _fill_defaults(entry)
+
+def _free_key(user_id: int, key: str, waba_id: str, used: set, checked: set) -> str:
+    """First of key, waba_id, waba_id_2, ... not taken in this batch nor by an existing row."""
+    candidates = [key, waba_id] + [f"{waba_id}_{n}" for n in range(2, MAX_RETRIES + 2)]
+    for cand in candidates:
+        if not cand or cand in used:
+            continue
+        if cand not in checked:
+            checked.add(cand)
+            if WabaEntry.query.filter_by(user_id=user_id, key=cand).first() is not None:
+                used.add(cand)
+                continue
+        return cand
+    raise RuntimeError(f"waba_store: no free key for {waba_id}")
+
+def _upsert_entry(user_id: int, key: str, entry: Dict[str, Any]) -> str:
+    """bulk_upsert for one item, committed on its own. Returns "created"/"updated"."""
+    waba_id, token = entry["waba_id"], entry["token"]
+    for _ in range(MAX_RETRIES):
+        row = WabaEntry.query.filter_by(user_id=user_id, waba_id=waba_id).order_by(WabaEntry.id.asc()).first()
+        if row is not None:
+            data = json.loads(row.data)
+            _set_token(data, waba_id, token)
+            if _cas(row.id, row.version, data):
+                db.session.commit()
+                return "updated"
+            db.session.rollback()
+            continue
+        new = dict(entry)
+        _fill_defaults(new)
+        db.session.add(_new_row(user_id, _free_key(user_id, key, waba_id, set(), set()), new))
+        try:
+            db.session.commit()
+            return "created"
+        except IntegrityError:
+            db.session.rollback()  # created concurrently: update it on the next pass
+    raise RuntimeError(f"waba_store: too much contention on {waba_id}")
+
+def bulk_upsert(user_id: int, items: list[tuple[str, Dict[str, Any]]], chunk: int = 500) -> Dict[str, str]:
+    """
+    upsert_waba for many (key, entry) pairs in a single transaction. Existing
+    rows get the new token; new rows keep the uploaded entry (under its
+    original key when it is free). Returns waba_id -> "created"/"updated",
+    as committed.
+    """
+    result: Dict[str, str] = {}
+    lost = []
+    used_keys: set = set()
+    checked_keys: set = set()
+    try:
+        for i in range(0, len(items), chunk):
+            part = items[i:i + chunk]
+            ids = [e["waba_id"] for _, e in part]
+            keys = {k for k, _ in part if k} | set(ids)
+            rows = WabaEntry.query.filter(
+                WabaEntry.user_id == user_id,
+                WabaEntry.waba_id.in_(ids) | WabaEntry.key.in_(keys),
+            ).all()
+            # match on waba_id only: a row whose key equals an uploaded id is
+            # another WABA, and only blocks that key
+            by_waba = {r.waba_id: r for r in rows}
+            used_keys.update(r.key for r in rows)
+            checked_keys.update(keys)
+
+            for key, entry in part:
+                waba_id = entry["waba_id"]
+                row = by_waba.get(waba_id)
+                if row is not None:
+                    data = json.loads(row.data)
+                    _set_token(data, waba_id, entry["token"])
+                    if not _cas(row.id, row.version, data):
+                        lost.append((key, entry))
+                    result[waba_id] = "updated"
+                    continue
+                key = _free_key(user_id, key, waba_id, used_keys, checked_keys)
+                used_keys.add(key)
+                entry = dict(entry)
+                _fill_defaults(entry)
+                db.session.add(_new_row(user_id, key, entry))
+                result[waba_id] = "created"
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request created some of these rows: nothing above was
+        # committed, so redo every item on its own with its full entry
+        db.session.rollback()
+        return {entry["waba_id"]: _upsert_entry(user_id, key, entry) for key, entry in items}
+
+    for key, entry in lost:
+        result[entry["waba_id"]] = _upsert_entry(user_id, key, entry)
+    return result
+
+def import_entries(user_id: int, entries: Iterable[tuple[str, Dict[str, Any]]]) -> int:
+    """Inserts raw bms.json (key, entry) pairs in a single transaction. Used by the migration."""
+    n = 0
+    for key, entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        db.session.add(_new_row(user_id, str(key), entry))
+        n += 1
+    db.session.commit()
+    return n
+
+def migrate_user_bms(user_id: int) -> int:
+    """One-shot import of instance/users/<id>/bms.json if the user has no rows yet."""
+    if not os.path.exists(bms_path(user_id)) or db.session.get(User, user_id) is None:
+        return 0
+    if WabaEntry.query.filter_by(user_id=user_id).first() is not None:
+        return 0
+    return import_entries(user_id, load_user_bms(user_id).items())
+
+def migrate_all_users() -> int:
+    base = os.path.join(os.getcwd(), "instance", "users")
+    if not os.path.isdir(base):
+        return 0
+    total = 0
+    for name in os.listdir(base):
+        if name.isdigit():
+            total += migrate_user_bms(int(name))
+    return total
+
+def reindex_entries(batch: int = 500) -> int:
+    """Recomputes the indexed columns of rows written by an older INDEX_VERSION."""
+    total = 0
+    while True:
+        rows = WabaEntry.query.filter(WabaEntry.index_version < INDEX_VERSION).limit(batch).all()
+        if not rows:
+            return total
+        for row in rows:
+            cols = _index_columns(json.loads(row.data))
+            del cols["waba_id"]
+            for name, value in cols.items():
+                setattr(row, name, value)
+        db.session.commit()
+        total += len(rows)
+
+# --- dashboard listing ---
+
+SORT_COLUMNS = {
+    "last_sync_at": WabaEntry.last_sync_at,
+    "status": WabaEntry.status_label,
+    "approved": WabaEntry.tpl_approved,
+    "paused": WabaEntry.tpl_paused,
+    "disabled": WabaEntry.tpl_disabled,
+    "waba_id": WabaEntry.waba_id,
+}
+
+def _encode_cursor(value: Any, row_id: int) -> str:
+    raw = json.dumps([value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple[Any, int] | None:
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return value, int(row_id)
+    except Exception:
+        return None
+
+def filtered_entries(user_id: int, status: str = "", has_phone: bool | None = None, q: str = ""):
+    """Base query for the dashboard filters (all served by the user_id-prefixed indexes)."""
+    query = WabaEntry.query.filter(WabaEntry.user_id == user_id)
+    if status == "OK":
+        # the dashboard shows never-synced rows as OK too
+        query = query.filter(WabaEntry.status_label.in_(["OK", ""]))
+    elif status:
+        query = query.filter(WabaEntry.status_label == status)
+    if has_phone is not None:
+        query = query.filter(WabaEntry.has_phone.is_(has_phone))
+    if q:
+        like = f"%{q}%"
+        query = query.filter(WabaEntry.error_text.like(like) | WabaEntry.waba_id.like(like))
+    return query
+
+def page_entries(user_id: int, sort: str = "last_sync_at", desc: bool = True, cursor: str = "",
+                 limit: int = 50, **filters) -> tuple[list[tuple[str, Dict[str, Any]]], str | None]:
+    """
+    One page of (key, entry) in the requested order, keyset-paginated on
+    (sort column, id). Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    col = SORT_COLUMNS.get(sort, WabaEntry.last_sync_at)
+    query = filtered_entries(user_id, **filters)
+
+    after = _decode_cursor(cursor) if cursor else None
+    if after is not None:
+        value, row_id = after
+        if desc:
+            query = query.filter((col < value) | ((col == value) & (WabaEntry.id < row_id)))
+        else:
+            query = query.filter((col > value) | ((col == value) & (WabaEntry.id > row_id)))
+
+    order = (col.desc(), WabaEntry.id.desc()) if desc else (col.asc(), WabaEntry.id.asc())
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_cursor(getattr(last, col.key), last.id)
+    return [(r.key, json.loads(r.data)) for r in rows], next_cursor
+
+def iter_entries_by_waba_ids(user_id: int, waba_ids: Iterable[str],
+                             chunk: int = 500) -> Iterator[tuple[str, Dict[str, Any]]]:
+    """(key, entry) for `waba_ids` in the given order, looked up `chunk` ids at a time; unknown ids are skipped."""
+    ids = [str(w).strip() for w in waba_ids if str(w).strip()]
+    for i in range(0, len(ids), chunk):
+        part = ids[i:i + chunk]
+        found = {}
+        for waba_id, key, data in (
+            WabaEntry.query.with_entities(WabaEntry.waba_id, WabaEntry.key, WabaEntry.data)
+            .filter(WabaEntry.user_id == user_id, WabaEntry.waba_id.in_(part))
+            .order_by(WabaEntry.id.desc())  # first row wins, like _find
+        ):
+            found[waba_id] = (key, data)
+        for waba_id in part:
+            if waba_id in found:
+                key, data = found[waba_id]
+                yield key, json.loads(data)
+
+def iter_filtered_entries(user_id: int, chunk: int = 500, **filters) -> Iterator[tuple[str, Dict[str, Any]]]:
+    """(key, entry) matching the dashboard filters, in insertion order, `chunk` rows per query."""
+    last_id = 0
+    while True:
+        rows = (
+            filtered_entries(user_id, **filters)
+            .with_entities(WabaEntry.id, WabaEntry.key, WabaEntry.data)
+            .filter(WabaEntry.id > last_id)
+            .order_by(WabaEntry.id.asc())
+            .limit(chunk)
+            .all()
+        )
+        for _, key, data in rows:
+            yield key, json.loads(data)
+        if len(rows) < chunk:
+            return
+        last_id = rows[-1][0]
+
+def export_user_bms(user_id: int, write_file: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Store contents in the bms.json format; optionally written back to the user's bms.json."""
+    data = load_user_wabas(user_id)
+    if write_file:
+        save_user_bms(user_id, data)
+    return data
@@ -0,0 +1 @@
+"""Throughput benchmark harness (see bench/run.py)."""
@@ -0,0 +1,201 @@
+"""
+End-to-end throughput benchmark against local Graph/SMS24h stand-ins.
+
+Runs an add-phone job over N WABAs (real queue worker, flow, ledger and HTTP
+layer) and a /sync over M WABAs (real route), then reports WABAs/minute,
+p50/p95 time-to-registration and peak memory. Nothing leaves the machine and
+the database is a throwaway SQLite file.
+
+    python -m bench.run --wabas 200 --syncs 500
+    python -m bench.run --wabas 500 --engine async --otp-delay 10 --json bench.json
+
+App settings (JOB_CONCURRENCY, QUEUE_WORKERS, THROTTLE_*, GRAPH_CACHE_*, ...)
+are read from the environment as usual, so the same command compares configs.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+from .stubs import StubConfig, StubServer
+
+BENCH_PASSWORD = "bench"
+
+def _percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def _peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def _make_user(db, User, username: str, balance_cents: int):
+    u = User(username=username, is_admin=False, is_banned=False, balance_cents=balance_cents)
+    u.set_password(BENCH_PASSWORD)
+    db.session.add(u)
+    db.session.commit()
+    return u
+
+def _entries(prefix: str, n: int):
+    # one token per WABA, like WABAs spread over many BMs
+    return [(f"{prefix}{i}", {"waba_id": f"{prefix}{i}", "token": f"{prefix}-token-{i}", "phone_number_id": ""})
+            for i in range(n)]
+
+def bench_add_phone(app, n: int, timeout: float) -> dict:
+    from app import db
+    from app.models import User, Job, JobEvent
+    from app.waba_store import import_entries
+    from app.jobs import start_add_phone_job
+
+    with app.app_context():
+        cost = int(app.config["OTP_COST_CENTS"])
+        u = _make_user(db, User, "bench-add", cost * n)
+        import_entries(u.id, _entries("add", n))
+
+        started = datetime.utcnow()
+        t0 = time.monotonic()
+        with app.test_request_context():
+            job_id = start_add_phone_job(u.id, [f"add{i}" for i in range(n)])
+
+        job = None
+        while time.monotonic() - t0 < timeout:
+            db.session.expire_all()
+            job = db.session.get(Job, job_id)
+            if job.status not in ("queued", "running"):
+                break
+            time.sleep(0.2)
+        elapsed = time.monotonic() - t0
+
+        registered = (
+            JobEvent.query.with_entities(JobEvent.created_at)
+            .filter(JobEvent.job_id == job_id, JobEvent.step == "register", JobEvent.http_status == 200)
+            .all()
+        )
+        ttr = [(created - started).total_seconds() for (created,) in registered]
+        return {
+            "wabas": n,
+            "status": job.status if job else "unknown",
+            "registered": len(ttr),
+            "failed": job.failed if job else None,
+            "seconds": round(elapsed, 2),
+            "wabas_per_min": round(len(ttr) / elapsed * 60, 1) if elapsed else None,
+            "ttr_p50": _round(_percentile(ttr, 50)),
+            "ttr_p95": _round(_percentile(ttr, 95)),
+            "timed_out": elapsed >= timeout,
+        }
+
+def bench_sync(app, m: int) -> dict:
+    from app import db
+    from app.models import User
+    from app.waba_store import import_entries
+    from app.services import metrics
+
+    with app.app_context():
+        u = _make_user(db, User, "bench-sync", 0)
+        import_entries(u.id, _entries("sync", m))
+
+    client = app.test_client()
+    client.post("/login", data={"username": "bench-sync", "password": BENCH_PASSWORD})
+    before = _histogram_totals(metrics.SYNC_WABA_SECONDS)
+    t0 = time.monotonic()
+    r = client.post("/sync")
+    elapsed = time.monotonic() - t0
+    after = _histogram_totals(metrics.SYNC_WABA_SECONDS)
+
+    count = after[1] - before[1]
+    return {
+        "wabas": m,
+        "http_status": r.status_code,
+        "synced": count,
+        "seconds": round(elapsed, 2),
+        "wabas_per_min": round(count / elapsed * 60, 1) if elapsed else None,
+        "avg_per_waba": _round((after[0] - before[0]) / count) if count else None,
+    }
+
+def _histogram_totals(hist) -> tuple[float, int]:
+    with hist._lock:
+        return sum(v[-2] for v in hist._values.values()), sum(v[-1] for v in hist._values.values())
+
+def _round(v: float | None) -> float | None:
+    return round(v, 2) if v is not None else None
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__.strip().splitlines()[0])
+    p.add_argument("--wabas", type=int, default=100, help="WABAs in the add-phone job (0 = skip)")
+    p.add_argument("--syncs", type=int, default=200, help="WABAs synced through /sync (0 = skip)")
+    p.add_argument("--engine", choices=("threads", "async"), default=os.getenv("ADD_PHONE_ENGINE", "threads"))
+    p.add_argument("--latency-ms", type=float, default=50.0, help="mean stub latency per request")
+    p.add_argument("--jitter-ms", type=float, default=20.0)
+    p.add_argument("--graph-error-rate", type=float, default=0.0, help="share of Graph calls answered with HTTP 500")
+    p.add_argument("--sms-error-rate", type=float, default=0.0, help="share of getNumber answered with NO_NUMBERS")
+    p.add_argument("--otp-delay", type=float, default=5.0, help="seconds until the stub delivers the OTP")
+    p.add_argument("--otp-loss-rate", type=float, default=0.0, help="share of activations that never get an OTP")
+    p.add_argument("--templates", type=int, default=40, help="templates per WABA (paginated)")
+    p.add_argument("--timeout", type=float, default=600.0, help="give up on the add-phone job after this many seconds")
+    p.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = p.parse_args(argv)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    stubs = StubServer(StubConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        graph_error_rate=args.graph_error_rate, sms_error_rate=args.sms_error_rate,
+        otp_delay=args.otp_delay, otp_loss_rate=args.otp_loss_rate,
+        templates_per_waba=args.templates,
+    )).start()
+
+    # must be in place before the app (and its Config) is imported
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "META_GRAPH_BASE_URL": stubs.graph_url,
+        "SMS24H_BASE_URL": stubs.sms24h_url,
+        "ADD_PHONE_ENGINE": args.engine,
+        "SYNC_SCHEDULER_ENABLED": "0",
+        "PROXIES_RAW": "",  # stubs are on loopback
+    })
+    os.chdir(workdir)  # keeps instance/users lookups away from the real tree
+
+    from app import create_app
+    app = create_app()
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "add_phone": bench_add_phone(app, args.wabas, args.timeout) if args.wabas else None,
+        "sync": bench_sync(app, args.syncs) if args.syncs else None,
+        "stub_requests": stubs.state.requests,
+        "peak_rss_mb": _round(_peak_rss_mb()),
+    }
+    stubs.stop()
+
+    add, sync = report["add_phone"], report["sync"]
+    if add:
+        print(f"add-phone: {add['registered']}/{add['wabas']} registered in {add['seconds']}s "
+              f"({add['wabas_per_min']} WABAs/min) • time-to-registration p50 {add['ttr_p50']}s "
+              f"p95 {add['ttr_p95']}s • job {add['status']}{' (TIMEOUT)' if add['timed_out'] else ''}")
+    if sync:
+        print(f"sync: {sync['synced']}/{sync['wabas']} WABAs in {sync['seconds']}s "
+              f"({sync['wabas_per_min']} WABAs/min) • avg {sync['avg_per_waba']}s per WABA")
+    print(f"peak RSS: {report['peak_rss_mb']} MB • stub requests: {report['stub_requests']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
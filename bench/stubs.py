@@ -0,0 +1,194 @@
+import re
+import json
+import time
+import random
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# Local stand-ins for the Meta Graph API and the SMS24h handler_api, good
+# enough for the code paths the app uses: WABA node (plain and field-expanded),
+# multi-ID lookups (?ids=), paginated /phone_numbers and /message_templates,
+# add phone / request_code / verify_code / register, and getNumber /
+# getStatus / setStatus.
+#
+#   Graph:  http://127.0.0.1:<graph port>/graph/<version>/...
+#   SMS24h: http://127.0.0.1:<sms24h port>/sms24h/stubs/handler_api
+#
+# Each runs on its own port so the app tells them apart by host the way it
+# does in production (throttle buckets/breakers, metrics labels).
+
+TEMPLATE_STATUSES = ("APPROVED", "APPROVED", "APPROVED", "PAUSED", "REJECTED", "DISABLED")
+
+class StubConfig:
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 20.0,
+                 graph_error_rate: float = 0.0, sms_error_rate: float = 0.0,
+                 otp_delay: float = 5.0, otp_loss_rate: float = 0.0,
+                 templates_per_waba: int = 40, phones_per_waba: int = 1, seed: int = 1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.graph_error_rate = graph_error_rate   # HTTP 500 on any Graph call
+        self.sms_error_rate = sms_error_rate       # NO_NUMBERS on getNumber
+        self.otp_delay = otp_delay                 # seconds until the OTP shows up
+        self.otp_loss_rate = otp_loss_rate         # activations whose OTP never arrives
+        self.templates_per_waba = templates_per_waba
+        self.phones_per_waba = phones_per_waba
+        self.seed = seed
+
+class _State:
+    def __init__(self, cfg: StubConfig):
+        self.cfg = cfg
+        self.rng = random.Random(cfg.seed)
+        self.ids = itertools.count(1)
+        self.activations: dict[str, tuple[float, bool]] = {}  # id -> (bought_at, otp_arrives)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def chance(self, rate: float) -> bool:
+        with self.lock:
+            return rate > 0 and self.rng.random() < rate
+
+    def latency(self) -> float:
+        with self.lock:
+            self.requests += 1
+            jitter = self.rng.uniform(-self.cfg.jitter_ms, self.cfg.jitter_ms)
+        return max(0.0, self.cfg.latency_ms + jitter) / 1000.0
+
+def _page(base: str, path: str, items_fn, total: int, after: int, limit: int) -> dict:
+    page = {"data": [items_fn(i) for i in range(after, min(total, after + limit))]}
+    if after + limit < total:
+        page["paging"] = {"next": f"{base}{path}?limit={limit}&after={after + limit}"}
+    return page
+
+def _expansion_limit(fields: str, edge: str, default: int) -> int:
+    m = re.search(rf"{edge}\.limit\((\d+)\)", fields)
+    return int(m.group(1)) if m else default
+
+def _handler(state: _State):
+    cfg = state.cfg
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, body, ctype: str = "application/json"):
+            data = (json.dumps(body) if ctype == "application/json" else body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _base(self) -> str:
+            return f"http://{self.headers.get('Host')}"
+
+        def do_GET(self):
+            time.sleep(state.latency())
+            u = urlsplit(self.path)
+            q = {k: v[0] for k, v in parse_qs(u.query).items()}
+            if u.path.startswith("/sms24h/"):
+                return self._sms(q)
+            if u.path.startswith("/graph/"):
+                return self._graph_get(u.path, q)
+            self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            time.sleep(state.latency())
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            path = urlsplit(self.path).path
+            if not path.startswith("/graph/"):
+                return self._send(404, {"error": "not found"})
+            if state.chance(cfg.graph_error_rate):
+                return self._send(500, {"error": {"message": "stub: injected error", "code": 1}})
+            parts = path.split("/")  # "", "graph", version, node, edge
+            if len(parts) == 5 and parts[4] == "phone_numbers":
+                return self._send(200, {"id": f"ph{next(state.ids)}"})
+            self._send(200, {"success": True})
+
+        def _graph_get(self, path: str, q: dict):
+            if state.chance(cfg.graph_error_rate):
+                return self._send(500, {"error": {"message": "stub: injected error", "code": 1}})
+            parts = path.split("/")
+            waba_id = parts[3] if len(parts) > 3 else ""
+            if not waba_id and q.get("ids"):
+                return self._send(200, {w: {"id": w, "name": f"WABA {w}"} for w in q["ids"].split(",")})
+            phones = lambda i: {"id": f"{waba_id}-p{i}", "display_phone_number": f"+55 11 9{i:04d}-0000",
+                                "verified_name": f"WABA {waba_id}"}
+            templates = lambda i: {"status": TEMPLATE_STATUSES[i % len(TEMPLATE_STATUSES)], "id": f"{waba_id}-t{i}"}
+            base = self._base()
+            after = int(q.get("after", 0))
+            if len(parts) == 5 and parts[4] == "phone_numbers":
+                limit = int(q.get("limit", 100))
+                return self._send(200, _page(base, path, phones, cfg.phones_per_waba, after, limit))
+            if len(parts) == 5 and parts[4] == "message_templates":
+                limit = int(q.get("limit", 25))
+                return self._send(200, _page(base, path, templates, cfg.templates_per_waba, after, limit))
+            body = {"id": waba_id, "name": f"WABA {waba_id}"}
+            fields = q.get("fields", "")
+            if "phone_numbers" in fields:
+                limit = _expansion_limit(fields, "phone_numbers", 25)
+                body["phone_numbers"] = _page(base, f"{path}/phone_numbers", phones, cfg.phones_per_waba, 0, limit)
+            if "message_templates" in fields:
+                limit = _expansion_limit(fields, "message_templates", 25)
+                body["message_templates"] = _page(base, f"{path}/message_templates", templates,
+                                                  cfg.templates_per_waba, 0, limit)
+            self._send(200, body)
+
+        def _sms(self, q: dict):
+            action = q.get("action", "")
+            if action == "getNumber":
+                if state.chance(cfg.sms_error_rate):
+                    return self._send(200, "NO_NUMBERS", "text/plain")
+                n = next(state.ids)
+                with state.lock:
+                    state.activations[str(n)] = (time.monotonic(), state.rng.random() >= cfg.otp_loss_rate)
+                return self._send(200, f"ACCESS_NUMBER:{n}:5511{n:09d}", "text/plain")
+            if action == "getStatus":
+                with state.lock:
+                    bought, arrives = state.activations.get(q.get("id", ""), (0.0, False))
+                if bought and arrives and time.monotonic() - bought >= cfg.otp_delay:
+                    return self._send(200, "STATUS_OK:123-456", "text/plain")
+                return self._send(200, "STATUS_WAIT_CODE", "text/plain")
+            if action == "setStatus":
+                return self._send(200, "ACCESS_CANCEL", "text/plain")
+            self._send(200, "BAD_ACTION", "text/plain")
+
+    return Handler
+
+class StubServer:
+    """The two stand-ins on two threaded HTTP servers on 127.0.0.1 (random ports by default)."""
+
+    def __init__(self, cfg: StubConfig | None = None, graph_port: int = 0, sms24h_port: int = 0):
+        self.cfg = cfg or StubConfig()
+        self.state = _State(self.cfg)
+        self.servers = {}
+        for name, port in (("graph", graph_port), ("sms24h", sms24h_port)):
+            server = ThreadingHTTPServer(("127.0.0.1", port), _handler(self.state))
+            server.daemon_threads = True
+            self.servers[name] = server
+        self._threads = [threading.Thread(target=s.serve_forever, name=f"bench-stub-{name}", daemon=True)
+                         for name, s in self.servers.items()]
+
+    def _base(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.servers[name].server_port}"
+
+    @property
+    def graph_url(self) -> str:
+        return f"{self._base('graph')}/graph"
+
+    @property
+    def sms24h_url(self) -> str:
+        return f"{self._base('sms24h')}/sms24h/stubs/handler_api"
+
+    def start(self) -> "StubServer":
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self) -> None:
+        for s in self.servers.values():
+            s.shutdown()
+            s.server_close()
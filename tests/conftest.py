@@ -0,0 +1,39 @@
+import os
+import tempfile
+import pytest
+
+# Config reads the environment at import time: point it at a scratch database
+# and keep the background services out of the test process.
+_tmp = tempfile.mkdtemp(prefix="waba-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(_tmp, 'test.db')}",
+    "SYNC_SCHEDULER_ENABLED": "0",
+    "QUEUE_WORKER_ENABLED": "0",
+    "PROXIES_RAW": "",
+})
+os.chdir(_tmp)  # legacy bms.json migration looks under ./instance
+
+from app import create_app, db  # noqa: E402
+from app.models import User  # noqa: E402
+
+@pytest.fixture(scope="session")
+def app():
+    return create_app()
+
+@pytest.fixture
+def ctx(app):
+    """App context over an emptied database."""
+    with app.app_context():
+        yield
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+@pytest.fixture
+def user(ctx):
+    u = User(username="tester", is_admin=False, is_banned=False, balance_cents=1000)
+    u.set_password("x")
+    db.session.add(u)
+    db.session.commit()
+    return u.id
@@ -0,0 +1,67 @@
+import io
+import json
+from app import db, waba_store
+from app.models import WabaEntry
+from app.waba_store import bulk_upsert, import_entries, get_entry
+
+def _rows():
+    return sorted((r.key, r.waba_id) for r in WabaEntry.query.all())
+
+def test_creates_and_updates(user):
+    import_entries(user, [("w1", {"waba_id": "w1", "token": "old", "name": "keep"})])
+    result = bulk_upsert(user, [("w1", {"waba_id": "w1", "token": "new"}),
+                                ("w2", {"waba_id": "w2", "token": "t2", "name": "n2"})])
+    assert result == {"w1": "updated", "w2": "created"}
+    assert get_entry(user, "w1")["token"] == "new"
+    assert get_entry(user, "w1")["name"] == "keep"  # updates only touch the token
+    assert get_entry(user, "w2")["name"] == "n2"
+
+def test_new_rows_avoid_taken_keys(user):
+    # key K1 belongs to w1, and key "w3" belongs to another WABA
+    import_entries(user, [("K1", {"waba_id": "w1", "token": "t"}), ("w3", {"waba_id": "w9", "token": "t"})])
+    result = bulk_upsert(user, [("K1", {"waba_id": "w2", "token": "a"}),
+                                ("w3", {"waba_id": "w3", "token": "b"})])
+    assert result == {"w2": "created", "w3": "created"}
+    assert _rows() == [("K1", "w1"), ("w2", "w2"), ("w3", "w9"), ("w3_2", "w3")]
+    assert get_entry(user, "w9")["token"] == "t"
+
+def test_concurrent_insert_falls_back_per_item(user, monkeypatch):
+    new_row = waba_store._new_row
+
+    def racing(user_id, key, entry):
+        # another request creates w4 between our lookup and our commit
+        if entry["waba_id"] == "w4":
+            monkeypatch.setattr(waba_store, "_new_row", new_row)
+            with db.engine.begin() as conn:
+                conn.execute(WabaEntry.__table__.insert().values(
+                    user_id=user_id, key="w4", waba_id="w4", version=0,
+                    data=json.dumps({"waba_id": "w4", "token": "theirs"})))
+        return new_row(user_id, key, entry)
+
+    monkeypatch.setattr(waba_store, "_new_row", racing)
+    result = bulk_upsert(user, [("w4", {"waba_id": "w4", "token": "ours"}),
+                                ("w5", {"waba_id": "w5", "token": "t5", "name": "n5"})])
+    assert result == {"w4": "updated", "w5": "created"}
+    assert get_entry(user, "w4")["token"] == "ours"
+    assert get_entry(user, "w5")["name"] == "n5"  # full entry kept on the fallback path
+
+def _login(app):
+    client = app.test_client()
+    client.post("/login", data={"username": "tester", "password": "x"})
+    return client
+
+def test_import_route_reports_rows(app, user):
+    client = _login(app)
+    r = client.post("/wabas/import", data=b"waba_id,token\nz1,t\nz1,t\n,t\n", content_type="text/csv")
+    body = r.get_json()
+    assert r.status_code == 200
+    assert [row["status"] for row in body["rows"]] == ["created", "duplicate", "invalid"]
+    assert body["new_waba_ids"] == ["z1"]
+
+def test_import_route_caps_chunked_bodies(app, user, monkeypatch):
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 100)
+    client = _login(app)
+    payload = b"waba_id,token\n" + b"".join(f"x{i},tok\n".encode() for i in range(100))
+    r = client.post("/wabas/import", input_stream=io.BytesIO(payload), content_type="text/csv")  # no Content-Length
+    assert r.status_code == 413
+    assert WabaEntry.query.count() == 0
@@ -0,0 +1,112 @@
+from types import SimpleNamespace
+import pytest
+from app.services import meta
+from app.services.throttle import CircuitOpenError, token_fingerprint
+
+V = "v21.0"
+
+class FakeSession:
+    """Stands in for the pooled requests session: scripted answers, counted calls."""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = 0
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        self.calls += 1
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        status, body = self.answer
+        return SimpleNamespace(status_code=status, text=str(body), json=lambda: body)
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        return SimpleNamespace(status_code=200, text="{}", json=lambda: {"id": "p1"})
+
+@pytest.fixture
+def graph(ctx, monkeypatch):
+    meta.get_graph_cache().clear()
+    session = FakeSession((200, {"id": "w1", "name": "Acme"}))
+    monkeypatch.setattr(meta, "get_session", lambda proxy_str=None: session)
+    yield session
+    meta.get_graph_cache().clear()
+
+def test_local_refusal_is_not_cached(graph):
+    graph.answer = CircuitOpenError("circuit open for token")
+    info, err = meta.get_waba_info(V, "tok", "w1")
+    assert info is None and isinstance(err, meta.UnsentError)
+
+    graph.answer = (200, {"id": "w1", "name": "Acme"})
+    assert meta.get_waba_name(V, "tok", "w1") == ("Acme", None)
+    assert graph.calls == 2
+
+def test_graph_error_answer_is_cached(graph):
+    graph.answer = (400, {"error": {"code": 100}})
+    assert meta.get_waba_info(V, "tok", "w1")[1].startswith("HTTP 400")
+    assert meta.get_waba_info(V, "tok", "w1")[1].startswith("HTTP 400")
+    assert graph.calls == 1
+
+def _cache(**kwargs):
+    args = {"ttls": {"info": 10}, "error_ttl": 5, "max_entries": 100, "max_bytes": 10_000}
+    args.update(kwargs)
+    return meta.GraphCache(**args)
+
+def _key(waba_id, resource="info", token="tok"):
+    return meta.cache_key(V, token, waba_id, resource)
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(meta, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = _cache()
+    cache.put(_key("w1"), ({"name": "A"}, None), error=False)
+    cache.put(_key("w2"), (None, "HTTP 400"), error=True)
+    clock[0] += 6
+    assert cache.get(_key("w1")) == (True, ({"name": "A"}, None))
+    assert cache.get(_key("w2")) == (False, None)  # error_ttl is shorter
+    clock[0] += 5
+    assert cache.get(_key("w1")) == (False, None)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_resource_without_ttl_is_not_cached():
+    cache = _cache()
+    cache.put(_key("w1", "phones"), ([], None), error=False)
+    assert cache.get(_key("w1", "phones")) == (False, None)
+
+def test_lru_eviction_by_count_keeps_recently_used():
+    cache = _cache(max_entries=2)
+    cache.put(_key("w1"), ("a", None), error=False)
+    cache.put(_key("w2"), ("b", None), error=False)
+    cache.get(_key("w1"))  # w1 is now the most recent
+    cache.put(_key("w3"), ("c", None), error=False)
+    assert cache.get(_key("w2"))[0] is False
+    assert cache.get(_key("w1"))[0] and cache.get(_key("w3"))[0]
+
+def test_eviction_by_bytes():
+    cache = _cache(max_bytes=60)
+    big = ("x" * 40, None)
+    cache.put(_key("w1"), big, error=False)
+    cache.put(_key("w2"), big, error=False)
+    assert cache.get(_key("w1"))[0] is False
+    assert cache.get(_key("w2"))[0] is True
+
+def test_token_fingerprint_isolates_entries():
+    cache = _cache()
+    cache.put(_key("w1", token="tok-a"), ("a", None), error=False)
+    assert cache.get(_key("w1", token="tok-b")) == (False, None)
+    assert _key("w1", token="tok-a")[3] == token_fingerprint("tok-a")
+    assert "tok-a" not in _key("w1", token="tok-a")
+
+def test_phone_writes_invalidate_the_waba(graph):
+    meta.get_waba_info(V, "tok", "w1")
+    meta.get_waba_info(V, "tok", "w2")
+    meta.add_phone_number(V, "tok", "w1", "55", "11999990000", "Acme", None)
+    meta.get_waba_info(V, "tok", "w1")
+    meta.get_waba_info(V, "tok", "w2")
+    assert graph.calls == 3  # only w1 was fetched again
+
+    meta.register_number(V, "tok", "p1", "123456", None, waba_id="w2")
+    meta.get_waba_info(V, "tok", "w2")
+    assert graph.calls == 4
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+from app import db
+from app.models import Job, JobItem
+from app.job_queue import enqueue_job, lease_next, heartbeat, complete, recover
+
+def _lease(owner="w1", lease_seconds=60, job_limit=10, user_limit=10):
+    return lease_next(owner, lease_seconds, job_limit, user_limit)
+
+def test_lease_claims_items_in_order_once(user):
+    job_id = enqueue_job(user, "add_phone", ["a", "b"])
+    first, second = _lease("w1"), _lease("w2")
+    assert (first.waba_id, second.waba_id) == ("a", "b")
+    assert first.lease_owner == "w1" and first.attempts == 1
+    assert _lease("w3") is None
+    assert db.session.get(Job, job_id).status == "running"
+
+def test_lease_respects_job_limit(user):
+    enqueue_job(user, "add_phone", ["a", "b"])
+    assert _lease(job_limit=1) is not None
+    assert _lease(job_limit=1) is None
+
+def test_complete_finalizes_job(user):
+    job_id = enqueue_job(user, "add_phone", ["a", "b"])
+    a, b = _lease("w1"), _lease("w1")
+    assert not complete(a.id, "w1", True)
+    assert complete(b.id, "w1", False)
+    job = db.session.get(Job, job_id)
+    db.session.refresh(job)
+    assert (job.status, job.done, job.failed) == ("done_with_errors", 2, 1)
+
+def test_complete_ignores_lost_lease(user):
+    enqueue_job(user, "add_phone", ["a"])
+    item = _lease("w1")
+    assert not complete(item.id, "someone-else", True)
+    assert db.session.get(JobItem, item.id).status == "running"
+
+def test_heartbeat_extends_only_own_lease(user):
+    enqueue_job(user, "add_phone", ["a"])
+    item = _lease("w1", lease_seconds=1)
+    before = item.lease_expires_at
+    heartbeat("w2", [item.id], 600)
+    db.session.refresh(item)
+    assert item.lease_expires_at == before
+    heartbeat("w1", [item.id], 600)
+    db.session.refresh(item)
+    assert item.lease_expires_at > before
+
+def _expire(item_id):
+    JobItem.query.filter_by(id=item_id).update({"lease_expires_at": 1})
+    db.session.commit()
+
+def test_recover_requeues_then_abandons(user):
+    job_id = enqueue_job(user, "add_phone", ["a"])
+    abandoned = []
+
+    item = _lease("w1")
+    _expire(item.id)
+    assert recover(2, abandoned.append)["requeued"] == 1
+    assert db.session.get(JobItem, item.id).status == "queued"
+
+    item = _lease("w2")
+    assert item.attempts == 2
+    _expire(item.id)
+    counts = recover(2, abandoned.append)
+    assert counts["abandoned"] == 1 and counts["jobs_closed"] == 0
+    assert [i.waba_id for i in abandoned] == ["a"]
+    job = db.session.get(Job, job_id)
+    db.session.refresh(job)
+    assert (job.status, job.failed) == ("done_with_errors", 1)
+
+def test_recover_gives_itemless_jobs_a_grace_period(user):
+    fresh = Job(user_id=user, type="add_phone", status="queued", total=0, done=0, failed=0)
+    old = Job(user_id=user, type="add_phone", status="running", total=0, done=0, failed=0,
+              created_at=datetime.utcnow() - timedelta(seconds=600))
+    db.session.add_all([fresh, old])
+    db.session.commit()
+
+    assert recover(3, lambda item: None, grace_seconds=120)["jobs_closed"] == 1
+    assert (fresh.status, old.status) == ("queued", "error")
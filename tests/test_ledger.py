@@ -0,0 +1,54 @@
+from app import db
+from app.models import BalanceHold, BalanceTx, OtpDailyStat, JobItem
+from app.services import ledger
+from app.services.otp_stats import TX_KIND_OTP
+
+def test_debit_takes_balance_and_records_tx(user):
+    assert ledger.debit(user, 300, "OTP recebido", TX_KIND_OTP, "w1", "p1")
+    assert ledger.balance(user) == 700
+    tx = BalanceTx.query.one()
+    assert (tx.amount_cents, tx.kind, tx.waba_id) == (-300, TX_KIND_OTP, "w1")
+    assert OtpDailyStat.query.one().count == 1
+
+def test_debit_never_overdraws(user):
+    assert not ledger.debit(user, 1001, "x", "admin_remove")
+    assert ledger.balance(user) == 1000
+    assert BalanceTx.query.count() == 0
+
+def test_credit(user):
+    ledger.credit(user, 250, "Ajuste Admin", ledger.TX_KIND_ADMIN_ADD)
+    assert ledger.balance(user) == 1250
+
+def test_reserve_moves_money_out_until_released(user):
+    hold_id = ledger.reserve(user, 800, job_id=1, waba_id="w1")
+    assert hold_id
+    assert ledger.balance(user) == 200
+    assert ledger.reserve(user, 800) is None  # the hold already covers most of it
+
+    assert ledger.release(hold_id)
+    assert not ledger.release(hold_id)  # second release is a no-op
+    assert ledger.balance(user) == 1000
+    assert db.session.get(BalanceHold, hold_id).status == "released"
+
+def test_capture_turns_hold_into_debit_once(user):
+    hold_id = ledger.reserve(user, 800)
+    assert ledger.capture(hold_id, "OTP recebido", TX_KIND_OTP, "w1", "p1")
+    assert not ledger.capture(hold_id, "OTP recebido", TX_KIND_OTP)
+    assert not ledger.release(hold_id)  # captured money does not come back
+    assert ledger.balance(user) == 200
+    assert BalanceTx.query.one().amount_cents == -800
+
+def test_release_ignores_missing_hold(user):
+    assert not ledger.release(None)
+    assert not ledger.release(0)
+
+def test_release_stale_holds_skips_live_items(user):
+    live = ledger.reserve(user, 100, job_id=7, waba_id="busy")
+    stale = ledger.reserve(user, 100, job_id=7, waba_id="gone")
+    db.session.add(JobItem(job_id=7, user_id=user, waba_id="busy", status="running"))
+    db.session.commit()
+
+    assert ledger.release_stale_holds(0) == 1
+    assert db.session.get(BalanceHold, live).status == "held"
+    assert db.session.get(BalanceHold, stale).status == "released"
+    assert ledger.balance(user) == 900
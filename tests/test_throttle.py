@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+import pytest
+from app.config import Config
+from app.services.throttle import (
+    Throttle, TokenBucket, CircuitBreaker, CircuitOpenError, RateLimitedError, token_fingerprint,
+)
+
+SMS24H = "http://sms.test/stubs/handler_api.php"
+GRAPH = "http://graph.test/v21.0/123/phone_numbers"
+
+class Cfg(Config):
+    THROTTLE_ENABLED = True
+    THROTTLE_MAX_WAIT = 0
+    SMS24H_BASE_URL = SMS24H
+    SMS24H_RATE_PER_SEC = 0.001
+    SMS24H_BURST = 1
+    BREAKER_FAILURES = 2
+    BREAKER_COOLDOWN = 60
+    BREAKER_MAX_COOLDOWN = 600
+
+def _resp(status=200, text="", headers=None):
+    return SimpleNamespace(status_code=status, text=text, headers=headers or {})
+
+def _graph(throttle, token):
+    return throttle.before(GRAPH, {"Authorization": f"Bearer {token}"}, None, "")
+
+def test_bucket_burst_then_empty():
+    b = TokenBucket(rate_per_sec=0.001, capacity=2)
+    assert b.try_take() == 0 and b.try_take() == 0
+    assert b.try_take() > 0
+    assert not b.acquire(0)
+
+def test_bucket_take_up_to_and_put_back():
+    b = TokenBucket(rate_per_sec=0.001, capacity=5)
+    assert b.take_up_to(3) == 3
+    assert b.take_up_to(10) == 2
+    b.put_back(2)
+    assert b.take_up_to(10) == 2
+
+def test_breaker_opens_after_failures_and_half_opens():
+    br = CircuitBreaker(failures=2, cooldown=0, max_cooldown=10)
+    br.failure("x")
+    assert br.allow()[0]
+    br.failure("x")
+    ok, _, trial = br.allow()  # cooldown 0: straight to half-open
+    assert ok and trial
+    assert not br.allow()[0]  # only one trial at a time
+    br.success()
+    assert br.allow() == (True, 0.0, False)
+
+def test_breaker_pause():
+    br = CircuitBreaker(failures=5, cooldown=1, max_cooldown=10)
+    br.pause(30, "Retry-After")
+    ok, retry_in, _ = br.allow()
+    assert not ok and retry_in > 25
+    assert br.is_open()
+
+def test_sms24h_bucket_limits_purchases():
+    t = Throttle(Cfg)
+    t.before(SMS24H, None, {"action": "getNumber"}, "")
+    with pytest.raises(RateLimitedError):
+        t.before(SMS24H, None, {"action": "getNumber"}, "")
+
+def test_refund_uses_own_bucket_and_skips_breakers():
+    t = Throttle(Cfg)
+    buy = t.before(SMS24H, None, {"action": "getNumber"}, "")
+    for _ in range(Cfg.BREAKER_FAILURES):
+        t.after_response(buy, _resp(200, "ERROR_SQL"))
+    with pytest.raises(CircuitOpenError):
+        t.check(SMS24H, None, {"action": "getNumber"}, "")
+
+    cancel = t.before(SMS24H, None, {"action": "setStatus", "status": "8"}, "")
+    assert cancel.refund
+    assert [label for label, _ in t.buckets(cancel)] == ["sms24h_refund"]
+    assert t.max_wait_for(cancel) == float("inf")
+
+def test_graph_breaker_is_per_token():
+    t = Throttle(Cfg)
+    for _ in range(Cfg.BREAKER_FAILURES):
+        t.after_response(_graph(t, "tok-a"), _resp(500))
+    with pytest.raises(CircuitOpenError):
+        _graph(t, "tok-a")
+    _graph(t, "tok-b")  # same host, other token: still allowed
+
+    keys = {b["key"] for b in t.open_breakers()}
+    assert f"graph:graph.test:{token_fingerprint('tok-a')}" in keys
+
+def test_graph_plain_400_is_not_a_failure():
+    t = Throttle(Cfg)
+    for _ in range(Cfg.BREAKER_FAILURES + 1):
+        t.after_response(_graph(t, "tok"), _resp(400, '{"error": {"code": 100}}'))
+    _graph(t, "tok")
+
+def test_retry_after_pauses_breaker():
+    t = Throttle(Cfg)
+    t.after_response(_graph(t, "tok"), _resp(429, "", {"Retry-After": "120"}))
+    with pytest.raises(CircuitOpenError):
+        _graph(t, "tok")
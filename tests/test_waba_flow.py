@@ -0,0 +1,117 @@
+from types import SimpleNamespace
+import requests
+from app import db
+from app.models import BalanceHold, User
+from app.job_queue import enqueue_job
+from app.services import ledger
+from app.services.waba_flow import FlowIO, add_phone_steps, run_blocking
+from app.waba_store import import_entries, update_entry, get_entry
+
+def _resp(status=200, body=None):
+    return SimpleNamespace(status_code=status, text=str(body or {}), json=lambda: body or {})
+
+class FakeIO(FlowIO):
+    """FlowIO with scripted upstream answers; database work is real."""
+
+    def __init__(self, app, user_id, waba_id, job_id, otp="STATUS_OK:123456"):
+        super().__init__(app, user_id, waba_id, job_id)
+        self.otp = otp
+        self.calls = []
+
+    async def get_waba_name(self, api_version, token):
+        self.calls.append("get_waba_name")
+        return "Acme", None
+
+    async def get_number(self, number_pool, service, country, operator, cc, proxy_str):
+        self.calls.append("get_number")
+        return f"act{self.calls.count('get_number')}", cc + "11999990000"
+
+    async def sms24h_cancel(self, activation_id, proxy_str):
+        self.calls.append(f"cancel:{activation_id}")
+
+    async def wait_otp(self, activation_id, proxy_str, timeout):
+        self.calls.append(f"wait:{activation_id}")
+        return self.otp
+
+    async def add_phone_number(self, api_version, token, cc, local_number, verified_name, proxy_str):
+        self.calls.append("add_phone_number")
+        return _resp(200, {"id": "phone1"})
+
+    async def request_code(self, api_version, token, phone_id, code_method, language, proxy_str):
+        return _resp()
+
+    async def verify_code(self, api_version, token, phone_id, code, proxy_str):
+        return _resp()
+
+    async def register_number(self, api_version, token, phone_id, proxy_str):
+        return _resp()
+
+def _setup(app, user, balance_cents):
+    db.session.get(User, user).balance_cents = balance_cents
+    db.session.commit()
+    import_entries(user, [("w1", {"waba_id": "w1", "token": "tok"})])
+    return enqueue_job(user, "add_phone", ["w1"])
+
+def test_resume_with_all_funds_held(app, user):
+    cost = int(app.config["OTP_COST_CENTS"])
+    job_id = _setup(app, user, cost)
+    # a crashed run bought a number and holds the user's whole balance for it
+    hold_id = ledger.reserve(user, cost, job_id, "w1")
+    update_entry(user, "w1", {"pending_phone_number_id": "phone0", "sms24h_activation_id": "act0",
+                              "balance_hold_id": hold_id})
+    assert ledger.balance(user) == 0
+
+    io = FakeIO(app, user, "w1", job_id)
+    assert run_blocking(add_phone_steps(io)) is True
+    assert io.calls == ["wait:act0"]
+    assert db.session.get(BalanceHold, hold_id).status == "captured"
+    entry = get_entry(user, "w1")
+    assert entry["phone_number_id"] == "phone0" and entry["sms24h_activation_id"] == ""
+
+def test_resume_without_otp_cancels_then_buys_with_released_hold(app, user, monkeypatch):
+    cost = int(app.config["OTP_COST_CENTS"])
+    job_id = _setup(app, user, cost)
+    hold_id = ledger.reserve(user, cost, job_id, "w1")
+    update_entry(user, "w1", {"pending_phone_number_id": "phone0", "sms24h_activation_id": "act0",
+                              "balance_hold_id": hold_id})
+
+    io = FakeIO(app, user, "w1", job_id, otp="")
+    monkeypatch.setitem(app.config, "MAX_TENTATIVAS_POR_WABA", 1)
+    assert run_blocking(add_phone_steps(io)) is False
+    assert io.calls[:3] == ["wait:act0", "cancel:act0", "get_waba_name"]
+    assert "get_number" in io.calls  # the released hold paid for a new attempt
+    assert ledger.balance(user) == cost
+
+class TimeoutOnAdd(FakeIO):
+    async def add_phone_number(self, api_version, token, cc, local_number, verified_name, proxy_str):
+        self.calls.append("add_phone_number")
+        raise requests.ReadTimeout("read timed out")
+
+def test_exception_after_purchase_cancels_the_number(app, user):
+    job_id = _setup(app, user, 1000)
+    io = TimeoutOnAdd(app, user, "w1", job_id)
+    assert run_blocking(add_phone_steps(io)) is False
+    assert io.calls[-2:] == ["add_phone_number", "cancel:act1"]
+    assert BalanceHold.query.one().status == "released"
+    assert ledger.balance(user) == 1000
+    entry = get_entry(user, "w1")
+    assert entry["sms24h_activation_id"] == "" and "ReadTimeout" in entry["last_add_phone_error"]
+
+class FailingRefund(FakeIO):
+    async def add_phone_number(self, api_version, token, cc, local_number, verified_name, proxy_str):
+        self.calls.append("add_phone_number")
+        return _resp(400, {"error": {"message": "bad number"}})
+
+    async def sms24h_cancel(self, activation_id, proxy_str):
+        self.calls.append(f"cancel:{activation_id}")
+        raise requests.ConnectionError("connection reset")
+
+def test_failed_refund_call_moves_on_to_next_attempt(app, user, monkeypatch):
+    monkeypatch.setitem(app.config, "MAX_TENTATIVAS_POR_WABA", 2)
+    job_id = _setup(app, user, 1000)
+    io = FailingRefund(app, user, "w1", job_id)
+    assert run_blocking(add_phone_steps(io)) is False
+    assert [c for c in io.calls if c.startswith("cancel:")] == ["cancel:act1", "cancel:act2"]
+    assert [h.status for h in BalanceHold.query.all()] == ["released", "released"]
+    assert ledger.balance(user) == 1000
+    assert get_entry(user, "w1")["last_add_phone_error"] == "Falha após tentativas máximas"
@@ -0,0 +1,87 @@
+import json
+from app import db, waba_store
+from app.models import WabaEntry
+from app.json_store import save_user_bms
+from app.waba_store import (
+    import_entries, get_entry, mutate_entry, update_entries, page_entries,
+    migrate_user_bms, migrate_all_users,
+)
+
+def _concurrent_write(user_id, waba_id, **fields):
+    """Another writer commits a change to the row from its own connection."""
+    table = WabaEntry.__table__
+    where = (table.c.user_id == user_id) & (table.c.waba_id == waba_id)
+    with db.engine.begin() as conn:
+        data = json.loads(conn.execute(table.select().where(where)).one().data)
+        data.update(fields)
+        conn.execute(table.update().where(where).values(data=json.dumps(data), version=table.c.version + 1))
+
+def test_mutate_entry_retries_on_cas_conflict(user):
+    import_entries(user, [("w1", {"waba_id": "w1", "token": "t"})])
+    calls = []
+
+    def fn(entry):
+        calls.append(dict(entry))
+        if len(calls) == 1:
+            _concurrent_write(user, "w1", name="theirs")
+        entry["note"] = "ours"
+
+    assert mutate_entry(user, "w1", fn)
+    assert len(calls) == 2 and calls[1]["name"] == "theirs"
+    entry = get_entry(user, "w1")
+    assert (entry["name"], entry["note"]) == ("theirs", "ours")
+    assert WabaEntry.query.one().version == 2
+
+def test_update_entries_redoes_lost_rows(user, monkeypatch):
+    import_entries(user, [("w1", {"waba_id": "w1", "token": "t"}), ("w2", {"waba_id": "w2", "token": "t"})])
+    cas = waba_store._cas
+    raced = []
+
+    def racing_cas(row_id, version, entry):
+        # before our first write: the other writer commits a change to w1
+        if not raced:
+            raced.append(row_id)
+            _concurrent_write(user, "w1", name="theirs")
+        return cas(row_id, version, entry)
+
+    monkeypatch.setattr(waba_store, "_cas", racing_cas)
+    update_entries(user, {"w1": {"note": "a"}, "w2": {"note": "b"}})
+    assert raced
+    assert (get_entry(user, "w1")["name"], get_entry(user, "w1")["note"]) == ("theirs", "a")
+    assert get_entry(user, "w2")["note"] == "b"
+
+def _all_pages(user, **kwargs):
+    seen, cursor = [], ""
+    while True:
+        items, cursor = page_entries(user, cursor=cursor, limit=2, **kwargs)
+        seen.extend(entry["waba_id"] for _, entry in items)
+        if cursor is None:
+            return seen
+
+def test_cursor_pages_cover_ties_exactly_once(user):
+    sync_times = [5, 5, 5, 3, 3, 0, 0]  # runs of equal sort values across page boundaries
+    import_entries(user, [(f"w{i}", {"waba_id": f"w{i}", "token": "t", "snapshot": {"last_sync_at": ts}})
+                          for i, ts in enumerate(sync_times)])
+
+    desc = _all_pages(user, sort="last_sync_at", desc=True)
+    assert desc == ["w2", "w1", "w0", "w4", "w3", "w6", "w5"]  # value desc, then id desc
+    asc = _all_pages(user, sort="last_sync_at", desc=False)
+    assert asc == list(reversed(desc))
+
+def test_bad_cursor_restarts_from_first_page(user):
+    import_entries(user, [("w1", {"waba_id": "w1", "token": "t"})])
+    items, cursor = page_entries(user, cursor="not-a-cursor")
+    assert [k for k, _ in items] == ["w1"] and cursor is None
+
+def test_legacy_bms_json_is_migrated_once(user, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    save_user_bms(user, {"BM 1": {"waba_id": "w1", "token": "t1"}, "w2": {"token": "t2"}, "junk": "x"})
+
+    assert migrate_all_users() == 2
+    assert get_entry(user, "w1")["token"] == "t1"
+    assert get_entry(user, "w2")["token"] == "t2"  # key stands in for a missing waba_id
+    assert WabaEntry.query.filter_by(waba_id="w1").one().key == "BM 1"
+
+    save_user_bms(user, {"w3": {"waba_id": "w3", "token": "t3"}})
+    assert migrate_user_bms(user) == 0  # rows exist: the file is not read again
+    assert get_entry(user, "w3") is None
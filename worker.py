@@ -0,0 +1,53 @@
+"""
+Standalone job worker: leases queued add-phone items from the database and runs
+them, without serving HTTP. Run as many copies as needed, on one machine or
+several sharing the same database; items are claimed with a conditional UPDATE
+so each one runs in exactly one process, and items of a worker that dies are
+picked up by the others once its lease expires.
+
+    QUEUE_WORKER_ENABLED=0 gunicorn -w 4 run:app     # web: enqueue + status only
+    python worker.py --workers 20                     # one or more of these
+
+SIGTERM / SIGINT stop leasing, wait up to --drain seconds for the items in
+flight, flush the event log and exit.
+"""
+import sys
+import signal
+import logging
+import argparse
+import threading
+
+from app import create_app
+from app.jobs import start_queue_worker
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(prog="python worker.py", description=__doc__.strip().splitlines()[0])
+    p.add_argument("--workers", type=int, default=None,
+                   help="items run in parallel by this process (default: QUEUE_WORKERS / ASYNC_MAX_IN_FLIGHT)")
+    p.add_argument("--drain", type=float, default=60.0, help="seconds to wait for in-flight items on shutdown")
+    p.add_argument("--sync-scheduler", action="store_true",
+                   help="also run the periodic WABA sync here (processes share it through a DB lease)")
+    args = p.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    app = create_app()
+    if args.sync_scheduler:
+        from app.services.sync_scheduler import start_sync_scheduler
+        start_sync_scheduler(app)
+    worker = start_queue_worker(app, args.workers)
+    app.logger.info("worker %s running %d items at a time", worker.owner, worker.workers)
+
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    while not stop.wait(1.0):
+        pass
+
+    app.logger.info("worker %s stopping, draining in-flight items", worker.owner)
+    left = worker.stop(args.drain)
+    if left:
+        app.logger.warning("worker %s exiting with %d items in flight; their leases will expire", worker.owner, left)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())